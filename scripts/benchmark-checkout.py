@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark checkout throughput against a running order-service.
+
+Posts orders with 1, 10 and 50 course carts (configurable) and reports
+orders/sec plus p50/p95/p99 latency for each cart size.
+
+    python scripts/benchmark-checkout.py --url http://localhost:8003 --requests 500 --concurrency 20
+
+With --payment-url each checkout also pays: it initiates a payment for the
+order on payment-service and polls GET /payments/verify until the payment
+settles, so latency covers the whole checkout. Run payment-service with
+PAYMENT_GATEWAY_ROUTES=paystack=simulator (see payment_simulator.py) to
+benchmark offline; the paid column counts completed payments.
+
+Unless --token is given, the benchmark logs in to auth-service with
+--email/--password to obtain one (tokens are RS256 signed there).
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+
+
+async def login(client, auth_url, email, password):
+    response = await client.post(f"{auth_url}/login", json={"email": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def build_cart(size, offset):
+    return {
+        "items": [
+            {"course_id": offset + i, "title": f"Benchmark Course {offset + i}", "price": 15000.0}
+            for i in range(size)
+        ],
+        "notes": "benchmark"
+    }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def pay(client, payment_url, headers, order, payment_method, poll_interval, settle_timeout):
+    """Initiate a payment for the order and poll until it settles; returns its final status"""
+    response = await client.post(f"{payment_url}/payments/initiate", headers=headers, json={
+        "order_id": order["id"],
+        "amount": order["final_amount"],
+        "payment_method": payment_method,
+        "callback_url": "https://example.invalid/checkout/callback"
+    })
+    response.raise_for_status()
+    payment_id = response.json()["payment_id"]
+
+    deadline = time.perf_counter() + settle_timeout
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(poll_interval)
+        response = await client.get(f"{payment_url}/payments/verify/{payment_id}", headers=headers)
+        response.raise_for_status()
+        payment_status = response.json()["status"]
+        if payment_status not in ("pending", "processing"):
+            return payment_status
+    return "timeout"
+
+
+async def run_cart_size(client, url, headers, cart_size, total_requests, concurrency, payment=None):
+    latencies = []
+    errors = 0
+    paid = 0
+    queue = asyncio.Queue()
+    for n in range(total_requests):
+        queue.put_nowait(n)
+
+    async def worker():
+        nonlocal errors, paid
+        while True:
+            try:
+                n = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            payload = build_cart(cart_size, n * cart_size)
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"{url}/orders", json=payload, headers=headers)
+                if response.status_code != 201:
+                    errors += 1
+                elif payment:
+                    if await pay(client, headers=headers, order=response.json(), **payment) == "completed":
+                        paid += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "cart_size": cart_size,
+        "requests": total_requests,
+        "errors": errors,
+        "paid": paid,
+        "throughput": total_requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Order-service checkout benchmark")
+    parser.add_argument("--url", default=os.getenv("ORDER_SERVICE_URL", "http://localhost:8003"))
+    parser.add_argument("--token", default=os.getenv("BENCHMARK_TOKEN"))
+    parser.add_argument("--auth-url", default=os.getenv("AUTH_SERVICE_URL", "http://localhost:8001"))
+    parser.add_argument("--email", default=os.getenv("BENCHMARK_EMAIL"))
+    parser.add_argument("--password", default=os.getenv("BENCHMARK_PASSWORD"))
+    parser.add_argument("--cart-sizes", default="1,10,50")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--payment-url", default=os.getenv("PAYMENT_SERVICE_URL"), help="Also pay each order on payment-service")
+    parser.add_argument("--payment-method", default="paystack")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between verify polls")
+    parser.add_argument("--settle-timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    if not args.token and not (args.email and args.password):
+        parser.error("pass --token, or --email and --password to log in")
+    cart_sizes = [int(size) for size in args.cart_sizes.split(",")]
+    payment = None
+    if args.payment_url:
+        payment = {
+            "payment_url": args.payment_url,
+            "payment_method": args.payment_method,
+            "poll_interval": args.poll_interval,
+            "settle_timeout": args.settle_timeout
+        }
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        token = args.token or await login(client, args.auth_url, args.email, args.password)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        if args.warmup:
+            await run_cart_size(client, args.url, headers, 1, args.warmup, args.concurrency, payment)
+
+        print(f"{'cart':>5} {'requests':>9} {'errors':>7} {'paid':>6} {'orders/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for cart_size in cart_sizes:
+            result = await run_cart_size(client, args.url, headers, cart_size, args.requests, args.concurrency, payment)
+            print(
+                f"{result['cart_size']:>5} {result['requests']:>9} {result['errors']:>7} {result['paid']:>6} "
+                f"{result['throughput']:>10.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
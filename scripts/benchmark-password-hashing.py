@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark password hash settings for auth-service.
+
+For each bcrypt cost (and optional argon2 parameter sets) reports the
+single-core verify latency and the verifies/sec sustained with one worker
+per available core, then recommends the highest bcrypt cost that stays
+under the target verify latency. Run it inside an auth-service pod, or
+pass --cpus, so the numbers reflect the pod's CPU limit.
+
+    python scripts/benchmark-password-hashing.py --rounds 10,11,12,13 --target-ms 250
+    python scripts/benchmark-password-hashing.py --argon2 2:19456:1,3:65536:1
+
+argon2 settings are time_cost:memory_cost_kib:parallelism and need
+argon2-cffi installed.
+"""
+
+import argparse
+import math
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+PASSWORD = "benchmark-password-123"
+
+
+def cpu_limit():
+    """CPU limit from cgroup v2/v1, falling back to the host core count"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+            if quota != "max":
+                return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return float(os.cpu_count() or 1)
+
+
+def build_context(setting):
+    scheme, params = setting
+    if scheme == "bcrypt":
+        return CryptContext(schemes=["bcrypt"], bcrypt__rounds=params["rounds"])
+    return CryptContext(
+        schemes=["argon2"],
+        argon2__time_cost=params["time_cost"],
+        argon2__memory_cost=params["memory_cost"],
+        argon2__parallelism=params["parallelism"]
+    )
+
+
+def label(setting):
+    scheme, params = setting
+    if scheme == "bcrypt":
+        return f"bcrypt rounds={params['rounds']}"
+    return f"argon2 t={params['time_cost']} m={params['memory_cost']} p={params['parallelism']}"
+
+
+def verify_loop(setting, hashed, seconds):
+    """Verify repeatedly for `seconds`; returns the number of verifies"""
+    context = build_context(setting)
+    deadline = time.perf_counter() + seconds
+    count = 0
+    while time.perf_counter() < deadline:
+        context.verify(PASSWORD, hashed)
+        count += 1
+    return count
+
+
+def measure_latency(setting, hashed, samples):
+    context = build_context(setting)
+    latencies = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.verify(PASSWORD, hashed)
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies) * 1000
+
+
+def measure_throughput(setting, hashed, workers, seconds):
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Warm the workers so process start-up is not timed
+        list(pool.map(verify_loop, [setting] * workers, [hashed] * workers, [0.01] * workers))
+        started = time.perf_counter()
+        counts = list(pool.map(verify_loop, [setting] * workers, [hashed] * workers, [seconds] * workers))
+        elapsed = time.perf_counter() - started
+    return sum(counts) / elapsed
+
+
+def parse_settings(args):
+    settings = [("bcrypt", {"rounds": int(rounds)}) for rounds in args.rounds.split(",") if rounds]
+    for spec in filter(None, (args.argon2 or "").split(",")):
+        time_cost, memory_cost, parallelism = (int(part) for part in spec.split(":"))
+        settings.append(("argon2", {"time_cost": time_cost, "memory_cost": memory_cost, "parallelism": parallelism}))
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Password hashing cost benchmark")
+    parser.add_argument("--rounds", default="10,11,12,13")
+    parser.add_argument("--argon2", default="")
+    parser.add_argument("--cpus", type=float, default=None, help="CPU limit to report against (default: cgroup limit)")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Throughput run length per setting")
+    parser.add_argument("--samples", type=int, default=5, help="Single-core latency samples per setting")
+    parser.add_argument("--target-ms", type=float, default=250.0)
+    args = parser.parse_args()
+
+    cpus = args.cpus or cpu_limit()
+    workers = max(1, math.ceil(cpus))
+    print(f"CPU limit {cpus:g} cores, {workers} worker process(es), target verify {args.target_ms:g} ms\n")
+
+    print(f"{'setting':<32} {'verify ms':>10} {'/s/core':>9} {'/s at limit':>12}")
+    recommended = None
+    for setting in parse_settings(args):
+        hashed = build_context(setting).hash(PASSWORD)
+        latency_ms = measure_latency(setting, hashed, args.samples)
+        throughput = measure_throughput(setting, hashed, workers, args.seconds)
+        print(f"{label(setting):<32} {latency_ms:>10.1f} {throughput / cpus:>9.1f} {throughput:>12.1f}")
+        if setting[0] == "bcrypt" and latency_ms <= args.target_ms:
+            if recommended is None or setting[1]["rounds"] > recommended:
+                recommended = setting[1]["rounds"]
+
+    print()
+    if recommended is None:
+        print(f"No bcrypt cost tested verifies within {args.target_ms:g} ms; try lower --rounds")
+    else:
+        print(f"Recommended: BCRYPT_ROUNDS={recommended}")
+
+
+if __name__ == "__main__":
+    main()
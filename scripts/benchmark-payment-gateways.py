@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Benchmark payment gateway calls against the stub provider.
+
+Starts scripts/stub-payment-provider.py, then runs the same mix of
+Paystack initialize and verify calls in two ways: a new AsyncClient per
+call (how payment_gateways.py used to work) and the shared gateway
+singleton. Reports throughput and latency for each. --tls serves the stub
+over HTTPS with a throwaway self-signed certificate, so the per-call runs
+pay for a TLS handshake each time, as they do against real providers.
+
+    python scripts/benchmark-payment-gateways.py --calls 2000 --concurrency 50 --tls
+"""
+
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_self_signed_cert(directory):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    certfile, keyfile = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(certfile, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return certfile, keyfile
+
+
+def wait_for_stub(url, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{url}/docs", verify=False, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"Stub provider did not start at {url}")
+
+
+async def run_calls(call, calls, concurrency):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call(i)
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    elapsed = time.perf_counter() - started
+    return calls / elapsed, latencies, errors
+
+
+def report(label, throughput, latencies, errors):
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000 if latencies else float("nan")
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else float("nan")
+    print(f"{label:<28} {throughput:>10.1f} {p50:>9.1f} {p99:>9.1f} {errors:>7}")
+
+
+async def benchmark(base_url, calls, concurrency):
+    from payment_gateways import PaystackGateway, close_payment_gateways, get_payment_gateway
+
+    async def per_call_client(i):
+        # The old behaviour: a fresh client, connection and handshake per call
+        async with httpx.AsyncClient(base_url=base_url, headers={"Authorization": "Bearer sk_test_stub"}) as client:
+            if i % 2:
+                await client.get(f"/transaction/verify/REF-{i}")
+            else:
+                await client.post("/transaction/initialize", json={"email": "a@b.c", "amount": 1000, "reference": f"REF-{i}"})
+
+    gateway: PaystackGateway = get_payment_gateway("paystack")
+
+    async def shared_gateway(i):
+        if i % 2:
+            await gateway.verify_transaction(f"REF-{i}")
+        else:
+            await gateway.initialize_transaction("a@b.c", 10.0, f"REF-{i}", "https://example.com/callback")
+
+    print(f"{'mode':<28} {'calls/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    report("client per call", *await run_calls(per_call_client, calls, concurrency))
+    report("shared gateway client", *await run_calls(shared_gateway, calls, concurrency))
+    await close_payment_gateways()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payment gateway client benchmark")
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Stub provider processing time")
+    parser.add_argument("--tls", action="store_true", help="Serve the stub over HTTPS")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stub_args = [sys.executable, os.path.join(ROOT, "scripts", "stub-payment-provider.py"),
+                     "--port", str(args.port), "--latency-ms", str(args.latency_ms)]
+        scheme = "http"
+        if args.tls:
+            certfile, keyfile = write_self_signed_cert(tmp)
+            stub_args += ["--certfile", certfile, "--keyfile", keyfile]
+            # httpx trusts SSL_CERT_FILE, so both modes verify the stub's certificate
+            os.environ["SSL_CERT_FILE"] = certfile
+            scheme = "https"
+        base_url = f"{scheme}://127.0.0.1:{args.port}"
+        os.environ["PAYSTACK_BASE_URL"] = base_url
+        os.environ["PAYSTACK_SECRET_KEY"] = "sk_test_stub"
+        sys.path[:0] = [os.path.join(ROOT, "services", "shared"), os.path.join(ROOT, "services", "payment-service")]
+
+        stub = subprocess.Popen(stub_args)
+        try:
+            wait_for_stub(base_url)
+            print(f"Stub at {base_url}, {args.latency_ms:g} ms provider latency, {args.calls} calls, concurrency {args.concurrency}\n")
+            asyncio.run(benchmark(base_url, args.calls, args.concurrency))
+        finally:
+            stub.terminate()
+            stub.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark list endpoint serialization: FastAPI's response_model path
+against service_toolkit.serialization.list_response.
+
+For each list schema it builds a page of ORM rows, checks that both paths
+produce exactly the same JSON body, then reports CPU time per request
+for each path. Rows are generated from the schema, so every optional
+field is also exercised as null, and floats and UTC datetimes are
+checked against Pydantic's formatting.
+
+    python scripts/benchmark-serialization.py
+    python scripts/benchmark-serialization.py --service order-service --rows 100 --requests 5000
+
+Needs the service's requirements plus services/shared/requirements.txt.
+"""
+
+import argparse
+import asyncio
+import datetime
+import enum
+import os
+import subprocess
+import sys
+import time
+from types import NoneType
+from typing import List, Union, get_args, get_origin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# List endpoints on the fast path: schema -> ORM model
+ENDPOINTS = {
+    "product-service": [("InstructorResponse", "Instructor"), ("CourseListResponse", "Course")],
+    "order-service": [("OrderResponse", "Order"), ("EnrollmentResponse", "Enrollment")],
+    "payment-service": [("PaymentResponse", "Payment")],
+}
+
+
+def sample_value(annotation, i, orm_attr):
+    origin = get_origin(annotation)
+    if origin is Union:
+        if i % 3 == 0:
+            return None
+        annotation = next(arg for arg in get_args(annotation) if arg is not NoneType)
+        origin = get_origin(annotation)
+    if origin in (list, List):
+        child_model = orm_attr.property.mapper.class_
+        return [build_row(get_args(annotation)[0], child_model, i * 10 + n) for n in range(3)]
+    if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+        members = list(annotation)
+        return members[i % len(members)]
+    if annotation is bool:
+        return i % 2 == 0
+    if annotation is int:
+        return i
+    if annotation is float:
+        return i * 1.25
+    if annotation is datetime.datetime:
+        return datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=i * 3607, microseconds=i * 37)
+    return f"value {i} with some text"
+
+
+def build_row(schema, orm_model, i):
+    values = {
+        name: sample_value(field.annotation, i, getattr(orm_model, name))
+        for name, field in schema.model_fields.items()
+    }
+    return orm_model(**values)
+
+
+def cpu_per_request(fn, requests):
+    started = time.process_time()
+    for _ in range(requests):
+        fn()
+    return (time.process_time() - started) / requests * 1000
+
+
+def run_service(service, rows, requests):
+    sys.path[:0] = [os.path.join(ROOT, "services", "shared"), os.path.join(ROOT, "services", service)]
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+
+    import models
+    import schemas
+    from service_toolkit.serialization import list_response
+
+    loop = asyncio.new_event_loop()
+    for schema_name, model_name in ENDPOINTS[service]:
+        schema = getattr(schemas, schema_name)
+        page = [build_row(schema, getattr(models, model_name), i) for i in range(1, rows + 1)]
+        field = create_response_field(name=f"Response_{schema_name}", type_=List[schema])
+
+        def pydantic_path():
+            content = loop.run_until_complete(serialize_response(field=field, response_content=page))
+            return JSONResponse(content=content).body
+
+        def fast_path():
+            return list_response(schema, page).body
+
+        baseline, fast = pydantic_path(), fast_path()
+        if baseline != fast:
+            print(f"{service} {schema_name}: fast path output differs from the response_model path")
+            print(f"  response_model: {baseline[:300]!r}")
+            print(f"  fast path:      {fast[:300]!r}")
+            sys.exit(1)
+
+        before = cpu_per_request(pydantic_path, requests)
+        after = cpu_per_request(fast_path, requests)
+        label = f"{service} {schema_name} x{rows}"
+        print(f"{label:<48} {before:>10.3f} {after:>10.3f} {before / after:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List endpoint serialization benchmark")
+    parser.add_argument("--service", default="all", choices=["all"] + list(ENDPOINTS))
+    parser.add_argument("--rows", type=int, default=100, help="Rows per response")
+    parser.add_argument("--requests", type=int, default=2000, help="Responses rendered per path")
+    args = parser.parse_args()
+
+    if args.service != "all":
+        run_service(args.service, args.rows, args.requests)
+        return
+
+    print(f"{'endpoint':<48} {'before ms':>10} {'after ms':>10} {'speedup':>9}")
+    for service in ENDPOINTS:
+        # Each service has its own models/schemas modules; one process each
+        result = subprocess.run(
+            [sys.executable, __file__, "--service", service, "--rows", str(args.rows), "--requests", str(args.requests)]
+        )
+        if result.returncode:
+            sys.exit(result.returncode)
+
+
+if __name__ == "__main__":
+    main()
@@ -93,13 +93,19 @@ function build_image() {
     
     local image_name="${PROJECT_NAME}/${service}:${tag}"
     
+    # Python services build from services/ so the shared toolkit is in context
+    local context="services/"
+    if [ "${service}" == "frontend" ]; then
+        context="services/frontend/"
+    fi
+    
     echo -e "${YELLOW}Building: ${image_name}${NC}"
     
     # Build with BuildKit
     DOCKER_BUILDKIT=1 docker build \
         -t ${image_name} \
         -f services/${service}/Dockerfile \
-        services/${service}/
+        ${context}
     
     if [ $? -eq 0 ]; then
         print_success "Successfully built: ${image_name}"
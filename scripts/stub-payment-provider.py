@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Stub Paystack/Flutterwave API for load-testing payment-service locally.
+
+Implements the endpoints payment_gateways.py calls and answers every
+transaction as successful after --latency-ms. Point payment-service at it
+with PAYSTACK_BASE_URL=http://127.0.0.1:9100 and
+FLUTTERWAVE_BASE_URL=http://127.0.0.1:9100/v3.
+
+    python scripts/stub-payment-provider.py --port 9100 --latency-ms 80
+    python scripts/stub-payment-provider.py --certfile cert.pem --keyfile key.pem
+
+Pass a certificate to serve HTTPS, so benchmarks include TLS handshakes.
+"""
+
+import argparse
+import asyncio
+import itertools
+
+from fastapi import FastAPI, Request
+import uvicorn
+
+app = FastAPI(title="Stub payment provider")
+transaction_ids = itertools.count(1000)
+latency = 0.0
+
+
+@app.post("/transaction/initialize")
+async def paystack_initialize(request: Request):
+    body = await request.json()
+    await asyncio.sleep(latency)
+    return {
+        "status": True,
+        "message": "Authorization URL created",
+        "data": {
+            "authorization_url": f"https://checkout.stub/{body['reference']}",
+            "access_code": f"AC-{body['reference']}",
+            "reference": body["reference"]
+        }
+    }
+
+
+@app.get("/transaction/verify/{reference}")
+async def paystack_verify(reference: str):
+    await asyncio.sleep(latency)
+    return {
+        "status": True,
+        "message": "Verification successful",
+        "data": {"id": next(transaction_ids), "status": "success", "reference": reference}
+    }
+
+
+@app.post("/refund")
+async def paystack_refund(request: Request):
+    body = await request.json()
+    await asyncio.sleep(latency)
+    return {"status": True, "message": "Refund has been queued", "data": {"transaction": body["transaction"], "status": "pending"}}
+
+
+@app.post("/v3/payments")
+async def flutterwave_initialize(request: Request):
+    body = await request.json()
+    await asyncio.sleep(latency)
+    return {"status": "success", "message": "Hosted Link", "data": {"link": f"https://checkout.stub/{body['tx_ref']}"}}
+
+
+@app.get("/v3/transactions/verify_by_reference")
+async def flutterwave_verify_by_reference(tx_ref: str):
+    await asyncio.sleep(latency)
+    return {"status": "success", "message": "Transaction fetched successfully", "data": {"id": next(transaction_ids), "tx_ref": tx_ref, "status": "successful"}}
+
+
+@app.get("/v3/transactions/{transaction_id}/verify")
+async def flutterwave_verify(transaction_id: str):
+    await asyncio.sleep(latency)
+    return {"status": "success", "message": "Transaction fetched successfully", "data": {"id": transaction_id, "status": "successful"}}
+
+
+@app.post("/v3/transactions/{transaction_id}/refund")
+async def flutterwave_refund(transaction_id: str):
+    await asyncio.sleep(latency)
+    return {"status": "success", "message": "Transaction refund initiated", "data": {"id": next(transaction_ids), "tx_id": transaction_id, "status": "completed"}}
+
+
+def main():
+    global latency
+    parser = argparse.ArgumentParser(description="Stub payment provider")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Simulated provider processing time")
+    parser.add_argument("--certfile", default=None)
+    parser.add_argument("--keyfile", default=None)
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    uvicorn.run(
+        app,
+        host=args.host,
+        port=args.port,
+        ssl_certfile=args.certfile,
+        ssl_keyfile=args.keyfile,
+        log_level="warning"
+    )
+
+
+if __name__ == "__main__":
+    main()
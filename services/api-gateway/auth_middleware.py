@@ -1,41 +1,24 @@
-from fastapi import HTTPException, status, Request
+from fastapi import Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
 from typing import Optional
 from config import settings
+from service_toolkit.auth import JWKSKeyCache, RevocationCache, TokenVerifier
 
 security = HTTPBearer()
 
 class AuthMiddleware:
     def __init__(self):
-        self.secret_key = settings.secret_key
         self.algorithm = settings.algorithm
+        self.key_cache = JWKSKeyCache(settings.auth_jwks_url, settings.jwks_refresh_interval, settings.algorithm)
+        self.revocation_cache = RevocationCache(settings.auth_revocations_url, settings.revocation_refresh_interval)
+        self.verifier = TokenVerifier(self.key_cache, self.revocation_cache, settings.algorithm)
     
     async def verify_token(self, credentials: HTTPAuthorizationCredentials) -> dict:
         """Verify JWT token"""
         token = credentials.credentials
-        
-        credentials_exception = HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-        
-        try:
-            payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
-            user_id: str = payload.get("sub")
-            role: str = payload.get("role")
-            
-            if user_id is None:
-                raise credentials_exception
-                
-            return {
-                "user_id": int(user_id),
-                "role": role,
-                "token": token
-            }
-        except JWTError:
-            raise credentials_exception
+        principal = await self.verifier.verify(token)
+        principal["token"] = token
+        return principal
     
     def get_token_from_request(self, request: Request) -> Optional[str]:
         """Extract token from request headers"""
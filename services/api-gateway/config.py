@@ -11,10 +11,12 @@ class Settings(BaseSettings):
     version: str = "1.0.0"
     debug: bool = True
     
-    # Security
-    secret_key: str = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
-    algorithm: str = "HS256"
-    access_token_expire_minutes: int = 60
+    # Security: tokens are RS256-signed by auth-service and verified against its JWKS
+    algorithm: str = "RS256"
+    auth_jwks_url: str = os.getenv("AUTH_JWKS_URL", "http://auth-service:8001/.well-known/jwks.json")
+    jwks_refresh_interval: int = int(os.getenv("JWKS_REFRESH_INTERVAL", "300"))
+    auth_revocations_url: str = os.getenv("AUTH_REVOCATIONS_URL", "http://auth-service:8001/revocations")
+    revocation_refresh_interval: float = float(os.getenv("REVOCATION_REFRESH_INTERVAL", "5"))
     
     # Service URLs
     auth_service_url: str = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8001")
@@ -61,4 +63,5 @@ SERVICE_ROUTES: Dict[str, str] = {
     "/invoices": settings.payment_service_url,
     "/refunds": settings.payment_service_url,
     "/wallet": settings.payment_service_url,
+    "/webhooks": settings.payment_service_url,
 }
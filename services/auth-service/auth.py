@@ -1,8 +1,8 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 import os
@@ -11,23 +11,25 @@ from dotenv import load_dotenv
 import models
 import schemas
 from database import get_db
+from hashing import password_hasher, UNUSABLE_PASSWORD
+from principal_cache import principal_cache
+from revocation import revocation_list
+from signing_keys import keyring, JWT_ALGORITHM
 
 load_dotenv()
 
-SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# Kept short: clients renew through /token/refresh without re-entering a password
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await password_hasher.hash(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -37,30 +39,62 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return keyring.sign(to_encode)
 
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = db.query(models.User).filter(models.User.email == email).first()
+def get_user_by_email(db: Session, email: str):
+    return db.query(models.User).filter(models.User.email == email).first()
+
+
+def save_password_hash(db: Session, user: models.User, hashed_password: str):
+    user.hashed_password = hashed_password
+    db.commit()
+
+
+async def authenticate_user(db: Session, email: str, password: str):
+    user = await run_in_threadpool(get_user_by_email, db, email)
     if not user:
+        # Same cost as a wrong password, so unknown emails are not revealed
+        await verify_password(password, UNUSABLE_PASSWORD)
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        # Stored with an outdated scheme or cost; upgrade while we have the password
+        await run_in_threadpool(save_password_hash, db, user, new_hash)
     return user
 
 
+def get_user_by_id(db: Session, user_id: int):
+    return db.query(models.User).filter(models.User.id == user_id).first()
+
+
+async def load_principal(db: Session, user_id: int) -> Optional[schemas.UserResponse]:
+    principal = await principal_cache.get(user_id)
+    if principal is None:
+        user = await run_in_threadpool(get_user_by_id, db, user_id)
+        if user is None:
+            return None
+        principal = schemas.UserResponse.model_validate(user)
+        await principal_cache.set(principal)
+    return principal
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
-):
+) -> schemas.UserResponse:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        public_key = keyring.public_key(jwt.get_unverified_header(token).get("kid"))
+        if public_key is None:
+            raise credentials_exception
+        payload = jwt.decode(token, public_key, algorithms=[JWT_ALGORITHM])
         user_id: int = payload.get("sub")
         role: str = payload.get("role")
         if user_id is None:
@@ -69,16 +103,19 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = db.query(models.User).filter(
-        models.User.id == token_data.user_id).first()
-    if user is None:
+    jti = payload.get("jti")
+    if jti and await revocation_list.is_revoked(jti):
         raise credentials_exception
-    return user
+
+    principal = await load_principal(db, token_data.user_id)
+    if principal is None:
+        raise credentials_exception
+    return principal
 
 
 async def get_current_active_user(
-    current_user: models.User = Depends(get_current_user)
-):
+    current_user: schemas.UserResponse = Depends(get_current_user)
+) -> schemas.UserResponse:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
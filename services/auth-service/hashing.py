@@ -0,0 +1,245 @@
+"""Bounded process pool for password hashing and verification.
+
+bcrypt is CPU bound, so running it on Starlette's threadpool lets a
+login burst starve every other endpoint on the pod. Hashing runs in a
+dedicated process pool instead; once ``workers + max_queue`` jobs are in
+flight, new ones are rejected with ``HashingPoolSaturated`` rather than
+queued without bound.
+
+The cost is set per environment with PASSWORD_HASH_SCHEME and
+BCRYPT_ROUNDS (or the ARGON2_* parameters); pick values with
+scripts/benchmark-password-hashing.py against the pod's CPU limit and the
+target verify latency. Stored hashes made with another scheme or cost are
+replaced on the user's next successful login.
+
+Keep this module free of FastAPI and database imports: worker processes
+import it on spawn.
+"""
+import asyncio
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+load_dotenv()
+
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(os.cpu_count() or 2)))
+HASH_POOL_MAX_QUEUE = int(os.getenv("HASH_POOL_MAX_QUEUE", "64"))
+
+PASSWORD_HASH_SCHEME = os.getenv("PASSWORD_HASH_SCHEME", "bcrypt")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# argon2 needs argon2-cffi; memory cost is in KiB
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+
+
+def build_context(
+    scheme: str = PASSWORD_HASH_SCHEME,
+    bcrypt_rounds: int = BCRYPT_ROUNDS,
+    argon2_time_cost: int = ARGON2_TIME_COST,
+    argon2_memory_cost: int = ARGON2_MEMORY_COST,
+    argon2_parallelism: int = ARGON2_PARALLELISM
+) -> CryptContext:
+    """Both schemes stay verifiable; only ``scheme`` at the configured cost
+    counts as current, so anything else reports needs_update"""
+    return CryptContext(
+        schemes=["bcrypt", "argon2"],
+        default=scheme,
+        deprecated="auto",
+        bcrypt__rounds=bcrypt_rounds,
+        argon2__time_cost=argon2_time_cost,
+        argon2__memory_cost=argon2_memory_cost,
+        argon2__parallelism=argon2_parallelism
+    )
+
+
+pwd_context = build_context()
+
+# Stored for invited users until they choose a password, and verified
+# against for unknown emails; never matches
+UNUSABLE_PASSWORD = "!"
+
+_dummy_hash: Optional[str] = None
+
+
+def _get_dummy_hash() -> str:
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = pwd_context.hash(secrets.token_urlsafe(16))
+    return _dummy_hash
+
+
+def _hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_password(plain_password: str, hashed_password: str) -> bool:
+    if hashed_password == UNUSABLE_PASSWORD:
+        # Spend a real verify so the response time does not reveal whether
+        # the account exists or has a password yet
+        pwd_context.verify(plain_password, _get_dummy_hash())
+        return False
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify, and rehash with the current policy if the stored hash is outdated"""
+    if hashed_password == UNUSABLE_PASSWORD:
+        return _verify_password(plain_password, hashed_password), None
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing pool has no capacity left"""
+
+
+class _OperationStats:
+    """Counters and a rolling latency window for one operation"""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, seconds: float, failed: bool = False):
+        self.count += 1
+        self.total_seconds += seconds
+        self.latencies.append(seconds)
+        if failed:
+            self.errors += 1
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def percentile(pct: float) -> Optional[float]:
+            if not ordered:
+                return None
+            index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+            return round(ordered[index] * 1000, 2)
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_seconds / self.count * 1000, 2) if self.count else None,
+            "p50_ms": percentile(50),
+            "p95_ms": percentile(95),
+            "p99_ms": percentile(99)
+        }
+
+
+class PasswordHasher:
+    """Async front end to a bounded bcrypt process pool"""
+
+    def __init__(self, workers: int = HASH_POOL_WORKERS, max_queue: int = HASH_POOL_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        self._stats = {"hash": _OperationStats(), "verify": _OperationStats()}
+        self._upgraded = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    def start(self):
+        """Spawn the worker processes ahead of the first request"""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_get_dummy_hash)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: forking a threaded server process can deadlock
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    async def _run(self, operation: str, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self._rejected += 1
+                raise HashingPoolSaturated(f"Password hashing pool saturated ({self._in_flight} in flight)")
+            self._in_flight += 1
+
+        started = time.perf_counter()
+        failed = False
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._stats[operation].record(time.perf_counter() - started, failed)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", _verify_password, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Returns (valid, new_hash); new_hash is set when the caller should store it"""
+        valid, new_hash = await self._run("verify", _verify_and_update, plain_password, hashed_password)
+        if new_hash:
+            with self._lock:
+                self._upgraded += 1
+        return valid, new_hash
+
+    async def hash_many(self, passwords: List[str], concurrency: Optional[int] = None) -> List[str]:
+        """Hash a batch across the pool without crowding out interactive logins.
+
+        At most ``concurrency`` (default: one per worker) jobs are in flight,
+        and a saturated pool makes the batch wait instead of failing.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.workers)
+
+        async def hash_one(password: str) -> str:
+            async with semaphore:
+                while True:
+                    try:
+                        return await self.hash(password)
+                    except HashingPoolSaturated:
+                        await asyncio.sleep(0.05)
+
+        return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "scheme": PASSWORD_HASH_SCHEME,
+                "bcrypt_rounds": BCRYPT_ROUNDS if PASSWORD_HASH_SCHEME == "bcrypt" else None,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "queue_depth": max(0, self._in_flight - self.workers),
+                "rejected": self._rejected,
+                "upgraded_hashes": self._upgraded,
+                "operations": {name: stats.snapshot() for name, stats in self._stats.items()}
+            }
+
+
+password_hasher = PasswordHasher()
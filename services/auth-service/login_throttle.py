@@ -0,0 +1,176 @@
+"""Failed login throttling.
+
+Failures are counted per account (keyed by a hash of the email, whether or
+not the account exists) and per client IP. Once a key has used its free
+attempts, each further failure locks it for an exponentially growing
+delay, capped at LOGIN_THROTTLE_MAX_DELAY. Locked attempts are rejected
+before any password hashing, so credential stuffing stops costing bcrypt
+time. Counters are forgotten after LOGIN_THROTTLE_WINDOW seconds without
+a failure; a successful login clears the account counter.
+
+If Redis is unreachable, logins are not throttled rather than refused.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from fastapi import Request
+import redis
+import redis.asyncio as aioredis
+
+from sessions import SESSION_STORE_BACKEND, REDIS_HOST, REDIS_PORT
+
+load_dotenv()
+
+LOGIN_THROTTLE_ACCOUNT_FREE_ATTEMPTS = int(os.getenv("LOGIN_THROTTLE_ACCOUNT_FREE_ATTEMPTS", "5"))
+LOGIN_THROTTLE_IP_FREE_ATTEMPTS = int(os.getenv("LOGIN_THROTTLE_IP_FREE_ATTEMPTS", "50"))
+LOGIN_THROTTLE_BASE_DELAY = float(os.getenv("LOGIN_THROTTLE_BASE_DELAY", "1"))
+LOGIN_THROTTLE_MAX_DELAY = float(os.getenv("LOGIN_THROTTLE_MAX_DELAY", "900"))
+LOGIN_THROTTLE_WINDOW = int(os.getenv("LOGIN_THROTTLE_WINDOW", "3600"))
+# Proxies in front of the service that append to X-Forwarded-For
+LOGIN_THROTTLE_PROXY_HOPS = int(os.getenv("LOGIN_THROTTLE_PROXY_HOPS", "0"))
+
+
+class LoginThrottled(Exception):
+    """Raised when an account or client IP is locked after failed logins"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Login locked for {retry_after:.0f}s")
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def client_ip(request: Request) -> str:
+    if LOGIN_THROTTLE_PROXY_HOPS > 0:
+        forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(forwarded) >= LOGIN_THROTTLE_PROXY_HOPS:
+            return forwarded[-LOGIN_THROTTLE_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+
+def lock_delay(failures: int, free_attempts: int) -> float:
+    if failures < free_attempts:
+        return 0.0
+    return min(LOGIN_THROTTLE_MAX_DELAY, LOGIN_THROTTLE_BASE_DELAY * 2 ** (failures - free_attempts))
+
+
+def _account_key(email: str) -> str:
+    return "auth:login:account:" + hashlib.sha256(email.strip().lower().encode()).hexdigest()[:32]
+
+
+def _ip_key(ip: str) -> str:
+    return f"auth:login:ip:{ip}"
+
+
+class InMemoryLoginThrottle:
+    """Per-process counters for single-instance local runs"""
+
+    def __init__(self):
+        self._counters: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def check(self, email: str, ip: str):
+        now = time.time()
+        with self._lock:
+            locked_until = max(
+                (self._counters[key]["locked_until"] for key in (_account_key(email), _ip_key(ip))
+                 if key in self._counters and self._counters[key]["expires_at"] > now),
+                default=0.0
+            )
+        if locked_until > now:
+            raise LoginThrottled(locked_until - now)
+
+    async def record_failure(self, email: str, ip: str):
+        now = time.time()
+        with self._lock:
+            for key, free_attempts in ((_account_key(email), LOGIN_THROTTLE_ACCOUNT_FREE_ATTEMPTS),
+                                       (_ip_key(ip), LOGIN_THROTTLE_IP_FREE_ATTEMPTS)):
+                counter = self._counters.get(key)
+                if counter is None or counter["expires_at"] <= now:
+                    counter = self._counters[key] = {"failures": 0, "locked_until": 0.0}
+                counter["failures"] += 1
+                counter["expires_at"] = now + LOGIN_THROTTLE_WINDOW
+                delay = lock_delay(counter["failures"], free_attempts)
+                if delay:
+                    counter["locked_until"] = now + delay
+
+    async def record_success(self, email: str):
+        with self._lock:
+            self._counters.pop(_account_key(email), None)
+
+
+class RedisLoginThrottle:
+    """Counters shared by all replicas, one hash per account or IP"""
+
+    # Count a failure and extend the lock, atomically per key
+    FAILURE_SCRIPT = """
+    local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+    local free_attempts = tonumber(ARGV[2])
+    if failures >= free_attempts then
+        local delay = math.min(tonumber(ARGV[4]), tonumber(ARGV[3]) * 2 ^ (failures - free_attempts))
+        redis.call('HSET', KEYS[1], 'locked_until', tonumber(ARGV[1]) + delay)
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return failures
+    """
+
+    def __init__(self, host: str = REDIS_HOST, port: int = REDIS_PORT):
+        self.redis_client = aioredis.Redis(host=host, port=port, decode_responses=True)
+        self._failure = self.redis_client.register_script(self.FAILURE_SCRIPT)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        await self.redis_client.close()
+
+    async def check(self, email: str, ip: str):
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hget(_account_key(email), "locked_until")
+            pipe.hget(_ip_key(ip), "locked_until")
+            values: List[Optional[str]] = await pipe.execute()
+        except redis.RedisError as e:
+            print(f"Redis error in login throttle: {e}")
+            return
+        locked_until = max((float(value) for value in values if value), default=0.0)
+        now = time.time()
+        if locked_until > now:
+            raise LoginThrottled(locked_until - now)
+
+    async def record_failure(self, email: str, ip: str):
+        now = time.time()
+        try:
+            for key, free_attempts in ((_account_key(email), LOGIN_THROTTLE_ACCOUNT_FREE_ATTEMPTS),
+                                       (_ip_key(ip), LOGIN_THROTTLE_IP_FREE_ATTEMPTS)):
+                await self._failure(
+                    keys=[key],
+                    args=[now, free_attempts, LOGIN_THROTTLE_BASE_DELAY, LOGIN_THROTTLE_MAX_DELAY, LOGIN_THROTTLE_WINDOW]
+                )
+        except redis.RedisError as e:
+            print(f"Redis error in login throttle: {e}")
+
+    async def record_success(self, email: str):
+        try:
+            await self.redis_client.delete(_account_key(email))
+        except redis.RedisError as e:
+            print(f"Redis error in login throttle: {e}")
+
+
+def create_login_throttle():
+    """Login throttle on the same backend as the session store"""
+    if SESSION_STORE_BACKEND == "memory":
+        return InMemoryLoginThrottle()
+    return RedisLoginThrottle()
+
+
+login_throttle = create_login_throttle()
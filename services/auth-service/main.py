@@ -1,53 +1,115 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import Depends, File, HTTPException, Request, Response, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from datetime import timedelta
+import time
+import uuid
 
 import models
 import schemas
 import auth
 from database import engine, get_db
+from hashing import password_hasher, HashingPoolSaturated
+from login_throttle import login_throttle, client_ip, LoginThrottled
+from principal_cache import principal_cache
+from revocation import revocation_list
+from sessions import session_store, RefreshTokenReused, SessionStoreUnavailable
+from signing_keys import keyring
+from user_import import import_users, parse_csv, MAX_IMPORT_ROWS
+from service_toolkit.app import add_lifecycle_hooks, create_app
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(
+app = create_app(
     title="Execute Tech Academy - Auth Service",
     description="Authentication and Authorization Service",
-    version="1.0.0"
+    service_name="Auth Service"
 )
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Configure properly in production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+add_lifecycle_hooks(app, start=password_hasher.start, stop=password_hasher.shutdown)
+add_lifecycle_hooks(app, start=principal_cache.start, stop=principal_cache.stop)
+add_lifecycle_hooks(app, start=session_store.start, stop=session_store.stop)
+add_lifecycle_hooks(app, start=revocation_list.start, stop=revocation_list.stop)
+add_lifecycle_hooks(app, start=login_throttle.start, stop=login_throttle.stop)
 
 
-@app.get("/")
-def read_root():
-    return {
-        "service": "Auth Service",
-        "status": "running",
-        "version": "1.0.0"
-    }
+@app.exception_handler(HashingPoolSaturated)
+async def hashing_pool_saturated_handler(request: Request, exc: HashingPoolSaturated):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Authentication is busy, please retry shortly"},
+        headers={"Retry-After": "1"}
+    )
+
+
+@app.exception_handler(LoginThrottled)
+async def login_throttled_handler(request: Request, exc: LoginThrottled):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Too many failed login attempts, please retry later"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(SessionStoreUnavailable)
+async def session_store_unavailable_handler(request: Request, exc: SessionStoreUnavailable):
+    print(f"Session store unavailable: {exc}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Authentication is temporarily unavailable"},
+        headers={"Retry-After": "1"}
+    )
+
 
+@app.get("/.well-known/jwks.json")
+def jwks(response: Response):
+    """Public signing keys for local token verification in other services"""
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return keyring.jwks()
 
-@app.get("/health")
-def health_check():
-    return {"status": "healthy"}
+
+@app.get("/revocations/bloom")
+async def revocation_filter(request: Request):
+    """Bloom filter of revoked token ids; verifiers poll it with If-None-Match"""
+    snapshot = await revocation_list.snapshot()
+    etag = f'"{snapshot["version"]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return JSONResponse(content=snapshot, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+@app.get("/revocations/{jti}")
+async def revocation_status(jti: str):
+    """Exact check for a token id that hit the bloom filter"""
+    # Never answered from this replica's filter: the caller's may be newer
+    return {"jti": jti, "revoked": await revocation_list.is_revoked_exact(jti)}
+
+
+@app.get("/metrics/hashing")
+def hashing_metrics():
+    return password_hasher.metrics()
+
+
+def find_existing_user(db: Session, email: str, username: str):
+    return db.query(models.User).filter(
+        (models.User.email == email) | (
+            models.User.username == username)
+    ).first()
+
+
+def save_user(db: Session, db_user: models.User):
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
 
 
 @app.post("/register", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     # Check if user exists
-    db_user = db.query(models.User).filter(
-        (models.User.email == user.email) | (
-            models.User.username == user.username)
-    ).first()
+    db_user = await run_in_threadpool(find_existing_user, db, user.email, user.username)
 
     if db_user:
         raise HTTPException(
@@ -55,8 +117,8 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
             detail="Email or username already registered"
         )
 
-    # Create new user
-    hashed_password = auth.get_password_hash(user.password)
+    # Create new user; hashing runs in the process pool, not on a request thread
+    hashed_password = await auth.get_password_hash(user.password)
     db_user = models.User(
         email=user.email,
         username=user.username,
@@ -64,72 +126,224 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         hashed_password=hashed_password,
         role=user.role
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return await run_in_threadpool(save_user, db, db_user)
 
 
 @app.post("/login", response_model=schemas.Token)
-def login(login_data: schemas.LoginRequest, db: Session = Depends(get_db)):
-    user = auth.authenticate_user(db, login_data.email, login_data.password)
+async def login(login_data: schemas.LoginRequest, request: Request, db: Session = Depends(get_db)):
+    # Locked accounts and IPs are turned away before any bcrypt work
+    ip = client_ip(request)
+    await login_throttle.check(login_data.email, ip)
+
+    user = await auth.authenticate_user(db, login_data.email, login_data.password)
     if not user:
+        await login_throttle.record_failure(login_data.email, ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    await login_throttle.record_success(login_data.email)
+    jti = uuid.uuid4().hex
+    session_id, refresh_token = await session_store.create(user.id, jti)
+    return issue_tokens(user, session_id, refresh_token, jti)
+
+
+def issue_tokens(user, session_id: str, refresh_token: str, jti: str) -> dict:
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": str(user.id), "role": user.role.value},
+        data={"sub": str(user.id), "role": user.role.value, "sid": session_id, "jti": jti},
         expires_delta=access_token_expires
     )
 
     return {
         "access_token": access_token,
         "token_type": "bearer",
+        "expires_in": int(access_token_expires.total_seconds()),
+        "refresh_token": refresh_token,
         "user": user
     }
 
 
+async def revoke_access_tokens(jtis):
+    """Revoke issued access tokens for at most their remaining lifetime"""
+    jtis = [jti for jti in jtis if jti]
+    await revocation_list.revoke(jtis, time.time() + auth.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+@app.post("/token/refresh", response_model=schemas.Token)
+async def refresh_access_token(refresh_data: schemas.RefreshRequest, db: Session = Depends(get_db)):
+    """Exchange a refresh token for a new token pair; no password check"""
+    invalid_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    jti = uuid.uuid4().hex
+    try:
+        rotated = await session_store.rotate(refresh_data.refresh_token, jti)
+    except RefreshTokenReused as e:
+        # A stolen copy and the real client both hold this token family;
+        # the session is already gone, make the owner log in again
+        print(f"{e}; session revoked")
+        await revoke_access_tokens([e.jti])
+        raise invalid_exception
+    if rotated is None:
+        raise invalid_exception
+
+    user_id, session_id, refresh_token = rotated
+    user = await auth.load_principal(db, user_id)
+    if user is None or not user.is_active:
+        await session_store.revoke(refresh_token)
+        raise invalid_exception
+
+    return issue_tokens(user, session_id, refresh_token, jti)
+
+
+@app.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(refresh_data: schemas.RefreshRequest):
+    """End the session behind a refresh token and revoke its current access token"""
+    jti = await session_store.revoke(refresh_data.refresh_token)
+    await revoke_access_tokens([jti])
+
+
+def apply_user_update(db: Session, user_id: int, changes: dict):
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if user is None:
+        return None
+    for key, value in changes.items():
+        setattr(user, key, value)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
+def require_admin(current_user: schemas.UserResponse):
+    if current_user.role != models.UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+
+
 @app.get("/me", response_model=schemas.UserResponse)
-async def read_users_me(current_user: models.User = Depends(auth.get_current_active_user)):
+async def read_users_me(current_user: schemas.UserResponse = Depends(auth.get_current_active_user)):
     return current_user
 
 
 @app.put("/me", response_model=schemas.UserResponse)
 async def update_user_me(
     user_update: schemas.UserUpdate,
-    current_user: models.User = Depends(auth.get_current_active_user),
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
     db: Session = Depends(get_db)
 ):
+    changes = {}
     if user_update.email:
-        current_user.email = user_update.email
+        changes["email"] = user_update.email
     if user_update.full_name:
-        current_user.full_name = user_update.full_name
+        changes["full_name"] = user_update.full_name
 
-    db.commit()
-    db.refresh(current_user)
-    return current_user
+    user = await run_in_threadpool(apply_user_update, db, current_user.id, changes)
+    await principal_cache.invalidate(current_user.id)
+    return user
 
 
 @app.get("/users", response_model=list[schemas.UserResponse])
 async def list_users(
     skip: int = 0,
     limit: int = 100,
-    current_user: models.User = Depends(auth.get_current_active_user),
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
     db: Session = Depends(get_db)
 ):
     # Only admins can list all users
-    if current_user.role != models.UserRole.ADMIN:
+    require_admin(current_user)
+
+    return await run_in_threadpool(
+        lambda: db.query(models.User).offset(skip).limit(limit).all()
+    )
+
+
+@app.put("/users/{user_id}", response_model=schemas.UserResponse)
+async def update_user(
+    user_id: int,
+    user_update: schemas.UserUpdate,
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Admin update of any user, including role changes and deactivation"""
+    require_admin(current_user)
+
+    user = await run_in_threadpool(
+        apply_user_update, db, user_id, user_update.dict(exclude_unset=True)
+    )
+    if user is None:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+
+    await principal_cache.invalidate(user_id)
+    if not user.is_active:
+        await revoke_access_tokens(await session_store.revoke_user(user_id))
+    return user
+
+
+@app.post("/users/bulk")
+async def bulk_import_users(
+    import_data: schemas.UserImportRequest,
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user)
+):
+    """Provision many users; streams one NDJSON result per row, then a summary"""
+    require_admin(current_user)
+    return StreamingResponse(import_users(import_data.users), media_type="application/x-ndjson")
+
+
+@app.post("/users/bulk/csv")
+async def bulk_import_users_csv(
+    file: UploadFile = File(...),
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user)
+):
+    """CSV variant of /users/bulk with columns email, username, full_name, role, password"""
+    require_admin(current_user)
+    try:
+        rows = parse_csv(await file.read())
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unreadable CSV: {e}")
+    if not rows:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="CSV has no rows")
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_IMPORT_ROWS} rows per import"
+        )
+    return StreamingResponse(import_users(rows), media_type="application/x-ndjson")
+
+
+@app.post("/invites/accept", response_model=schemas.Token)
+async def accept_invite(invite: schemas.InviteAccept, db: Session = Depends(get_db)):
+    """Set the password of an invited user and log them in"""
+    user_id = await session_store.redeem_invite(invite.token)
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid or expired invite"
+        )
+
+    hashed_password = await auth.get_password_hash(invite.password)
+    user = await run_in_threadpool(
+        apply_user_update, db, user_id, {"hashed_password": hashed_password, "is_verified": True}
+    )
+    if user is None or not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid or expired invite"
         )
+    await principal_cache.invalidate(user_id)
 
-    users = db.query(models.User).offset(skip).limit(limit).all()
-    return users
+    jti = uuid.uuid4().hex
+    session_id, refresh_token = await session_store.create(user.id, jti)
+    return issue_tokens(user, session_id, refresh_token, jti)
 
 if __name__ == "__main__":
     import uvicorn
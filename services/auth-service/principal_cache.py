@@ -0,0 +1,136 @@
+"""Two-tier cache of authenticated principals keyed by user id.
+
+Holds the fields of ``schemas.UserResponse`` (including is_active), so
+authenticated reads need no users SELECT. The in-process tier absorbs hot
+users; Redis shares entries between replicas. ``invalidate`` deletes both
+tiers and broadcasts the user id so other replicas drop their local copy.
+If Redis is unreachable the cache degrades to the local tier only.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from dotenv import load_dotenv
+import redis
+import redis.asyncio as aioredis
+
+import schemas
+
+load_dotenv()
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+PRINCIPAL_CACHE_LOCAL_TTL = float(os.getenv("PRINCIPAL_CACHE_LOCAL_TTL", "10"))
+PRINCIPAL_CACHE_REDIS_TTL = int(os.getenv("PRINCIPAL_CACHE_REDIS_TTL", "60"))
+PRINCIPAL_CACHE_MAX_SIZE = int(os.getenv("PRINCIPAL_CACHE_MAX_SIZE", "10000"))
+
+INVALIDATION_CHANNEL = "auth:principal:invalidate"
+
+
+class PrincipalCache:
+    def __init__(
+        self,
+        local_ttl: float = PRINCIPAL_CACHE_LOCAL_TTL,
+        redis_ttl: int = PRINCIPAL_CACHE_REDIS_TTL,
+        max_size: int = PRINCIPAL_CACHE_MAX_SIZE
+    ):
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.max_size = max_size
+        self._local: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.redis_client: Optional[aioredis.Redis] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"auth:principal:{user_id}"
+
+    async def start(self):
+        """Connect the Redis tier and listen for invalidations from other replicas"""
+        try:
+            client = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+            await client.ping()
+            self.redis_client = client
+            self._listener = asyncio.create_task(self._listen())
+        except (redis.RedisError, OSError) as e:
+            print(f"Redis connection failed: {e}. Principal cache is process-local only.")
+            self.redis_client = None
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            self._listener = None
+        if self.redis_client:
+            await self.redis_client.close()
+            self.redis_client = None
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._drop_local(int(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except redis.RedisError as e:
+                print(f"Principal invalidation listener error: {e}")
+                # Entries may have been missed; the local TTL bounds staleness
+                await asyncio.sleep(1)
+
+    def _drop_local(self, user_id: int):
+        with self._lock:
+            self._local.pop(user_id, None)
+
+    def _set_local(self, principal: schemas.UserResponse):
+        with self._lock:
+            self._local[principal.id] = (time.monotonic() + self.local_ttl, principal)
+            self._local.move_to_end(principal.id)
+            if len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    async def get(self, user_id: int) -> Optional[schemas.UserResponse]:
+        with self._lock:
+            entry = self._local.get(user_id)
+            if entry and entry[0] > time.monotonic():
+                self._local.move_to_end(user_id)
+                return entry[1]
+
+        if self.redis_client:
+            try:
+                raw = await self.redis_client.get(self._key(user_id))
+            except redis.RedisError as e:
+                print(f"Redis error in principal cache: {e}")
+                raw = None
+            if raw:
+                principal = schemas.UserResponse.model_validate_json(raw)
+                self._set_local(principal)
+                return principal
+
+        return None
+
+    async def set(self, principal: schemas.UserResponse):
+        self._set_local(principal)
+        if self.redis_client:
+            try:
+                await self.redis_client.set(self._key(principal.id), principal.model_dump_json(), ex=self.redis_ttl)
+            except redis.RedisError as e:
+                print(f"Redis error in principal cache: {e}")
+
+    async def invalidate(self, user_id: int):
+        """Drop a principal everywhere; call after any change to the user row"""
+        self._drop_local(user_id)
+        if self.redis_client:
+            try:
+                await self.redis_client.delete(self._key(user_id))
+                await self.redis_client.publish(INVALIDATION_CHANNEL, str(user_id))
+            except redis.RedisError as e:
+                print(f"Redis error in principal cache: {e}")
+
+
+principal_cache = PrincipalCache()
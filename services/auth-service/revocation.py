@@ -0,0 +1,245 @@
+"""Revoked access token ids (jti) and the bloom filter published to verifiers.
+
+Revocations are kept only until the token would have expired anyway, so
+the set stays small. After each change a bloom filter of the set is
+rebuilt and stored as a versioned snapshot; verifiers poll
+/revocations/bloom, swap the filter in, and only call
+/revocations/{jti} when a token hits it.
+
+Snapshot versions come from INCR taken after the revocation is written
+and before the set is read, and a snapshot only replaces an older one.
+The highest version therefore always contains every revocation.
+"""
+import asyncio
+import base64
+import hashlib
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+import redis
+import redis.asyncio as aioredis
+
+from sessions import SESSION_STORE_BACKEND, REDIS_HOST, REDIS_PORT, SessionStoreUnavailable
+
+load_dotenv()
+
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", "10000"))
+REVOCATION_BLOOM_FP_RATE = float(os.getenv("REVOCATION_BLOOM_FP_RATE", "0.001"))
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", "5"))
+
+
+class BloomFilter:
+    """Fixed-size bloom filter using double hashing over SHA-256"""
+
+    def __init__(self, size_bits: int, hash_count: int, bits: Optional[bytearray] = None):
+        self.size_bits = size_bits
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else bytearray((size_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, fp_rate: float) -> "BloomFilter":
+        size_bits = max(64, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))))
+        hash_count = max(1, int(round(size_bits / capacity * math.log(2))))
+        return cls(size_bits, hash_count)
+
+    def _positions(self, item: str):
+        digest = hashlib.sha256(item.encode()).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size_bits
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def to_snapshot(self, version: int) -> dict:
+        return {
+            "version": version,
+            "size_bits": self.size_bits,
+            "hash_count": self.hash_count,
+            "filter": base64.b64encode(bytes(self.bits)).decode()
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> "BloomFilter":
+        return cls(snapshot["size_bits"], snapshot["hash_count"], bytearray(base64.b64decode(snapshot["filter"])))
+
+
+def build_filter(jtis: Iterable[str]) -> BloomFilter:
+    jtis = list(jtis)
+    bloom = BloomFilter.for_capacity(max(REVOCATION_BLOOM_CAPACITY, len(jtis)), REVOCATION_BLOOM_FP_RATE)
+    for jti in jtis:
+        bloom.add(jti)
+    return bloom
+
+
+class InMemoryRevocationList:
+    """Per-process revocations for single-instance local runs"""
+
+    def __init__(self):
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.version = 0
+        self._snapshot = build_filter([]).to_snapshot(0)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def revoke(self, jtis: List[str], expires_at: float):
+        if not jtis:
+            return
+        with self._lock:
+            for jti in jtis:
+                self._revoked[jti] = expires_at
+            self._rebuild()
+
+    def _rebuild(self):
+        now = time.time()
+        self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+        self.version += 1
+        self._snapshot = build_filter(self._revoked).to_snapshot(self.version)
+
+    async def is_revoked(self, jti: str) -> bool:
+        with self._lock:
+            return self._revoked.get(jti, 0) > time.time()
+
+    async def is_revoked_exact(self, jti: str) -> bool:
+        return await self.is_revoked(jti)
+
+    async def snapshot(self) -> dict:
+        return self._snapshot
+
+
+class RedisRevocationList:
+    """Revocations shared by all auth-service replicas.
+
+    ``auth:revoked`` is a sorted set of jti scored by expiry; the latest
+    filter snapshot is the ``auth:revocation:snapshot`` hash. Each replica
+    also keeps the current filter in memory, synced every
+    REVOCATION_SYNC_INTERVAL, so its own token checks stay local.
+    """
+
+    REVOKED_KEY = "auth:revoked"
+    VERSION_KEY = "auth:revocation:version"
+    SNAPSHOT_KEY = "auth:revocation:snapshot"
+
+    # Replace the stored snapshot only with a newer one
+    STORE_SCRIPT = """
+    local current = tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+    if tonumber(ARGV[1]) <= current then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'version', ARGV[1], 'size_bits', ARGV[2], 'hash_count', ARGV[3], 'filter', ARGV[4])
+    return 1
+    """
+
+    def __init__(self, host: str = REDIS_HOST, port: int = REDIS_PORT, sync_interval: float = REVOCATION_SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self.redis_client = aioredis.Redis(host=host, port=port, decode_responses=True)
+        self._store = self.redis_client.register_script(self.STORE_SCRIPT)
+        self._snapshot = build_filter([]).to_snapshot(0)
+        self._filter = BloomFilter.from_snapshot(self._snapshot)
+        self._syncer: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._syncer = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._syncer:
+            self._syncer.cancel()
+            self._syncer = None
+        await self.redis_client.close()
+
+    async def _sync_loop(self):
+        while True:
+            try:
+                # Expired revocations only need dropping from the filter when
+                # nothing else has triggered a rebuild in the meantime
+                if await self.redis_client.zremrangebyscore(self.REVOKED_KEY, "-inf", time.time()):
+                    await self._publish()
+                await self._load()
+            except asyncio.CancelledError:
+                raise
+            except redis.RedisError as e:
+                print(f"Revocation sync failed: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    async def _load(self):
+        stored = await self.redis_client.hgetall(self.SNAPSHOT_KEY)
+        if stored and int(stored["version"]) > self._snapshot["version"]:
+            self._set_snapshot({
+                "version": int(stored["version"]),
+                "size_bits": int(stored["size_bits"]),
+                "hash_count": int(stored["hash_count"]),
+                "filter": stored["filter"]
+            })
+
+    def _set_snapshot(self, snapshot: dict):
+        self._filter = BloomFilter.from_snapshot(snapshot)
+        self._snapshot = snapshot
+
+    async def _publish(self):
+        version = await self.redis_client.incr(self.VERSION_KEY)
+        jtis = await self.redis_client.zrangebyscore(self.REVOKED_KEY, time.time(), "+inf")
+        snapshot = build_filter(jtis).to_snapshot(version)
+        await self._store(
+            keys=[self.SNAPSHOT_KEY],
+            args=[version, snapshot["size_bits"], snapshot["hash_count"], snapshot["filter"]]
+        )
+        if version > self._snapshot["version"]:
+            self._set_snapshot(snapshot)
+
+    async def revoke(self, jtis: List[str], expires_at: float):
+        """Revoke access tokens until expires_at, their latest possible expiry"""
+        if not jtis:
+            return
+        try:
+            await self.redis_client.zadd(self.REVOKED_KEY, {jti: expires_at for jti in jtis})
+            await self._publish()
+        except redis.RedisError as e:
+            raise SessionStoreUnavailable(str(e)) from e
+
+    async def is_revoked(self, jti: str) -> bool:
+        """Exact check, skipped when the local filter rules the jti out"""
+        if jti not in self._filter:
+            return False
+        return await self.is_revoked_exact(jti)
+
+    async def is_revoked_exact(self, jti: str) -> bool:
+        """Check auth:revoked itself, never the local filter.
+
+        Serves verifiers whose filter may be fresher than this replica's.
+        """
+        try:
+            score = await self.redis_client.zscore(self.REVOKED_KEY, jti)
+        except redis.RedisError as e:
+            raise SessionStoreUnavailable(str(e)) from e
+        return score is not None and score > time.time()
+
+    async def snapshot(self) -> dict:
+        try:
+            await self._load()
+        except redis.RedisError as e:
+            print(f"Serving cached revocation snapshot: {e}")
+        return self._snapshot
+
+
+def create_revocation_list():
+    """Revocation list on the same backend as the session store"""
+    if SESSION_STORE_BACKEND == "memory":
+        return InMemoryRevocationList()
+    return RedisRevocationList()
+
+
+revocation_list = create_revocation_list()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 from models import UserRole
 
@@ -15,6 +15,21 @@ class UserCreate(UserBase):
     password: str = Field(..., min_length=8)
 
 
+class UserImportRow(UserBase):
+    # Rows without a password are invited instead
+    password: Optional[str] = Field(None, min_length=8)
+
+
+class UserImportRequest(BaseModel):
+    # Rows are validated one by one so a bad row is reported, not fatal
+    users: List[Dict[str, Any]] = Field(..., min_length=1, max_length=10000)
+
+
+class InviteAccept(BaseModel):
+    token: str
+    password: str = Field(..., min_length=8)
+
+
 class UserUpdate(BaseModel):
     email: Optional[EmailStr] = None
     full_name: Optional[str] = None
@@ -35,9 +50,15 @@ class UserResponse(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    expires_in: int
+    refresh_token: str
     user: UserResponse
 
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
 class TokenData(BaseModel):
     user_id: Optional[int] = None
     role: Optional[str] = None
@@ -0,0 +1,306 @@
+"""Refresh token sessions.
+
+A login opens a session and returns an opaque refresh token
+``<session_id>.<secret>``. Only a SHA-256 of the secret is stored: the
+secret is 256 random bits, so a slow hash would add nothing. Every refresh
+rotates the secret. Presenting a secret that has already been rotated
+away means the token was copied, so the whole session is revoked and
+both holders have to log in again.
+
+Each session also remembers the jti of the last access token issued from
+it, so ending a session can revoke that token too (see revocation.py).
+
+Sessions live in Redis so every replica sees the same state, with an
+idle TTL of REFRESH_TOKEN_EXPIRE_DAYS that each rotation renews.
+SESSION_STORE_BACKEND=memory keeps them in-process for single-instance
+local runs.
+
+The store also holds single-use invite tokens for users provisioned
+without a password; like refresh tokens they are kept only as hashes.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+import redis
+import redis.asyncio as aioredis
+
+load_dotenv()
+
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "redis")
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+INVITE_EXPIRE_DAYS = int(os.getenv("INVITE_EXPIRE_DAYS", "7"))
+
+
+class SessionStoreUnavailable(Exception):
+    """Raised when the session store cannot be reached"""
+
+
+class RefreshTokenReused(Exception):
+    """Raised when a rotated-away refresh token is presented again"""
+
+    def __init__(self, user_id: int, jti: Optional[str]):
+        super().__init__(f"Refresh token reuse detected for user {user_id}")
+        self.user_id = user_id
+        self.jti = jti
+
+
+def _hash_secret(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def _new_secret() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def _split_token(refresh_token: str) -> Optional[Tuple[str, str]]:
+    session_id, _, secret = refresh_token.partition(".")
+    if not session_id or not secret:
+        return None
+    return session_id, secret
+
+
+class InMemorySessionStore:
+    """Per-process sessions; every replica has its own and restarts lose them"""
+
+    def __init__(self, ttl_seconds: int = REFRESH_TOKEN_EXPIRE_DAYS * 86400, invite_ttl_seconds: int = INVITE_EXPIRE_DAYS * 86400):
+        self.ttl_seconds = ttl_seconds
+        self.invite_ttl_seconds = invite_ttl_seconds
+        self._sessions: Dict[str, dict] = {}
+        self._invites: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def _live(self, session_id: str) -> Optional[dict]:
+        session = self._sessions.get(session_id)
+        if session and session["expires_at"] <= time.monotonic():
+            del self._sessions[session_id]
+            return None
+        return session
+
+    async def create(self, user_id: int, jti: str) -> Tuple[str, str]:
+        """Open a session; returns (session_id, refresh_token)"""
+        session_id, secret = secrets.token_urlsafe(16), _new_secret()
+        with self._lock:
+            self._sessions[session_id] = {
+                "user_id": user_id,
+                "token_hash": _hash_secret(secret),
+                "jti": jti,
+                "expires_at": time.monotonic() + self.ttl_seconds
+            }
+        return session_id, f"{session_id}.{secret}"
+
+    async def rotate(self, refresh_token: str, jti: str) -> Optional[Tuple[int, str, str]]:
+        """Swap a refresh token for a new one; returns (user_id, session_id, refresh_token)"""
+        parts = _split_token(refresh_token)
+        if parts is None:
+            return None
+        session_id, secret = parts
+        new_secret = _new_secret()
+        with self._lock:
+            session = self._live(session_id)
+            if session is None:
+                return None
+            if not hmac.compare_digest(session["token_hash"], _hash_secret(secret)):
+                del self._sessions[session_id]
+                raise RefreshTokenReused(session["user_id"], session["jti"])
+            session["token_hash"] = _hash_secret(new_secret)
+            session["jti"] = jti
+            session["expires_at"] = time.monotonic() + self.ttl_seconds
+            return session["user_id"], session_id, f"{session_id}.{new_secret}"
+
+    async def revoke(self, refresh_token: str) -> Optional[str]:
+        parts = _split_token(refresh_token)
+        if parts is None:
+            return None
+        with self._lock:
+            session = self._sessions.pop(parts[0], None)
+        return session["jti"] if session else None
+
+    async def revoke_user(self, user_id: int) -> List[str]:
+        with self._lock:
+            session_ids = [sid for sid, s in self._sessions.items() if s["user_id"] == user_id]
+            return [self._sessions.pop(session_id)["jti"] for session_id in session_ids]
+
+    async def create_invites(self, user_ids: List[int]) -> Dict[int, str]:
+        """Issue one invite token per user; returns user_id -> token"""
+        tokens = {user_id: _new_secret() for user_id in user_ids}
+        expires_at = time.monotonic() + self.invite_ttl_seconds
+        with self._lock:
+            for user_id, token in tokens.items():
+                self._invites[_hash_secret(token)] = (user_id, expires_at)
+        return tokens
+
+    async def redeem_invite(self, token: str) -> Optional[int]:
+        with self._lock:
+            invite = self._invites.pop(_hash_secret(token), None)
+        if invite is None or invite[1] <= time.monotonic():
+            return None
+        return invite[0]
+
+
+class RedisSessionStore:
+    """Sessions shared by all replicas.
+
+    ``auth:session:<id>`` is a hash of user_id, token_hash and jti;
+    ``auth:user_sessions:<user_id>`` indexes a user's sessions so they can
+    all be revoked at once. Members of the index may outlive their session
+    and are ignored.
+    """
+
+    # Check and rotate in one step so two concurrent refreshes with the same
+    # token cannot both succeed
+    ROTATE_SCRIPT = """
+    local current = redis.call('HGET', KEYS[1], 'token_hash')
+    if not current then
+        return {0}
+    end
+    local user_id = redis.call('HGET', KEYS[1], 'user_id')
+    if current ~= ARGV[1] then
+        local jti = redis.call('HGET', KEYS[1], 'jti')
+        redis.call('DEL', KEYS[1])
+        return {-1, user_id, jti}
+    end
+    redis.call('HSET', KEYS[1], 'token_hash', ARGV[2], 'jti', ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return {1, user_id}
+    """
+
+    def __init__(
+        self,
+        host: str = REDIS_HOST,
+        port: int = REDIS_PORT,
+        ttl_seconds: int = REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+        invite_ttl_seconds: int = INVITE_EXPIRE_DAYS * 86400
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.invite_ttl_seconds = invite_ttl_seconds
+        self.redis_client = aioredis.Redis(host=host, port=port, decode_responses=True)
+        self._rotate = self.redis_client.register_script(self.ROTATE_SCRIPT)
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"auth:session:{session_id}"
+
+    @staticmethod
+    def _user_key(user_id: int) -> str:
+        return f"auth:user_sessions:{user_id}"
+
+    @staticmethod
+    def _invite_key(token: str) -> str:
+        return f"auth:invite:{_hash_secret(token)}"
+
+    async def start(self):
+        try:
+            await self.redis_client.ping()
+        except (redis.RedisError, OSError) as e:
+            print(f"Redis connection failed: {e}. Logins will fail until the session store is reachable.")
+
+    async def stop(self):
+        await self.redis_client.close()
+
+    async def create(self, user_id: int, jti: str) -> Tuple[str, str]:
+        """Open a session; returns (session_id, refresh_token)"""
+        session_id, secret = secrets.token_urlsafe(16), _new_secret()
+        try:
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.hset(self._key(session_id), mapping={"user_id": user_id, "token_hash": _hash_secret(secret), "jti": jti})
+            pipe.expire(self._key(session_id), self.ttl_seconds)
+            pipe.sadd(self._user_key(user_id), session_id)
+            pipe.expire(self._user_key(user_id), self.ttl_seconds)
+            await pipe.execute()
+        except redis.RedisError as e:
+            raise SessionStoreUnavailable(str(e)) from e
+        return session_id, f"{session_id}.{secret}"
+
+    async def rotate(self, refresh_token: str, jti: str) -> Optional[Tuple[int, str, str]]:
+        """Swap a refresh token for a new one; returns (user_id, session_id, refresh_token)"""
+        parts = _split_token(refresh_token)
+        if parts is None:
+            return None
+        session_id, secret = parts
+        new_secret = _new_secret()
+        try:
+            result = await self._rotate(
+                keys=[self._key(session_id)],
+                args=[_hash_secret(secret), _hash_secret(new_secret), self.ttl_seconds, jti]
+            )
+        except redis.RedisError as e:
+            raise SessionStoreUnavailable(str(e)) from e
+
+        if result[0] == 0:
+            return None
+        user_id = int(result[1])
+        if result[0] == -1:
+            raise RefreshTokenReused(user_id, result[2] if len(result) > 2 else None)
+        return user_id, session_id, f"{session_id}.{new_secret}"
+
+    async def revoke(self, refresh_token: str) -> Optional[str]:
+        """End one session; returns the jti of its last access token"""
+        parts = _split_token(refresh_token)
+        if parts is None:
+            return None
+        try:
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.hget(self._key(parts[0]), "jti")
+            pipe.delete(self._key(parts[0]))
+            jti, _ = await pipe.execute()
+        except redis.RedisError as e:
+            raise SessionStoreUnavailable(str(e)) from e
+        return jti
+
+    async def revoke_user(self, user_id: int) -> List[str]:
+        """End every session of a user, e.g. on deactivation; returns their jtis"""
+        try:
+            session_ids = list(await self.redis_client.smembers(self._user_key(user_id)))
+            keys = [self._key(session_id) for session_id in session_ids]
+            pipe = self.redis_client.pipeline(transaction=True)
+            for key in keys:
+                pipe.hget(key, "jti")
+            pipe.delete(*keys, self._user_key(user_id))
+            results = await pipe.execute()
+        except redis.RedisError as e:
+            raise SessionStoreUnavailable(str(e)) from e
+        return [jti for jti in results[:-1] if jti]
+
+    async def create_invites(self, user_ids: List[int]) -> Dict[int, str]:
+        """Issue one invite token per user; returns user_id -> token"""
+        tokens = {user_id: _new_secret() for user_id in user_ids}
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for user_id, token in tokens.items():
+                pipe.set(self._invite_key(token), user_id, ex=self.invite_ttl_seconds)
+            await pipe.execute()
+        except redis.RedisError as e:
+            raise SessionStoreUnavailable(str(e)) from e
+        return tokens
+
+    async def redeem_invite(self, token: str) -> Optional[int]:
+        """Consume an invite token; returns its user id, or None if unknown or used"""
+        try:
+            user_id = await self.redis_client.getdel(self._invite_key(token))
+        except redis.RedisError as e:
+            raise SessionStoreUnavailable(str(e)) from e
+        return int(user_id) if user_id else None
+
+
+def create_session_store():
+    """Session store selected by SESSION_STORE_BACKEND"""
+    if SESSION_STORE_BACKEND == "memory":
+        return InMemorySessionStore()
+    return RedisSessionStore()
+
+
+session_store = create_session_store()
@@ -0,0 +1,84 @@
+"""RS256 signing keys and the JWKS document other services verify against.
+
+Private keys are PEM files in JWT_PRIVATE_KEYS_DIR, one per key, named
+``<kid>.pem``:
+
+    openssl genpkey -algorithm RSA -pkeyopt rsa_keygen_bits:2048 -out 2026-01.pem
+
+Every key in the directory is published at /.well-known/jwks.json; only
+JWT_ACTIVE_KID (default: the last kid in sort order) signs new tokens.
+To rotate, add the new key and wait one JWKS refresh interval so
+verifiers have it, switch JWT_ACTIVE_KID, then delete the old key once
+the last token it signed has expired.
+
+Without a keys directory an ephemeral key is generated per process. That
+is only suitable for a single local instance.
+"""
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from jose import jwk, jwt
+
+load_dotenv()
+
+JWT_ALGORITHM = "RS256"
+JWT_PRIVATE_KEYS_DIR = os.getenv("JWT_PRIVATE_KEYS_DIR", "")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID", "")
+
+
+def _generate_private_pem() -> bytes:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+
+class SigningKeyring:
+    def __init__(self, keys_dir: str = JWT_PRIVATE_KEYS_DIR, active_kid: str = JWT_ACTIVE_KID):
+        self._private_keys: Dict[str, jwk.Key] = {}
+        self._public_keys: Dict[str, jwk.Key] = {}
+
+        if keys_dir:
+            for path in sorted(Path(keys_dir).glob("*.pem")):
+                self._add_key(path.stem, path.read_bytes())
+
+        if not self._private_keys:
+            print("No JWT signing keys configured; using an ephemeral key for this process.")
+            self._add_key(f"ephemeral-{uuid.uuid4().hex[:8]}", _generate_private_pem())
+
+        self.active_kid = active_kid or sorted(self._private_keys)[-1]
+        if self.active_kid not in self._private_keys:
+            raise RuntimeError(f"JWT_ACTIVE_KID {self.active_kid!r} not found in {keys_dir}")
+
+    def _add_key(self, kid: str, pem: bytes):
+        private_key = jwk.construct(pem, JWT_ALGORITHM)
+        self._private_keys[kid] = private_key
+        self._public_keys[kid] = private_key.public_key()
+
+    def sign(self, claims: dict) -> str:
+        return jwt.encode(
+            claims,
+            self._private_keys[self.active_kid],
+            algorithm=JWT_ALGORITHM,
+            headers={"kid": self.active_kid}
+        )
+
+    def public_key(self, kid: Optional[str]) -> Optional[jwk.Key]:
+        return self._public_keys.get(kid)
+
+    def jwks(self) -> dict:
+        keys = []
+        for kid, public_key in sorted(self._public_keys.items()):
+            keys.append({**public_key.to_dict(), "kid": kid, "use": "sig", "alg": JWT_ALGORITHM})
+        return {"keys": keys}
+
+
+keyring = SigningKeyring()
@@ -0,0 +1,149 @@
+"""Bulk user provisioning.
+
+Rows are handled in chunks: each chunk is validated, checked against
+existing emails and usernames with a single query, hashed across the
+password pool and written with one multi-row INSERT. Rows without a
+password are created with an unusable password and get a single-use
+invite token instead. Results stream back as one JSON line per row,
+followed by a summary line.
+"""
+import csv
+import io
+import json
+from typing import AsyncIterator, Dict, List, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+from database import SessionLocal
+from hashing import password_hasher, UNUSABLE_PASSWORD
+from sessions import session_store
+
+IMPORT_CHUNK_SIZE = 500
+MAX_IMPORT_ROWS = 10000
+
+
+def parse_csv(content: bytes) -> List[dict]:
+    """Read an upload with a header row of email, username, full_name, role
+    and password; blank cells are treated as missing"""
+    reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+    return [
+        {key.strip(): value.strip() for key, value in record.items() if key and value and value.strip()}
+        for record in reader
+    ]
+
+
+def find_taken(db: Session, emails: List[str], usernames: List[str]) -> Tuple[Set[str], Set[str]]:
+    rows = db.execute(
+        select(models.User.email, models.User.username).where(
+            or_(models.User.email.in_(emails), models.User.username.in_(usernames))
+        )
+    ).all()
+    return {row.email for row in rows}, {row.username for row in rows}
+
+
+def insert_users(db: Session, values: List[dict]) -> Dict[str, int]:
+    """Insert users in one statement; returns email -> id for the rows written.
+
+    Rows that collide with a user created since find_taken are skipped
+    rather than failing the whole chunk.
+    """
+    stmt = pg_insert(models.User).values(values).on_conflict_do_nothing().returning(
+        models.User.id, models.User.email
+    )
+    created = {row.email: row.id for row in db.execute(stmt)}
+    db.commit()
+    return created
+
+
+def _failed(row_number: int, email, error: str) -> dict:
+    return {"row": row_number, "email": email, "status": "failed", "error": error}
+
+
+async def _import_chunk(chunk: List[dict], first_row: int, seen_emails: Set[str], seen_usernames: Set[str]) -> List[dict]:
+    results: Dict[int, dict] = {}
+    valid: List[Tuple[int, schemas.UserImportRow]] = []
+
+    for offset, raw in enumerate(chunk):
+        row_number = first_row + offset
+        try:
+            row = schemas.UserImportRow.model_validate(raw)
+        except ValidationError as e:
+            error = "; ".join(f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors())
+            results[row_number] = _failed(row_number, raw.get("email") if isinstance(raw, dict) else None, error)
+            continue
+        if row.email in seen_emails or row.username in seen_usernames:
+            results[row_number] = _failed(row_number, row.email, "Duplicate email or username in import")
+            continue
+        seen_emails.add(row.email)
+        seen_usernames.add(row.username)
+        valid.append((row_number, row))
+
+    if valid:
+        db = SessionLocal()
+        try:
+            taken_emails, taken_usernames = await run_in_threadpool(
+                find_taken, db, [row.email for _, row in valid], [row.username for _, row in valid]
+            )
+            fresh = []
+            for row_number, row in valid:
+                if row.email in taken_emails or row.username in taken_usernames:
+                    results[row_number] = _failed(row_number, row.email, "Email or username already registered")
+                else:
+                    fresh.append((row_number, row))
+
+            # Only rows that will actually be inserted pay for bcrypt
+            hashes = iter(await password_hasher.hash_many([row.password for _, row in fresh if row.password]))
+            values = [
+                {
+                    "email": row.email,
+                    "username": row.username,
+                    "full_name": row.full_name,
+                    "role": row.role,
+                    "hashed_password": next(hashes) if row.password else UNUSABLE_PASSWORD
+                }
+                for _, row in fresh
+            ]
+            created = await run_in_threadpool(insert_users, db, values) if values else {}
+        finally:
+            db.close()
+
+        invite_tokens = await session_store.create_invites(
+            [created[row.email] for _, row in fresh if not row.password and row.email in created]
+        )
+        for row_number, row in fresh:
+            user_id = created.get(row.email)
+            if user_id is None:
+                results[row_number] = _failed(row_number, row.email, "Email or username already registered")
+            elif row.password:
+                results[row_number] = {"row": row_number, "email": row.email, "status": "created", "id": user_id}
+            else:
+                results[row_number] = {
+                    "row": row_number,
+                    "email": row.email,
+                    "status": "invited",
+                    "id": user_id,
+                    "invite_token": invite_tokens[user_id]
+                }
+
+    return [results[row_number] for row_number in sorted(results)]
+
+
+async def import_users(rows: List[dict]) -> AsyncIterator[str]:
+    """Yield one NDJSON line per row (numbered from 1), then a summary line"""
+    summary = {"total": len(rows), "created": 0, "invited": 0, "failed": 0}
+    seen_emails: Set[str] = set()
+    seen_usernames: Set[str] = set()
+
+    for start in range(0, len(rows), IMPORT_CHUNK_SIZE):
+        chunk = rows[start:start + IMPORT_CHUNK_SIZE]
+        for result in await _import_chunk(chunk, start + 1, seen_emails, seen_usernames):
+            summary[result["status"]] += 1
+            yield json.dumps(result) + "\n"
+
+    yield json.dumps({"summary": summary}) + "\n"
@@ -5,12 +5,16 @@ import {
   Users, GraduationCap, DollarSign 
 } from 'lucide-react'
 import { useAuthStore } from '../../store/authStore'
+import { authAPI } from '../../services/api'
 
 const DashboardLayout = ({ isAdmin = false }) => {
   const navigate = useNavigate()
-  const { user, logout } = useAuthStore()
+  const { user, refreshToken, logout } = useAuthStore()
 
   const handleLogout = () => {
+    if (refreshToken) {
+      authAPI.logout(refreshToken).catch(() => {})
+    }
     logout()
     navigate('/login')
   }
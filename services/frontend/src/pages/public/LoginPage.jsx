@@ -16,8 +16,8 @@ const LoginPage = () => {
 
     try {
       const response = await authAPI.login(formData.email, formData.password)
-      const { access_token, user } = response.data
-      login(user, access_token)
+      const { access_token, refresh_token, user } = response.data
+      login(user, access_token, refresh_token)
       toast.success('Login successful!')
       navigate('/dashboard')
     } catch (error) {
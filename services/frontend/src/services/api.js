@@ -23,11 +23,42 @@ api.interceptors.request.use(
   }
 )
 
+// Access tokens are short-lived; one refresh is shared by all requests
+// that hit a 401 at the same time, since each refresh token is single-use
+let refreshPromise = null
+
+const refreshTokens = () => {
+  if (!refreshPromise) {
+    const { refreshToken, setTokens } = useAuthStore.getState()
+    refreshPromise = axios
+      .post('/api/auth/token/refresh', { refresh_token: refreshToken })
+      .then((response) => {
+        setTokens(response.data.access_token, response.data.refresh_token)
+        return response.data.access_token
+      })
+      .finally(() => {
+        refreshPromise = null
+      })
+  }
+  return refreshPromise
+}
+
 // Response interceptor
 api.interceptors.response.use(
   (response) => response,
-  (error) => {
+  async (error) => {
+    const config = error.config
     if (error.response?.status === 401) {
+      if (useAuthStore.getState().refreshToken && config && !config._retry) {
+        config._retry = true
+        try {
+          const token = await refreshTokens()
+          config.headers.Authorization = `Bearer ${token}`
+          return api(config)
+        } catch (refreshError) {
+          // Fall through to a fresh login
+        }
+      }
       useAuthStore.getState().logout()
       window.location.href = '/login'
       toast.error('Session expired. Please login again.')
@@ -41,6 +72,7 @@ export const authAPI = {
   login: (email, password) => api.post('/auth/login', { email, password }),
   register: (data) => api.post('/auth/register', data),
   getMe: () => api.get('/auth/me'),
+  logout: (refreshToken) => api.post('/auth/logout', { refresh_token: refreshToken }),
 }
 
 // Course API
@@ -56,6 +88,8 @@ export const enrollmentAPI = {
   getEnrollment: (id) => api.get(`/enrollments/${id}`),
   getCourseEnrollment: (courseId) => api.get(`/courses/${courseId}/enrollment`),
   updateProgress: (progressId, data) => api.put(`/progress/${progressId}`, data),
+  reportProgress: (data) => api.post('/progress/heartbeat', data),
+  syncProgress: (enrollmentId, items) => api.post('/progress/batch', { enrollment_id: enrollmentId, items }),
 }
 
 // Cart API
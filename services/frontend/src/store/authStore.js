@@ -6,14 +6,19 @@ export const useAuthStore = create(
     (set, get) => ({
       user: null,
       token: null,
+      refreshToken: null,
       isAuthenticated: false,
 
-      login: (user, token) => {
-        set({ user, token, isAuthenticated: true })
+      login: (user, token, refreshToken) => {
+        set({ user, token, refreshToken, isAuthenticated: true })
+      },
+
+      setTokens: (token, refreshToken) => {
+        set({ token, refreshToken })
       },
 
       logout: () => {
-        set({ user: null, token: null, isAuthenticated: false })
+        set({ user: null, token: null, refreshToken: null, isAuthenticated: false })
       },
 
       updateUser: (user) => {
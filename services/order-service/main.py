@@ -1,44 +1,39 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import insert, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from typing import List, Optional
 from datetime import datetime
 import uuid
 
 import models
 import schemas
-from database import engine, get_db
-from auth_middleware import verify_token, verify_admin
+import progress as progress_store
+from database import engine, get_db, SessionLocal
+from service_toolkit import events
+from service_toolkit.app import add_lifecycle_hooks, create_app
+from service_toolkit.auth import token_verifier, verify_token, verify_admin, verify_service
+from service_toolkit.idempotency import add_idempotency
+from service_toolkit.serialization import list_response
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
+events.create_event_tables(engine)
 
-app = FastAPI(
+app = create_app(
     title="Execute Tech Academy - Order Service",
     description="Enrollment and Order Management Service",
-    version="1.0.0"
+    service_name="Order Service"
 )
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Retried creates with the same Idempotency-Key replay the first response
+add_idempotency(app, routes=[("POST", "/orders")], namespace="order-service", engine=engine)
 
-@app.get("/")
-def read_root():
-    return {
-        "service": "Order Service",
-        "status": "running",
-        "version": "1.0.0"
-    }
+add_lifecycle_hooks(app, stop=token_verifier.stop)
 
-@app.get("/health")
-def health_check():
-    return {"status": "healthy"}
+ORDER_EVENTS_STREAM = "orders.events"
+PAYMENT_EVENTS_STREAM = "payments.events"
 
 # ==================== CART ENDPOINTS ====================
 
@@ -158,6 +153,74 @@ def clear_cart(
 
 # ==================== ORDER ENDPOINTS ====================
 
+def add_order_event(db: Session, event_type: str, order: models.Order):
+    """Stage an order event in the outbox, committed with the order change"""
+    events.add_event(
+        db,
+        event_type,
+        aggregate_type="order",
+        aggregate_id=order.id,
+        payload={
+            "order_id": order.id,
+            "order_number": order.order_number,
+            "student_id": order.student_id,
+            "final_amount": order.final_amount,
+            "status": order.status.value,
+            "payment_id": order.payment_id
+        }
+    )
+
+def enroll_orders(db: Session, order_ids: List[int]) -> int:
+    """Create enrollments for every course in the given orders.
+    
+    One INSERT ... SELECT for any number of orders and items; courses the
+    student is already enrolled in are skipped by the unique
+    (student_id, course_id) constraint. Returns the number created.
+    """
+    enrollment = models.Enrollment.__table__.c
+    rows = select(
+        models.Order.student_id,
+        models.OrderItem.course_id,
+        models.Order.id,
+        literal(models.EnrollmentStatus.ACTIVE, type_=enrollment.status.type),
+        literal(0.0),
+        literal(0),
+        literal(0),
+        literal(False)
+    ).join(
+        models.OrderItem, models.OrderItem.order_id == models.Order.id
+    ).where(models.Order.id.in_(order_ids))
+    
+    stmt = pg_insert(models.Enrollment).from_select(
+        [
+            "student_id", "course_id", "order_id", "status",
+            "progress_percentage", "completed_lessons", "total_lessons", "certificate_issued"
+        ],
+        rows
+    ).on_conflict_do_nothing(index_elements=["student_id", "course_id"])
+    return db.execute(stmt).rowcount
+
+def confirm_orders(db: Session, order_ids: List[int]):
+    """Confirm the pending orders among order_ids in one UPDATE and enroll their students.
+
+    Failed and refunded orders are left as they are.
+    """
+    orders = db.scalars(
+        update(models.Order).where(
+            models.Order.id.in_(order_ids),
+            models.Order.status == models.OrderStatus.PENDING
+        ).values(status=models.OrderStatus.CONFIRMED).returning(models.Order),
+        execution_options={"synchronize_session": False}
+    ).all()
+    
+    enrollments_created = 0
+    if orders:
+        enrollments_created = enroll_orders(db, [order.id for order in orders])
+        for order in orders:
+            add_order_event(db, "order.status_changed", order)
+    
+    return orders, enrollments_created
+
 @app.post("/orders", response_model=schemas.OrderResponse, status_code=status.HTTP_201_CREATED)
 def create_order(
     order: schemas.OrderCreate,
@@ -165,40 +228,53 @@ def create_order(
     current_user: dict = Depends(verify_token)
 ):
     # Calculate totals
-    total_amount = sum(item["price"] for item in order.items)
+    total_amount = sum(item.price for item in order.items)
+    if order.discount_amount > total_amount:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Discount exceeds order total"
+        )
     final_amount = total_amount - order.discount_amount
     
     # Generate order number
     order_number = f"ORD-{uuid.uuid4().hex[:8].upper()}"
     
-    # Create order
-    db_order = models.Order(
-        order_number=order_number,
-        student_id=current_user["user_id"],
-        total_amount=total_amount,
-        discount_amount=order.discount_amount,
-        final_amount=final_amount,
-        notes=order.notes
-    )
-    db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
-    
-    # Create order items
-    for item in order.items:
-        order_item = models.OrderItem(
-            order_id=db_order.id,
-            course_id=item["course_id"],
-            course_title=item["title"],
-            price=item["price"],
-            discount=0.0,
-            final_price=item["price"]
-        )
-        db.add(order_item)
+    # Order and items go in with one INSERT ... RETURNING each, in a single transaction
+    db_order = db.scalars(
+        insert(models.Order).returning(models.Order),
+        [{
+            "order_number": order_number,
+            "student_id": current_user["user_id"],
+            "total_amount": total_amount,
+            "discount_amount": order.discount_amount,
+            "final_amount": final_amount,
+            "status": models.OrderStatus.PENDING,
+            "notes": order.notes
+        }]
+    ).one()
+    
+    order_items = db.scalars(
+        insert(models.OrderItem).returning(models.OrderItem),
+        [
+            {
+                "order_id": db_order.id,
+                "course_id": item.course_id,
+                "course_title": item.title,
+                "price": item.price,
+                "discount": 0.0,
+                "final_price": item.price
+            }
+            for item in order.items
+        ]
+    ).all()
+    set_committed_value(db_order, "items", order_items)
+    
+    add_order_event(db, "order.created", db_order)
     
+    # Serialize before commit so expired attributes aren't reloaded
+    response = schemas.OrderResponse.model_validate(db_order)
     db.commit()
-    db.refresh(db_order)
-    return db_order
+    return response
 
 @app.get("/orders", response_model=List[schemas.OrderResponse])
 def list_orders(
@@ -207,16 +283,49 @@ def list_orders(
     db: Session = Depends(get_db),
     current_user: dict = Depends(verify_token)
 ):
+    # Load every order's items in one extra query instead of one per order
+    query = db.query(models.Order).options(selectinload(models.Order.items))
     if current_user["role"] == "admin":
         # Admins can see all orders
-        orders = db.query(models.Order).offset(skip).limit(limit).all()
+        orders = query.offset(skip).limit(limit).all()
     else:
         # Students see only their orders
-        orders = db.query(models.Order).filter(
+        orders = query.filter(
             models.Order.student_id == current_user["user_id"]
         ).offset(skip).limit(limit).all()
     
-    return orders
+    return list_response(schemas.OrderResponse, orders)
+
+@app.post("/orders/confirm", response_model=schemas.OrderBulkConfirmResponse)
+def confirm_orders_bulk(
+    request: schemas.OrderBulkConfirm,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_admin)
+):
+    """Confirm many pending orders and create their enrollments in one transaction; other ids are returned as skipped"""
+    order_ids = list(dict.fromkeys(request.order_ids))
+    orders, enrollments_created = confirm_orders(db, order_ids)
+    confirmed_ids = {order.id for order in orders}
+    db.commit()
+    
+    return {
+        "confirmed_order_ids": [order_id for order_id in order_ids if order_id in confirmed_ids],
+        "skipped_order_ids": [order_id for order_id in order_ids if order_id not in confirmed_ids],
+        "enrollments_created": enrollments_created
+    }
+
+@app.post("/orders/lookup", response_model=List[schemas.OrderResponse])
+def lookup_orders(
+    request: schemas.OrderLookup,
+    db: Session = Depends(get_db),
+    _: None = Depends(verify_service)
+):
+    """Orders with their items by id, for other services; unknown ids are left out"""
+    orders = db.query(models.Order).options(selectinload(models.Order.items)).filter(
+        models.Order.id.in_(set(request.order_ids))
+    ).order_by(models.Order.id).all()
+    
+    return list_response(schemas.OrderResponse, orders)
 
 @app.get("/orders/{order_id}", response_model=schemas.OrderResponse)
 def get_order(
@@ -256,31 +365,73 @@ def update_order(
             detail="Order not found"
         )
     
+    previous_status = order.status
+    
     for key, value in order_update.dict(exclude_unset=True).items():
         setattr(order, key, value)
     
     # If order is confirmed, create enrollments
-    if order_update.status == models.OrderStatus.CONFIRMED and order.status != models.OrderStatus.CONFIRMED:
-        for item in order.items:
-            # Check if enrollment already exists
-            existing = db.query(models.Enrollment).filter(
-                models.Enrollment.student_id == order.student_id,
-                models.Enrollment.course_id == item.course_id
-            ).first()
-            
-            if not existing:
-                enrollment = models.Enrollment(
-                    student_id=order.student_id,
-                    course_id=item.course_id,
-                    order_id=order.id,
-                    status=models.EnrollmentStatus.ACTIVE
-                )
-                db.add(enrollment)
+    if order.status == models.OrderStatus.CONFIRMED and previous_status != models.OrderStatus.CONFIRMED:
+        enroll_orders(db, [order.id])
+    
+    if order.status != previous_status:
+        add_order_event(db, "order.status_changed", order)
     
     db.commit()
     db.refresh(order)
     return order
 
+# ==================== PAYMENT EVENTS ====================
+
+def handle_payment_completed(db: Session, event: dict):
+    """Confirm the paid order and enroll the student"""
+    payload = event["payload"]
+    order = db.query(models.Order).filter(
+        models.Order.id == payload["order_id"]
+    ).with_for_update().first()
+    
+    # Replays and duplicate payments for the same order are no-ops
+    if not order or order.status == models.OrderStatus.CONFIRMED:
+        return
+    
+    order.status = models.OrderStatus.CONFIRMED
+    order.payment_id = payload["payment_id"]
+    enroll_orders(db, [order.id])
+    add_order_event(db, "order.status_changed", order)
+
+def handle_payment_unsuccessful(db: Session, event: dict):
+    """Fail a pending order whose payment failed or expired unpaid"""
+    payload = event["payload"]
+    order = db.query(models.Order).filter(
+        models.Order.id == payload["order_id"]
+    ).with_for_update().first()
+    
+    # A later successful payment still confirms the order
+    if not order or order.status != models.OrderStatus.PENDING:
+        return
+    
+    order.status = models.OrderStatus.FAILED
+    add_order_event(db, "order.status_changed", order)
+
+outbox_relay = events.OutboxRelay(SessionLocal, events.get_event_bus(), ORDER_EVENTS_STREAM)
+progress_flusher = progress_store.ProgressFlusher(SessionLocal, progress_store.get_progress_buffer())
+enrollment_owners = progress_store.EnrollmentOwnerCache()
+payment_events_consumer = events.EventConsumer(
+    SessionLocal,
+    events.get_event_bus(),
+    PAYMENT_EVENTS_STREAM,
+    group="order-service",
+    handlers={
+        "payment.completed": handle_payment_completed,
+        "payment.failed": handle_payment_unsuccessful,
+        "payment.cancelled": handle_payment_unsuccessful
+    }
+)
+
+add_lifecycle_hooks(app, start=outbox_relay.start, stop=outbox_relay.stop)
+add_lifecycle_hooks(app, start=payment_events_consumer.start, stop=payment_events_consumer.stop)
+add_lifecycle_hooks(app, start=progress_flusher.start, stop=progress_flusher.stop)
+
 # ==================== ENROLLMENT ENDPOINTS ====================
 
 @app.post("/enrollments", response_model=schemas.EnrollmentResponse, status_code=status.HTTP_201_CREATED)
@@ -326,7 +477,7 @@ def list_enrollments(
             models.Enrollment.student_id == current_user["user_id"]
         ).offset(skip).limit(limit).all()
     
-    return enrollments
+    return list_response(schemas.EnrollmentResponse, enrollments)
 
 @app.get("/enrollments/{enrollment_id}", response_model=schemas.EnrollmentResponse)
 def get_enrollment(
@@ -442,20 +593,65 @@ def update_lesson_progress(
     if progress_update.is_completed and not progress.completed_at:
         progress.completed_at = datetime.utcnow()
         
-        # Update enrollment progress
-        enrollment.completed_lessons += 1
-        if enrollment.total_lessons > 0:
-            enrollment.progress_percentage = (enrollment.completed_lessons / enrollment.total_lessons) * 100
-        
-        # Check if course is completed
-        if enrollment.completed_lessons >= enrollment.total_lessons and enrollment.total_lessons > 0:
-            enrollment.status = models.EnrollmentStatus.COMPLETED
-            enrollment.completed_at = datetime.utcnow()
+        # Recount in SQL under the enrollment lock so concurrent completions are counted
+        db.flush()
+        progress_store.refresh_enrollment_progress(db, [enrollment.id])
     
     db.commit()
     db.refresh(progress)
     return progress
 
+@app.post("/progress/heartbeat", status_code=status.HTTP_202_ACCEPTED)
+def report_lesson_progress(
+    heartbeat: schemas.LessonProgressHeartbeat,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    """Buffer a player heartbeat; it is written with the next bulk flush"""
+    owner = enrollment_owners.get_owner(db, heartbeat.enrollment_id)
+    if owner != current_user["user_id"]:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Enrollment not found"
+        )
+    
+    progress_flusher.buffer.record(heartbeat.dict())
+    return {"status": "accepted"}
+
+@app.post("/progress/batch", response_model=List[schemas.LessonProgressResponse])
+def sync_lesson_progress(
+    batch: schemas.LessonProgressBatch,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    """Apply many lesson progress records for one enrollment; returns only changed rows"""
+    # Verify ownership once for the whole batch
+    enrollment = db.query(models.Enrollment.id).filter(
+        models.Enrollment.id == batch.enrollment_id,
+        models.Enrollment.student_id == current_user["user_id"]
+    ).first()
+    
+    if not enrollment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Enrollment not found"
+        )
+    
+    # Collapse repeated lessons; one UPSERT cannot touch the same row twice
+    rows = {}
+    for item in batch.items:
+        record = dict(item.dict(), enrollment_id=batch.enrollment_id)
+        rows[item.lesson_id] = progress_store.merge_progress(rows.get(item.lesson_id), record)
+    
+    changed = progress_store.upsert_lesson_progress(db, list(rows.values()))
+    if changed:
+        progress_store.refresh_enrollment_progress(db, [batch.enrollment_id])
+    
+    # Serialize before commit so expired attributes aren't reloaded
+    response = [schemas.LessonProgressResponse.model_validate(row) for row in changed]
+    db.commit()
+    return response
+
 @app.get("/enrollments/{enrollment_id}/progress", response_model=List[schemas.LessonProgressResponse])
 def get_enrollment_progress(
     enrollment_id: int,
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -52,6 +52,7 @@ class OrderItem(Base):
 
 class Enrollment(Base):
     __tablename__ = "enrollments"
+    __table_args__ = (UniqueConstraint("student_id", "course_id", name="uq_enrollments_student_course"),)
 
     id = Column(Integer, primary_key=True, index=True)
     student_id = Column(Integer, nullable=False, index=True)  # References auth service user
@@ -74,6 +75,7 @@ class Enrollment(Base):
 
 class LessonProgress(Base):
     __tablename__ = "lesson_progress"
+    __table_args__ = (UniqueConstraint("enrollment_id", "lesson_id", name="uq_lesson_progress_enrollment_lesson"),)
 
     id = Column(Integer, primary_key=True, index=True)
     enrollment_id = Column(Integer, ForeignKey("enrollments.id"), nullable=False)
@@ -0,0 +1,356 @@
+"""Lesson progress write path.
+
+Player heartbeats are coalesced per (enrollment, lesson) in a buffer
+(Redis or in-process) and flushed by ``ProgressFlusher`` as one bulk
+UPSERT per batch. Enrollment completion counters are always recomputed
+in SQL from lesson_progress, after locking the enrollment rows, so a
+recount never misses a completion committed by a concurrent writer.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import Float, and_, case, cast, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+import models
+from service_toolkit.events import BackgroundWorker
+
+load_dotenv()
+
+PROGRESS_BUFFER_BACKEND = os.getenv("PROGRESS_BUFFER_BACKEND", "redis")
+PROGRESS_FLUSH_INTERVAL = float(os.getenv("PROGRESS_FLUSH_INTERVAL", "5"))
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+
+ProgressKey = Tuple[int, int]
+
+
+# ==================== SQL ====================
+
+def upsert_lesson_progress(db: Session, rows: List[dict]):
+    """Insert or merge many lesson progress rows in one statement.
+
+    Each row carries enrollment_id, lesson_id, last_position,
+    time_spent_minutes and is_completed; (enrollment_id, lesson_id) must be
+    unique within ``rows``. Positions take the newest value, time spent
+    never goes backwards and completion is sticky. Rows the merge would
+    leave untouched are skipped, so only inserted or changed rows are
+    returned.
+    """
+    now = datetime.utcnow()
+    values = [
+        {
+            "enrollment_id": row["enrollment_id"],
+            "lesson_id": row["lesson_id"],
+            "last_position": row["last_position"],
+            "time_spent_minutes": row["time_spent_minutes"],
+            "is_completed": row["is_completed"],
+            "completed_at": now if row["is_completed"] else None
+        }
+        for row in rows
+    ]
+
+    progress = models.LessonProgress.__table__.c
+    stmt = pg_insert(models.LessonProgress).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["enrollment_id", "lesson_id"],
+        set_={
+            "last_position": stmt.excluded.last_position,
+            "time_spent_minutes": func.greatest(progress.time_spent_minutes, stmt.excluded.time_spent_minutes),
+            "is_completed": progress.is_completed | stmt.excluded.is_completed,
+            "completed_at": func.coalesce(progress.completed_at, stmt.excluded.completed_at),
+            "updated_at": func.now()
+        },
+        where=(
+            progress.last_position.is_distinct_from(stmt.excluded.last_position)
+            | (stmt.excluded.time_spent_minutes > progress.time_spent_minutes)
+            | (stmt.excluded.is_completed & ~progress.is_completed)
+        )
+    ).returning(models.LessonProgress)
+    return db.scalars(stmt, execution_options={"populate_existing": True}).all()
+
+
+def refresh_enrollment_progress(db: Session, enrollment_ids: List[int]):
+    """Recompute completion counters for enrollments from lesson_progress.
+
+    A single UPDATE derives completed_lessons from the rows themselves
+    instead of read-modify-writing a counter in Python. The enrollments are
+    locked by a separate statement first: under READ COMMITTED an UPDATE
+    that waited on another writer's row lock would still count with its
+    original snapshot and miss that writer's completions, whereas a
+    statement issued after the lock sees them.
+    """
+    if not enrollment_ids:
+        return
+    enrollment = models.Enrollment
+    # Ordered, so writers touching overlapping enrollments cannot deadlock
+    db.execute(
+        select(enrollment.id).where(enrollment.id.in_(enrollment_ids)).order_by(enrollment.id).with_for_update()
+    )
+    completed_lessons = select(func.count(models.LessonProgress.id)).where(
+        models.LessonProgress.enrollment_id == enrollment.id,
+        models.LessonProgress.is_completed.is_(True)
+    ).scalar_subquery()
+    is_finished = and_(enrollment.total_lessons > 0, completed_lessons >= enrollment.total_lessons)
+
+    db.execute(
+        update(enrollment).where(enrollment.id.in_(enrollment_ids)).values(
+            completed_lessons=completed_lessons,
+            progress_percentage=case(
+                (enrollment.total_lessons > 0, cast(completed_lessons, Float) * 100 / enrollment.total_lessons),
+                else_=enrollment.progress_percentage
+            ),
+            status=case(
+                (is_finished, literal(models.EnrollmentStatus.COMPLETED, type_=enrollment.__table__.c.status.type)),
+                else_=enrollment.status
+            ),
+            completed_at=case(
+                (is_finished, func.coalesce(enrollment.completed_at, func.now())),
+                else_=enrollment.completed_at
+            ),
+            started_at=func.coalesce(enrollment.started_at, func.now()),
+            last_accessed_at=func.now()
+        ).execution_options(synchronize_session=False)
+    )
+
+
+# ==================== BUFFERS ====================
+
+def merge_progress(current: Optional[dict], update: dict) -> dict:
+    """Coalesce two updates for the same (enrollment, lesson)"""
+    if current is None:
+        return dict(update)
+    return {
+        "enrollment_id": update["enrollment_id"],
+        "lesson_id": update["lesson_id"],
+        "last_position": update["last_position"],
+        "time_spent_minutes": max(current["time_spent_minutes"], update["time_spent_minutes"]),
+        "is_completed": current["is_completed"] or update["is_completed"]
+    }
+
+
+class InMemoryProgressBuffer:
+    """Per-process buffer; unflushed heartbeats are lost if the pod dies"""
+
+    def __init__(self):
+        self._pending: Dict[ProgressKey, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, update: dict):
+        key = (update["enrollment_id"], update["lesson_id"])
+        with self._lock:
+            self._pending[key] = merge_progress(self._pending.get(key), update)
+
+    def drain(self, max_items: int) -> List[dict]:
+        with self._lock:
+            keys = list(self._pending)[:max_items]
+            return [self._pending.pop(key) for key in keys]
+
+    def requeue(self, rows: List[dict]):
+        """Put back drained rows without rewinding newer heartbeats"""
+        with self._lock:
+            for row in rows:
+                key = (row["enrollment_id"], row["lesson_id"])
+                current = self._pending.get(key)
+                # A heartbeat recorded since the drain is newer; keep its position
+                self._pending[key] = merge_progress(row, current) if current else dict(row)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+
+class RedisProgressBuffer:
+    """Redis buffer shared by all replicas.
+
+    Buffered heartbeats survive pod restarts, but a drained batch lives
+    only in the flushing process until it commits; if that pod dies
+    mid-flush the batch is lost and the next heartbeat for each lesson
+    writes it again.
+    """
+
+    DIRTY_SET = "progress:dirty"
+    KEY_PREFIX = "progress:buf:"
+
+    # Merge one heartbeat into its hash and mark the key dirty, atomically
+    RECORD_SCRIPT = """
+    redis.call('HSET', KEYS[1], 'enrollment_id', ARGV[1], 'lesson_id', ARGV[2], 'last_position', ARGV[3])
+    local spent = tonumber(redis.call('HGET', KEYS[1], 'time_spent_minutes') or '0')
+    if tonumber(ARGV[4]) > spent then
+        redis.call('HSET', KEYS[1], 'time_spent_minutes', ARGV[4])
+    end
+    if ARGV[5] == '1' or not redis.call('HGET', KEYS[1], 'is_completed') then
+        redis.call('HSET', KEYS[1], 'is_completed', ARGV[5])
+    end
+    redis.call('SADD', KEYS[2], KEYS[1])
+    """
+
+    # Put back a drained row after a failed flush. A hash that exists again
+    # holds a newer heartbeat, so only merge the monotonic fields into it
+    REQUEUE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        local spent = tonumber(redis.call('HGET', KEYS[1], 'time_spent_minutes') or '0')
+        if tonumber(ARGV[4]) > spent then
+            redis.call('HSET', KEYS[1], 'time_spent_minutes', ARGV[4])
+        end
+        if ARGV[5] == '1' then
+            redis.call('HSET', KEYS[1], 'is_completed', '1')
+        end
+    else
+        redis.call('HSET', KEYS[1], 'enrollment_id', ARGV[1], 'lesson_id', ARGV[2], 'last_position', ARGV[3],
+            'time_spent_minutes', ARGV[4], 'is_completed', ARGV[5])
+    end
+    redis.call('SADD', KEYS[2], KEYS[1])
+    """
+
+    # Read and delete a batch of hashes in one step so no heartbeat slips between
+    DRAIN_SCRIPT = """
+    local result = {}
+    for i, key in ipairs(KEYS) do
+        result[i] = redis.call('HGETALL', key)
+        redis.call('DEL', key)
+    end
+    return result
+    """
+
+    def __init__(self, host: str = REDIS_HOST, port: int = REDIS_PORT):
+        import redis
+
+        self.redis_client = redis.Redis(host=host, port=port, decode_responses=True)
+        self._record = self.redis_client.register_script(self.RECORD_SCRIPT)
+        self._requeue = self.redis_client.register_script(self.REQUEUE_SCRIPT)
+        self._drain = self.redis_client.register_script(self.DRAIN_SCRIPT)
+
+    def _call(self, script, update: dict):
+        key = f"{self.KEY_PREFIX}{update['enrollment_id']}:{update['lesson_id']}"
+        script(
+            keys=[key, self.DIRTY_SET],
+            args=[
+                update["enrollment_id"],
+                update["lesson_id"],
+                update["last_position"],
+                update["time_spent_minutes"],
+                "1" if update["is_completed"] else "0"
+            ]
+        )
+
+    def record(self, update: dict):
+        self._call(self._record, update)
+
+    def requeue(self, rows: List[dict]):
+        """Put back drained rows without rewinding newer heartbeats"""
+        for row in rows:
+            self._call(self._requeue, row)
+
+    def drain(self, max_items: int) -> List[dict]:
+        keys = self.redis_client.spop(self.DIRTY_SET, max_items)
+        if not keys:
+            return []
+        drained = []
+        for flat in self._drain(keys=keys):
+            if not flat:
+                continue
+            fields = dict(zip(flat[::2], flat[1::2]))
+            drained.append({
+                "enrollment_id": int(fields["enrollment_id"]),
+                "lesson_id": int(fields["lesson_id"]),
+                "last_position": int(fields["last_position"]),
+                "time_spent_minutes": int(fields.get("time_spent_minutes", 0)),
+                "is_completed": fields.get("is_completed") == "1"
+            })
+        return drained
+
+    def size(self) -> int:
+        return self.redis_client.scard(self.DIRTY_SET)
+
+
+_progress_buffer = None
+
+
+def get_progress_buffer():
+    """Process-wide progress buffer selected by PROGRESS_BUFFER_BACKEND"""
+    global _progress_buffer
+    if _progress_buffer is None:
+        if PROGRESS_BUFFER_BACKEND == "memory":
+            _progress_buffer = InMemoryProgressBuffer()
+        else:
+            _progress_buffer = RedisProgressBuffer()
+    return _progress_buffer
+
+
+class EnrollmentOwnerCache:
+    """Bounded LRU of enrollment_id -> student_id.
+
+    Ownership never changes once an enrollment exists, so heartbeats only
+    hit the database the first time an enrollment is seen.
+    """
+
+    def __init__(self, max_size: int = 50000):
+        self.max_size = max_size
+        self._owners: "OrderedDict[int, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_owner(self, db: Session, enrollment_id: int) -> Optional[int]:
+        with self._lock:
+            if enrollment_id in self._owners:
+                self._owners.move_to_end(enrollment_id)
+                return self._owners[enrollment_id]
+
+        owner = db.query(models.Enrollment.student_id).filter(
+            models.Enrollment.id == enrollment_id
+        ).scalar()
+        if owner is None:
+            return None
+
+        with self._lock:
+            self._owners[enrollment_id] = owner
+            if len(self._owners) > self.max_size:
+                self._owners.popitem(last=False)
+        return owner
+
+
+# ==================== FLUSHER ====================
+
+class ProgressFlusher(BackgroundWorker):
+    """Periodically writes buffered heartbeats with bulk UPSERTs"""
+
+    def __init__(self, session_factory, buffer, batch_size: int = 500, flush_interval: float = PROGRESS_FLUSH_INTERVAL):
+        super().__init__("progress-flusher")
+        self.session_factory = session_factory
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.idle_interval = flush_interval
+
+    def run_once(self) -> int:
+        """Flush one batch; returns the number of lesson rows written"""
+        rows = self.buffer.drain(self.batch_size)
+        if not rows:
+            return 0
+
+        db = self.session_factory()
+        try:
+            upsert_lesson_progress(db, rows)
+            refresh_enrollment_progress(db, sorted({row["enrollment_id"] for row in rows}))
+            db.commit()
+            return len(rows)
+        except Exception:
+            db.rollback()
+            # Put the batch back so the next flush retries it
+            self.buffer.requeue(rows)
+            raise
+        finally:
+            db.close()
+
+    def stop(self, timeout: float = 5.0):
+        super().stop(timeout)
+        # Drain what is left so a graceful shutdown loses nothing
+        try:
+            while self.run_once():
+                pass
+        except Exception as e:
+            print(f"Final progress flush failed: {e}")
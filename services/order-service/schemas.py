@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List
 from datetime import datetime
 from models import EnrollmentStatus, OrderStatus
@@ -42,15 +42,39 @@ class OrderItemResponse(OrderItemBase):
     class Config:
         from_attributes = True
 
+class OrderItemCreate(BaseModel):
+    course_id: int
+    title: str
+    price: float = Field(..., ge=0)
+
 class OrderCreate(BaseModel):
-    items: List[dict]  # List of {course_id, price, title}
-    discount_amount: float = 0.0
+    items: List[OrderItemCreate] = Field(..., min_length=1)
+    discount_amount: float = Field(0.0, ge=0)
     notes: Optional[str] = None
+    
+    @field_validator("items")
+    @classmethod
+    def unique_courses(cls, items: List[OrderItemCreate]) -> List[OrderItemCreate]:
+        course_ids = [item.course_id for item in items]
+        if len(course_ids) != len(set(course_ids)):
+            raise ValueError("Each course can only appear once per order")
+        return items
 
 class OrderUpdate(BaseModel):
     status: Optional[OrderStatus] = None
     payment_id: Optional[str] = None
 
+class OrderBulkConfirm(BaseModel):
+    order_ids: List[int] = Field(..., min_length=1, max_length=1000)
+
+class OrderLookup(BaseModel):
+    order_ids: List[int] = Field(..., min_length=1, max_length=1000)
+
+class OrderBulkConfirmResponse(BaseModel):
+    confirmed_order_ids: List[int]
+    skipped_order_ids: List[int]
+    enrollments_created: int
+
 class OrderResponse(BaseModel):
     id: int
     order_number: str
@@ -105,6 +129,19 @@ class LessonProgressUpdate(BaseModel):
     time_spent_minutes: Optional[int] = None
     last_position: Optional[int] = None
 
+class LessonProgressSync(BaseModel):
+    lesson_id: int
+    last_position: int = Field(..., ge=0)
+    time_spent_minutes: int = Field(0, ge=0)
+    is_completed: bool = False
+
+class LessonProgressHeartbeat(LessonProgressSync):
+    enrollment_id: int
+
+class LessonProgressBatch(BaseModel):
+    enrollment_id: int
+    items: List[LessonProgressSync] = Field(..., min_length=1, max_length=1000)
+
 class LessonProgressResponse(BaseModel):
     id: int
     enrollment_id: int
@@ -0,0 +1,36 @@
+"""Check every wallet's balance against its ledger.
+
+Run in the payment-service image (the payment-ledger-audit CronJob does
+this nightly):
+
+    python audit_ledger.py [--batch-size 500]
+
+Prints one line per wallet whose entries do not chain or do not add up to
+Wallet.balance_minor and exits 1 if there were any.
+"""
+import argparse
+import sys
+
+from database import SessionLocal
+from ledger import audit_wallets
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Wallet ledger audit")
+    parser.add_argument("--batch-size", type=int, default=500, help="Wallets checked per transaction")
+    args = parser.parse_args()
+
+    mismatches = 0
+    for report in audit_wallets(SessionLocal, batch_size=args.batch_size):
+        mismatches += 1
+        print(
+            f"wallet {report['wallet_id']}: balance {report['balance_minor']}, "
+            f"ledger {report['ledger_balance_minor']}, broken entries {report['broken_entries']}"
+        )
+
+    print(f"Ledger audit finished: {mismatches} wallet(s) out of balance")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""Content-addressed blob storage for generated documents.
+
+A blob's key is the SHA-256 of its bytes, so storing the same document
+twice is a no-op and a stored blob never changes. BLOB_STORE_BACKEND picks
+the backend: local (a directory; it must be a shared volume when more than
+one replica serves downloads) or s3 (any S3-compatible service, via
+boto3). Both read byte ranges without loading the whole blob.
+"""
+import hashlib
+import os
+import tempfile
+from typing import Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "local")
+BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH", "/app/data/blobs")
+BLOB_S3_BUCKET = os.getenv("BLOB_S3_BUCKET", "")
+BLOB_S3_PREFIX = os.getenv("BLOB_S3_PREFIX", "blobs/")
+BLOB_S3_ENDPOINT_URL = os.getenv("BLOB_S3_ENDPOINT_URL") or None  # MinIO etc.; None means AWS
+
+CHUNK_SIZE = 64 * 1024
+
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class LocalBlobStore:
+    def __init__(self, root: str = BLOB_STORE_PATH):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, data: bytes, content_type: str = "application/octet-stream") -> str:
+        key = content_key(data)
+        path = self._path(key)
+        if os.path.exists(path):
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return key
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self._path(key))
+        except FileNotFoundError:
+            return None
+
+    def iter_range(self, key: str, start: int, end: int) -> Iterator[bytes]:
+        """Bytes start..end inclusive"""
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+class S3BlobStore:
+    def __init__(self, bucket: str = BLOB_S3_BUCKET, prefix: str = BLOB_S3_PREFIX, endpoint_url: Optional[str] = BLOB_S3_ENDPOINT_URL):
+        import boto3
+
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, data: bytes, content_type: str = "application/octet-stream") -> str:
+        key = content_key(data)
+        if self.size(key) is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data, ContentType=content_type)
+        return key
+
+    def size(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)["ContentLength"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def iter_range(self, key: str, start: int, end: int) -> Iterator[bytes]:
+        response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key, Range=f"bytes={start}-{end}")
+        yield from response["Body"].iter_chunks(CHUNK_SIZE)
+
+
+_blob_store = None
+
+
+def get_blob_store():
+    """Process-wide blob store selected by BLOB_STORE_BACKEND"""
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = S3BlobStore() if BLOB_STORE_BACKEND == "s3" else LocalBlobStore()
+    return _blob_store
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a single-range Range header, None to send everything.
+
+    Multi-range and malformed headers are ignored, which RFC 9110 allows;
+    a well-formed range outside the blob raises RangeNotSatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, size - int(last))
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end or size == 0:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
@@ -0,0 +1,137 @@
+"""Invoice PDF rendering.
+
+render_invoice_pdf turns an invoice payload (a plain dict, so it pickles to
+worker processes) into a PDF written directly with the built-in Helvetica
+fonts, so no PDF library is needed. Nothing time- or run-dependent goes
+into the file: the same payload always produces the same bytes, which is
+what lets the blob store deduplicate by content.
+
+Keep this module free of FastAPI and database imports: worker processes
+import it on spawn.
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Tuple
+
+# Bump when the layout changes so existing invoices are re-rendered
+TEMPLATE_VERSION = "1"
+
+PAGE_WIDTH = 595  # A4 in points
+PAGE_HEIGHT = 842
+MARGIN = 50
+LINE_HEIGHT = 16
+
+# (font, size, x, y, text)
+DrawOp = Tuple[str, int, float, float, str]
+
+
+def source_hash(payload: Dict[str, Any]) -> str:
+    """Identity of a render: same inputs and template, same PDF"""
+    canonical = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(f"{TEMPLATE_VERSION}:{canonical}".encode()).hexdigest()
+
+
+def _money(amount: Any, currency: str) -> str:
+    return f"{currency} {float(amount or 0):,.2f}"
+
+
+def _pdf_text(text: Any) -> str:
+    # Standard fonts only cover Latin-1; anything else prints as '?'
+    text = str(text).encode("latin-1", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _item_columns(item: Dict[str, Any], currency: str) -> Tuple[str, str, str]:
+    description = item.get("title") or item.get("course_title") or item.get("description") or item.get("name") or "Item"
+    quantity = item.get("quantity", 1)
+    amount = item.get("final_price", item.get("price", item.get("amount", 0)))
+    return str(description)[:60], str(quantity), _money(amount, currency)
+
+
+def _layout(payload: Dict[str, Any]) -> List[List[DrawOp]]:
+    """Draw operations per page"""
+    currency = payload.get("currency") or "NGN"
+    pages: List[List[DrawOp]] = [[]]
+    y = PAGE_HEIGHT - MARGIN
+
+    def line(text: str, font: str = "F1", size: int = 10, x: float = MARGIN, advance: bool = True):
+        nonlocal y
+        if y < MARGIN + LINE_HEIGHT:
+            pages.append([])
+            y = PAGE_HEIGHT - MARGIN
+        pages[-1].append((font, size, x, y, text))
+        if advance:
+            y -= LINE_HEIGHT
+
+    line("Execute Tech Academy", "F2", 16)
+    line("INVOICE", "F2", 20)
+    y -= 4
+    line(f"Invoice number: {payload['invoice_number']}")
+    line(f"Issued: {payload.get('created_at') or ''}")
+    if payload.get("due_date"):
+        line(f"Due: {payload['due_date']}")
+    if payload.get("is_paid"):
+        line("Status: PAID" + (f" on {payload['paid_at']}" if payload.get("paid_at") else ""))
+    else:
+        line("Status: UNPAID")
+    y -= LINE_HEIGHT / 2
+
+    line("Bill to", "F2", 11)
+    for part in ("billing_name", "billing_email", "billing_address", "billing_city", "billing_state", "billing_country"):
+        if payload.get(part):
+            line(str(payload[part]))
+    y -= LINE_HEIGHT / 2
+
+    line("Description", "F2", 11, advance=False)
+    line("Qty", "F2", 11, x=380, advance=False)
+    line("Amount", "F2", 11, x=450)
+    for item in payload.get("items") or []:
+        description, quantity, amount = _item_columns(item, currency)
+        line(description, advance=False)
+        line(quantity, x=380, advance=False)
+        line(amount, x=450)
+    y -= LINE_HEIGHT / 2
+
+    for label, key in (("Subtotal", "subtotal"), ("Tax", "tax"), ("Discount", "discount")):
+        line(label, x=350, advance=False)
+        line(_money(payload.get(key), currency), x=450)
+    line("Total", "F2", 11, x=350, advance=False)
+    line(_money(payload.get("total"), currency), "F2", 11, x=450)
+    return pages
+
+
+def render_invoice_pdf(payload: Dict[str, Any]) -> bytes:
+    pages = _layout(payload)
+    # Objects 1-4 are the catalog, page tree and fonts; each page adds a
+    # page object and a content stream
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # page tree, filled in once page numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>"
+    ]
+    page_refs = []
+    for ops in pages:
+        stream = "\n".join(
+            f"BT /{font} {size} Tf {x:.2f} {y:.2f} Td ({_pdf_text(text)}) Tj ET" for font, size, x, y, text in ops
+        ).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_ref} 0 R >>"
+        ).encode())
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(out)
@@ -0,0 +1,202 @@
+"""Background rendering of invoice PDFs.
+
+Invoices are created with pdf_status PENDING, and the invoices table is
+the queue: InvoiceRenderer claims pending rows with SKIP LOCKED (so
+replicas share the work), renders them in a spawn-context process pool
+(rendering is CPU bound and would hold the GIL against request threads)
+and stores the PDFs in the content-addressed blob store. Renders are
+deduplicated three ways: an invoice whose inputs have not changed since
+its stored PDF is not rendered again, identical inputs in one batch are
+rendered once, and the blob store keeps one copy of identical bytes.
+
+A failed render is retried on later batches and left FAILED after
+INVOICE_RENDER_MAX_ATTEMPTS.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from blob_store import get_blob_store
+from service_toolkit.events import BackgroundWorker
+from invoice_pdf import render_invoice_pdf, source_hash
+from models import Invoice, InvoicePdfStatus
+
+load_dotenv()
+
+INVOICE_RENDER_WORKERS = int(os.getenv("INVOICE_RENDER_WORKERS", "2"))
+INVOICE_RENDER_BATCH_SIZE = int(os.getenv("INVOICE_RENDER_BATCH_SIZE", "20"))
+INVOICE_RENDER_TIMEOUT = float(os.getenv("INVOICE_RENDER_TIMEOUT", "60"))  # seconds per batch
+INVOICE_RENDER_MAX_ATTEMPTS = int(os.getenv("INVOICE_RENDER_MAX_ATTEMPTS", "5"))
+INVOICE_RENDER_POLL_INTERVAL = float(os.getenv("INVOICE_RENDER_POLL_INTERVAL", "1"))
+
+
+def _date(value: Optional[datetime]) -> Optional[str]:
+    return value.strftime("%Y-%m-%d") if value else None
+
+
+def invoice_payload(invoice: Invoice) -> Dict[str, Any]:
+    """Everything the PDF shows, as plain data for the worker processes"""
+    return {
+        "invoice_number": invoice.invoice_number,
+        "created_at": _date(invoice.created_at),
+        "due_date": _date(invoice.due_date),
+        "is_paid": bool(invoice.is_paid),
+        "paid_at": _date(invoice.paid_at),
+        "billing_name": invoice.billing_name,
+        "billing_email": invoice.billing_email,
+        "billing_address": invoice.billing_address,
+        "billing_city": invoice.billing_city,
+        "billing_state": invoice.billing_state,
+        "billing_country": invoice.billing_country,
+        "items": invoice.items or [],
+        "subtotal": invoice.subtotal,
+        "tax": invoice.tax,
+        "discount": invoice.discount,
+        "total": invoice.total,
+        "currency": invoice.currency
+    }
+
+
+def invoice_pdf_url(invoice_number: str) -> str:
+    return f"/invoices/{invoice_number}/pdf"
+
+
+class InvoiceRenderer(BackgroundWorker):
+    """Renders pending invoices in batches on a process pool"""
+
+    idle_interval = INVOICE_RENDER_POLL_INTERVAL
+
+    def __init__(
+        self,
+        session_factory,
+        store=None,
+        workers: int = INVOICE_RENDER_WORKERS,
+        batch_size: int = INVOICE_RENDER_BATCH_SIZE,
+        timeout: float = INVOICE_RENDER_TIMEOUT
+    ):
+        super().__init__("invoice-renderer")
+        self.session_factory = session_factory
+        self.store = store
+        self.workers = workers
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Spawn the worker processes ahead of the first batch"""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(source_hash, {})
+        super().start()
+
+    def stop(self, timeout: float = 5.0):
+        super().stop(timeout)
+        self._shutdown_executor()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: forking a threaded server process can deadlock
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _shutdown_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def run_once(self) -> int:
+        """Render one batch; returns the number of invoices handled"""
+        store = self.store or get_blob_store()
+        db = self.session_factory()
+        try:
+            invoices = db.query(Invoice).filter(
+                Invoice.pdf_status == InvoicePdfStatus.PENDING
+            ).order_by(Invoice.id).limit(self.batch_size).with_for_update(skip_locked=True).all()
+
+            if not invoices:
+                db.rollback()
+                return 0
+
+            sources: Dict[int, str] = {}
+            payloads: Dict[str, Dict[str, Any]] = {}
+            for invoice in invoices:
+                payload = invoice_payload(invoice)
+                sources[invoice.id] = source_hash(payload)
+                if self._still_current(store, invoice, sources[invoice.id]):
+                    continue
+                payloads.setdefault(sources[invoice.id], payload)
+
+            rendered, errors = self._render(store, payloads)
+
+            now = datetime.utcnow()
+            for invoice in invoices:
+                source = sources[invoice.id]
+                if source in rendered:
+                    invoice.pdf_sha256, invoice.pdf_size = rendered[source]
+                    invoice.pdf_source_hash = source
+                    invoice.pdf_rendered_at = now
+                elif source in errors:
+                    invoice.pdf_attempts += 1
+                    invoice.pdf_error = errors[source]
+                    if invoice.pdf_attempts >= INVOICE_RENDER_MAX_ATTEMPTS:
+                        invoice.pdf_status = InvoicePdfStatus.FAILED
+                    print(f"Invoice {invoice.invoice_number} render failed (attempt {invoice.pdf_attempts}): {errors[source]}")
+                    continue
+                invoice.pdf_status = InvoicePdfStatus.READY
+                invoice.pdf_url = invoice_pdf_url(invoice.invoice_number)
+                invoice.pdf_attempts = 0
+                invoice.pdf_error = None
+
+            db.commit()
+            return len(invoices)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _still_current(self, store, invoice: Invoice, source: str) -> bool:
+        """Whether the stored PDF was rendered from these same inputs and still exists"""
+        return (
+            invoice.pdf_sha256 is not None
+            and invoice.pdf_source_hash == source
+            and store.size(invoice.pdf_sha256) is not None
+        )
+
+    def _render(self, store, payloads: Dict[str, Dict[str, Any]]):
+        """Render and store each distinct payload; (source -> (key, size), source -> error)"""
+        rendered: Dict[str, tuple] = {}
+        errors: Dict[str, str] = {}
+        if not payloads:
+            return rendered, errors
+
+        executor = self._get_executor()
+        futures = {source: executor.submit(render_invoice_pdf, payload) for source, payload in payloads.items()}
+        deadline = time.monotonic() + self.timeout
+        for source, future in futures.items():
+            try:
+                pdf = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                rendered[source] = (store.put(pdf, "application/pdf"), len(pdf))
+            except BrokenProcessPool as e:
+                # A worker died; the next batch gets a fresh pool
+                errors[source] = f"Render worker crashed: {e}"
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+            except Exception as e:
+                future.cancel()
+                errors[source] = str(e) or type(e).__name__
+        return rendered, errors
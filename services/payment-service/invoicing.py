@@ -0,0 +1,147 @@
+"""Automatic invoices for completed payments.
+
+InvoiceGenerator claims completed payments that have not been invoiced
+(payments.invoiced_at is null) in batches with SKIP LOCKED, fetches the
+batch's orders from order-service in one POST /orders/lookup call and
+writes all of the batch's invoices with one multi-row INSERT. The insert
+skips payments that already have an invoice (created through POST
+/invoices), so the generator never duplicates one. New invoices start
+with pdf_status pending and are picked up by the invoice renderer.
+
+If order-service is unreachable the batch is rolled back and retried
+with the worker's backoff. A payment whose order no longer exists still
+gets an invoice, with a single line for the amount paid.
+"""
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from service_toolkit.events import BackgroundWorker
+from models import Invoice, InvoicePdfStatus, Payment, PaymentStatus
+
+load_dotenv()
+
+ORDER_SERVICE_URL = os.getenv("ORDER_SERVICE_URL", "http://order-service:8003")
+SERVICE_API_TOKEN = os.getenv("SERVICE_API_TOKEN", "")
+ORDER_LOOKUP_TIMEOUT = float(os.getenv("ORDER_LOOKUP_TIMEOUT", "10"))
+INVOICE_BATCH_SIZE = int(os.getenv("INVOICE_BATCH_SIZE", "100"))  # order-service caps lookups at 1000
+INVOICE_POLL_INTERVAL = float(os.getenv("INVOICE_POLL_INTERVAL", "2"))
+
+
+def new_invoice_number() -> str:
+    return f"INV-{uuid.uuid4().hex[:10].upper()}"
+
+
+class OrderServiceClient:
+    """Keep-alive client for order-service's service-to-service endpoints"""
+
+    def __init__(self, base_url: str = ORDER_SERVICE_URL, token: str = SERVICE_API_TOKEN, timeout: float = ORDER_LOOKUP_TIMEOUT):
+        self._client = httpx.Client(base_url=base_url, timeout=timeout, headers={"X-Service-Token": token})
+
+    def lookup_orders(self, order_ids: List[int]) -> Dict[int, dict]:
+        """Orders with their items by id; unknown ids are missing from the result"""
+        response = self._client.post("/orders/lookup", json={"order_ids": order_ids})
+        response.raise_for_status()
+        return {order["id"]: order for order in response.json()}
+
+    def close(self):
+        self._client.close()
+
+
+def _billing(payment: Payment):
+    """Billing name and email from the gateway's customer record"""
+    customer = (payment.gateway_response or {}).get("customer") or {}
+    name = customer.get("name") or " ".join(filter(None, (customer.get("first_name"), customer.get("last_name"))))
+    # Same placeholder the checkout sends the gateway when it has no email
+    email = customer.get("email") or f"student{payment.student_id}@executetechacademy.com"
+    return name or f"Student {payment.student_id}", email
+
+
+def invoice_row(payment: Payment, order: Optional[dict]) -> dict:
+    """Invoice values for a completed payment and its order"""
+    if order:
+        items = [
+            {
+                "course_id": item["course_id"],
+                "course_title": item["course_title"],
+                "price": item["price"],
+                "discount": item["discount"],
+                "final_price": item["final_price"]
+            }
+            for item in order["items"]
+        ]
+        subtotal, discount = order["total_amount"], order["discount_amount"]
+    else:
+        items = [{"description": f"Order {payment.order_id}", "final_price": payment.amount}]
+        subtotal, discount = payment.amount, 0.0
+
+    billing_name, billing_email = _billing(payment)
+    return {
+        "invoice_number": new_invoice_number(),
+        "payment_id": payment.id,
+        "order_id": payment.order_id,
+        "student_id": payment.student_id,
+        "subtotal": subtotal,
+        "tax": 0.0,
+        "discount": discount,
+        "total": subtotal - discount,
+        "currency": payment.currency,
+        "billing_name": billing_name,
+        "billing_email": billing_email,
+        "items": items,
+        "is_paid": True,
+        "paid_at": payment.paid_at,
+        "pdf_status": InvoicePdfStatus.PENDING,
+        "pdf_attempts": 0
+    }
+
+
+class InvoiceGenerator(BackgroundWorker):
+    """Creates invoices for completed payments in batches"""
+
+    idle_interval = INVOICE_POLL_INTERVAL
+
+    def __init__(self, session_factory, orders: Optional[OrderServiceClient] = None, batch_size: int = INVOICE_BATCH_SIZE):
+        super().__init__("invoice-generator")
+        self.session_factory = session_factory
+        self.orders = orders or OrderServiceClient()
+        self.batch_size = batch_size
+
+    def stop(self, timeout: float = 5.0):
+        super().stop(timeout)
+        self.orders.close()
+
+    def run_once(self) -> int:
+        """Invoice one batch; returns the number of payments handled"""
+        db = self.session_factory()
+        try:
+            payments = db.query(Payment).filter(
+                Payment.status == PaymentStatus.COMPLETED,
+                Payment.invoiced_at.is_(None)
+            ).order_by(Payment.id).limit(self.batch_size).with_for_update(skip_locked=True).all()
+
+            if not payments:
+                db.rollback()
+                return 0
+
+            orders = self.orders.lookup_orders(sorted({payment.order_id for payment in payments}))
+            db.execute(
+                pg_insert(Invoice).values([
+                    invoice_row(payment, orders.get(payment.order_id)) for payment in payments
+                ]).on_conflict_do_nothing(index_elements=["payment_id"])
+            )
+            db.query(Payment).filter(
+                Payment.id.in_([payment.id for payment in payments])
+            ).update({Payment.invoiced_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            return len(payments)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
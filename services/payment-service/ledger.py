@@ -0,0 +1,232 @@
+"""Wallet ledger.
+
+Balances are integer minor units. Every balance change is a posting: a
+conditional UPDATE ... RETURNING moves Wallet.balance_minor, and a
+WalletTransaction row records the amount with the balance before and
+after. Nothing is read, modified and written back in Python, so concurrent
+postings to one wallet serialise on its row lock instead of losing
+updates, and a debit that would overdraw fails inside the same statement.
+
+post_batch applies many postings (payouts, refunds) in one transaction.
+It locks the wallets in id order, so concurrent batches cannot deadlock,
+moves all balances with one UPDATE and writes the entries with one
+INSERT. The batch is all or nothing. A posting whose reference was
+already posted to its wallet is skipped, so a retried batch is safe.
+
+Wallet.balance_minor is a materialisation of the ledger. audit_wallets
+streams the ledger wallet by wallet and reports every wallet whose
+entries do not chain or do not add up to its balance.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Iterator, List, Optional, Set
+
+from sqlalchemy import case, insert, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from models import MINOR_UNITS, Wallet, WalletTransaction
+
+CREDIT = "credit"
+DEBIT = "debit"
+
+
+class LedgerError(Exception):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    def __init__(self, student_ids: List[int]):
+        super().__init__(f"Insufficient wallet balance for students {sorted(student_ids)}")
+        self.student_ids = student_ids
+
+
+def to_minor(amount: float) -> int:
+    """Major units (as sent by clients) to minor units, rounding half up"""
+    return int((Decimal(str(amount)) * MINOR_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def _wallet_ids(db: Session, student_ids: List[int], create_for: Set[int]) -> Dict[int, int]:
+    """student_id -> wallet id, creating missing wallets for create_for"""
+    wallets = dict(db.execute(
+        select(Wallet.student_id, Wallet.id).where(Wallet.student_id.in_(student_ids))
+    ).all())
+    missing = [student_id for student_id in student_ids if student_id not in wallets and student_id in create_for]
+    if missing:
+        db.execute(
+            pg_insert(Wallet).on_conflict_do_nothing(index_elements=["student_id"]),
+            [{"student_id": student_id, "balance_minor": 0, "is_active": True} for student_id in missing]
+        )
+        wallets.update(db.execute(
+            select(Wallet.student_id, Wallet.id).where(Wallet.student_id.in_(missing))
+        ).all())
+    return wallets
+
+
+def post_batch(db: Session, postings: List[dict]) -> List[WalletTransaction]:
+    """Apply postings atomically; the caller commits.
+
+    Each posting has student_id, transaction_type (credit or debit), a
+    positive amount_minor and optionally description, reference and
+    metadata. Returns the new entries in posting order, without the ones
+    skipped as already posted. Raises InsufficientFunds, and posts
+    nothing, if any wallet would go below zero at any point in the batch.
+    """
+    for posting in postings:
+        if posting["transaction_type"] not in (CREDIT, DEBIT):
+            raise LedgerError(f"Unknown transaction type {posting['transaction_type']!r}")
+        if posting["amount_minor"] <= 0:
+            raise LedgerError("Posting amounts must be positive")
+    if not postings:
+        return []
+
+    # Debits never create a wallet; a missing one simply has no funds
+    credited = {p["student_id"] for p in postings if p["transaction_type"] == CREDIT}
+    wallets = _wallet_ids(db, sorted({p["student_id"] for p in postings}), create_for=credited)
+    unfunded = {p["student_id"] for p in postings if p["student_id"] not in wallets}
+    if unfunded:
+        raise InsufficientFunds(sorted(unfunded))
+
+    referenced = [(wallets[p["student_id"]], p["reference"]) for p in postings if p.get("reference")]
+    if referenced:
+        already_posted = set(db.execute(
+            select(WalletTransaction.wallet_id, WalletTransaction.reference).where(
+                tuple_(WalletTransaction.wallet_id, WalletTransaction.reference).in_(referenced)
+            )
+        ).all())
+        postings = [p for p in postings if (wallets[p["student_id"]], p.get("reference")) not in already_posted]
+        if not postings:
+            return []
+
+    deltas: Dict[int, int] = {}
+    for posting in postings:
+        wallet_id = wallets[posting["student_id"]]
+        signed = posting["amount_minor"] if posting["transaction_type"] == CREDIT else -posting["amount_minor"]
+        deltas[wallet_id] = deltas.get(wallet_id, 0) + signed
+
+    wallet_ids = sorted(deltas)
+    if len(wallet_ids) > 1:
+        # Lock in id order first; one UPDATE alone locks rows in scan order
+        db.execute(select(Wallet.id).where(Wallet.id.in_(wallet_ids)).order_by(Wallet.id).with_for_update())
+
+    delta = case(deltas, value=Wallet.id)
+    balances = dict(db.execute(
+        update(Wallet).where(
+            Wallet.id.in_(wallet_ids),
+            Wallet.is_active.is_(True),
+            Wallet.balance_minor + delta >= 0
+        ).values(balance_minor=Wallet.balance_minor + delta).returning(Wallet.id, Wallet.balance_minor),
+        execution_options={"synchronize_session": False}
+    ).all())
+
+    student_of = {wallet_id: student_id for student_id, wallet_id in wallets.items()}
+    if len(balances) != len(wallet_ids):
+        raise InsufficientFunds([student_of[wallet_id] for wallet_id in wallet_ids if wallet_id not in balances])
+
+    # Walk each wallet forward from its balance before the batch
+    running = {wallet_id: balances[wallet_id] - deltas[wallet_id] for wallet_id in wallet_ids}
+    rows = []
+    overdrawn = set()
+    for posting in postings:
+        wallet_id = wallets[posting["student_id"]]
+        before = running[wallet_id]
+        after = before + (posting["amount_minor"] if posting["transaction_type"] == CREDIT else -posting["amount_minor"])
+        if after < 0:
+            overdrawn.add(posting["student_id"])
+        running[wallet_id] = after
+        rows.append({
+            "wallet_id": wallet_id,
+            "transaction_type": posting["transaction_type"],
+            "amount_minor": posting["amount_minor"],
+            "balance_before_minor": before,
+            "balance_after_minor": after,
+            "description": posting.get("description"),
+            "reference": posting.get("reference"),
+            "meta": posting.get("metadata")
+        })
+    if overdrawn:
+        raise InsufficientFunds(sorted(overdrawn))
+
+    return db.scalars(
+        insert(WalletTransaction).returning(WalletTransaction, sort_by_parameter_order=True),
+        rows
+    ).all()
+
+
+def post(
+    db: Session,
+    student_id: int,
+    transaction_type: str,
+    amount_minor: int,
+    description: Optional[str] = None,
+    reference: Optional[str] = None,
+    metadata: Optional[dict] = None
+) -> Optional[WalletTransaction]:
+    """Apply one posting; returns None if reference was already posted"""
+    entries = post_batch(db, [{
+        "student_id": student_id,
+        "transaction_type": transaction_type,
+        "amount_minor": amount_minor,
+        "description": description,
+        "reference": reference,
+        "metadata": metadata
+    }])
+    return entries[0] if entries else None
+
+
+# ==================== AUDIT ====================
+
+def audit_wallets(session_factory, batch_size: int = 500, entry_chunk: int = 5000) -> Iterator[dict]:
+    """Yield a report for every wallet whose ledger and balance disagree.
+
+    Wallets are read in id batches under a shared lock, so postings to
+    the batch being checked wait rather than skewing it, and their entries
+    are streamed in (wallet_id, id) order without loading the ledger.
+    """
+    last_id = 0
+    while True:
+        db = session_factory()
+        try:
+            wallets = db.execute(
+                select(Wallet.id, Wallet.balance_minor).where(Wallet.id > last_id)
+                .order_by(Wallet.id).limit(batch_size).with_for_update(read=True)
+            ).all()
+            if not wallets:
+                return
+
+            ledger = {wallet_id: 0 for wallet_id, _ in wallets}
+            broken: Dict[int, List[int]] = {}
+            entries = db.execute(
+                select(
+                    WalletTransaction.wallet_id,
+                    WalletTransaction.id,
+                    WalletTransaction.transaction_type,
+                    WalletTransaction.amount_minor,
+                    WalletTransaction.balance_before_minor,
+                    WalletTransaction.balance_after_minor
+                ).where(WalletTransaction.wallet_id.in_(list(ledger)))
+                .order_by(WalletTransaction.wallet_id, WalletTransaction.id)
+                .execution_options(yield_per=entry_chunk)
+            )
+            for wallet_id, entry_id, transaction_type, amount, before, after in entries:
+                signed = amount if transaction_type == CREDIT else -amount
+                # Each entry must start where the previous one ended
+                if before != ledger[wallet_id] or after != before + signed:
+                    broken.setdefault(wallet_id, []).append(entry_id)
+                ledger[wallet_id] += signed
+
+            reports = [
+                {
+                    "wallet_id": wallet_id,
+                    "balance_minor": balance,
+                    "ledger_balance_minor": ledger[wallet_id],
+                    "broken_entries": broken.get(wallet_id, [])
+                }
+                for wallet_id, balance in wallets
+                if balance != ledger[wallet_id] or wallet_id in broken
+            ]
+            last_id = wallets[-1][0]
+            db.rollback()
+        finally:
+            db.close()
+
+        yield from reports
@@ -1,196 +1,220 @@
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime, timedelta
 import uuid
-import httpx
 
 import models
 import schemas
-from database import engine, get_db
-from auth_middleware import verify_token, verify_admin
-from payment_gateways import get_payment_gateway, PaystackGateway
+import webhooks
+import ledger
+import refund_execution
+from blob_store import RangeNotSatisfiable, get_blob_store, parse_byte_range
+from invoice_rendering import InvoiceRenderer
+from invoicing import InvoiceGenerator, new_invoice_number
+from reconciler import PaymentReconciler
+from database import engine, get_db, SessionLocal
+from service_toolkit import events
+from service_toolkit.app import add_lifecycle_hooks, add_metrics_collector, create_app
+from service_toolkit.auth import token_verifier, verify_token, verify_admin
+from service_toolkit.idempotency import add_idempotency
+from service_toolkit.serialization import list_response
+from payment_gateways import ChargeLookupCache, close_payment_gateways, gateway_metrics, get_payment_gateway
+from payment_state import OPEN_STATUSES, add_payment_event, amount_matches, apply_charge_outcome
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
+events.create_event_tables(engine)
 
-app = FastAPI(
+app = create_app(
     title="Execute Tech Academy - Payment Service",
     description="Payment Processing and Invoice Management Service",
-    version="1.0.0"
+    service_name="Payment Service"
 )
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Retried creates with the same Idempotency-Key replay the first response
+add_idempotency(app, routes=[("POST", "/payments/initiate"), ("POST", "/payments")], namespace="payment-service", engine=engine)
 
-@app.get("/")
-def read_root():
-    return {
-        "service": "Payment Service",
-        "status": "running",
-        "version": "1.0.0"
-    }
+PAYMENT_EVENTS_STREAM = "payments.events"
+
+outbox_relay = events.OutboxRelay(SessionLocal, events.get_event_bus(), PAYMENT_EVENTS_STREAM)
+webhook_workers = webhooks.WebhookWorkerPool(SessionLocal)
+payment_reconciler = PaymentReconciler(SessionLocal)
+invoice_generator = InvoiceGenerator(SessionLocal)
+invoice_renderer = InvoiceRenderer(SessionLocal)
+refund_executor = refund_execution.RefundExecutor(SessionLocal)
+charge_lookups = ChargeLookupCache()
 
-@app.get("/health")
-def health_check():
-    return {"status": "healthy"}
+add_lifecycle_hooks(app, start=outbox_relay.start, stop=outbox_relay.stop)
+add_lifecycle_hooks(app, start=webhook_workers.start, stop=webhook_workers.stop)
+add_lifecycle_hooks(app, start=payment_reconciler.start, stop=payment_reconciler.stop)
+add_lifecycle_hooks(app, start=invoice_generator.start, stop=invoice_generator.stop)
+add_lifecycle_hooks(app, start=invoice_renderer.start, stop=invoice_renderer.stop)
+add_lifecycle_hooks(app, start=refund_executor.start, stop=refund_executor.stop)
+add_lifecycle_hooks(app, stop=token_verifier.stop)
+add_lifecycle_hooks(app, stop=close_payment_gateways)
+add_metrics_collector(app, gateway_metrics.render)
+add_metrics_collector(app, payment_reconciler.render_metrics)
+add_metrics_collector(app, charge_lookups.render_metrics)
+add_metrics_collector(app, refund_executor.render_metrics)
 
 # ==================== PAYMENT ENDPOINTS ====================
 
-async def notify_order_service(order_id: int, payment_status: str):
-    """Notify order service about payment status"""
+def _create_pending_payment(request: schemas.PaymentInitiateRequest, student_id: int) -> models.Payment:
+    db = SessionLocal()
     try:
-        order_service_url = "http://order-service:8003"  # Update with actual URL
-        async with httpx.AsyncClient() as client:
-            await client.put(
-                f"{order_service_url}/orders/{order_id}",
-                json={"status": "confirmed" if payment_status == "completed" else "failed"}
-            )
-    except Exception as e:
-        print(f"Failed to notify order service: {e}")
+        db_payment = models.Payment(
+            payment_id=f"PAY-{uuid.uuid4().hex[:12].upper()}",
+            order_id=request.order_id,
+            student_id=student_id,
+            amount=request.amount,
+            payment_method=request.payment_method,
+            status=models.PaymentStatus.PENDING,
+            expires_at=datetime.utcnow() + timedelta(hours=1),
+            meta=request.metadata
+        )
+        db.add(db_payment)
+        db.commit()
+        db.refresh(db_payment)
+        return db_payment
+    finally:
+        db.close()
+
+
+def _fail_initiated_payment(payment_id: str):
+    db = SessionLocal()
+    try:
+        db.query(models.Payment).filter(
+            models.Payment.payment_id == payment_id
+        ).update({models.Payment.status: models.PaymentStatus.FAILED}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
 
 @app.post("/payments/initiate", response_model=schemas.PaymentInitiateResponse)
 async def initiate_payment(
     request: schemas.PaymentInitiateRequest,
-    db: Session = Depends(get_db),
     current_user: dict = Depends(verify_token)
 ):
     """Initiate a payment with selected gateway"""
     
-    # Generate payment reference
-    payment_reference = f"PAY-{uuid.uuid4().hex[:12].upper()}"
-    
-    # Create payment record
-    db_payment = models.Payment(
-        payment_id=payment_reference,
-        order_id=request.order_id,
-        student_id=current_user["user_id"],
-        amount=request.amount,
-        payment_method=request.payment_method,
-        status=models.PaymentStatus.PENDING,
-        expires_at=datetime.utcnow() + timedelta(hours=1),
-        metadata=request.metadata
-    )
-    db.add(db_payment)
-    db.commit()
-    db.refresh(db_payment)
+    # Database work runs in the threadpool, as in verify_payment, so the
+    # event loop and its background workers are never blocked on a commit
+    db_payment = await run_in_threadpool(_create_pending_payment, request, current_user["user_id"])
+    payment_reference = db_payment.payment_id
     
     # Initialize with payment gateway
     try:
         gateway = get_payment_gateway(request.payment_method.value)
         
-        if isinstance(gateway, PaystackGateway):
-            # Get user email (would normally fetch from auth service)
-            user_email = f"student{current_user['user_id']}@executetechacademy.com"
-            
-            result = await gateway.initialize_transaction(
-                email=user_email,
-                amount=request.amount,
-                reference=payment_reference,
-                callback_url=request.callback_url,
-                metadata=request.metadata
-            )
-            
-            if result.get("status"):
-                data = result.get("data", {})
-                return {
-                    "payment_id": payment_reference,
-                    "authorization_url": data.get("authorization_url", ""),
-                    "access_code": data.get("access_code", ""),
-                    "reference": payment_reference
-                }
+        # Get user email (would normally fetch from auth service)
+        user_email = f"student{current_user['user_id']}@executetechacademy.com"
         
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to initialize payment"
+        checkout = await gateway.initialize_payment(
+            reference=payment_reference,
+            amount=request.amount,
+            currency=db_payment.currency,
+            email=user_email,
+            callback_url=request.callback_url,
+            metadata=request.metadata
         )
         
+        return {
+            "payment_id": payment_reference,
+            "authorization_url": checkout["authorization_url"],
+            "access_code": checkout["access_code"] or "",
+            "reference": payment_reference
+        }
+        
     except Exception as e:
-        db_payment.status = models.PaymentStatus.FAILED
-        db.commit()
+        await run_in_threadpool(_fail_initiated_payment, payment_reference)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Payment initialization failed: {str(e)}"
         )
 
+def _verify_response(payment: models.Payment) -> dict:
+    return {
+        "payment_id": payment.payment_id,
+        "status": payment.status,
+        "amount": payment.amount,
+        "paid_at": payment.paid_at,
+        "gateway_response": payment.gateway_response
+    }
+
+
+def _load_for_verify(payment_id: str) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        payment = db.query(models.Payment).filter(models.Payment.payment_id == payment_id).first()
+        if payment is None:
+            return None
+        return {
+            "open": payment.status in OPEN_STATUSES,
+            "method": payment.payment_method.value,
+            "response": _verify_response(payment)
+        }
+    finally:
+        db.close()
+
+
+def _settle_verified(payment_id: str, succeeded: bool, data: dict) -> dict:
+    """Apply a gateway outcome under the row lock and return the settled payment"""
+    db = SessionLocal()
+    try:
+        # A webhook may have settled the payment during the round trip
+        payment = db.query(models.Payment).filter(
+            models.Payment.payment_id == payment_id
+        ).with_for_update().one()
+        apply_charge_outcome(db, payment, succeeded, data)
+        db.commit()
+        return _verify_response(payment)
+    finally:
+        db.close()
+
+
 @app.get("/payments/verify/{payment_id}", response_model=schemas.PaymentVerifyResponse)
 async def verify_payment(
     payment_id: str,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
     current_user: dict = Depends(verify_token)
 ):
     """Verify a payment"""
     
-    payment = db.query(models.Payment).filter(
-        models.Payment.payment_id == payment_id
-    ).first()
+    # Database work runs in the threadpool so the gateway round trip
+    # neither blocks the event loop nor holds a pooled connection
+    loaded = await run_in_threadpool(_load_for_verify, payment_id)
     
-    if not payment:
+    if not loaded:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Payment not found"
         )
     
-    # Verify with payment gateway
-    try:
-        gateway = get_payment_gateway(payment.payment_method.value)
-        
-        if isinstance(gateway, PaystackGateway):
-            result = await gateway.verify_transaction(payment_id)
+    # Settled payments never change at the gateway again; answer from the row
+    if loaded["open"]:
+        try:
+            gateway = get_payment_gateway(loaded["method"])
             
-            if result.get("status") and result.get("data"):
-                data = result["data"]
-                
-                if data.get("status") == "success":
-                    payment.status = models.PaymentStatus.COMPLETED
-                    payment.paid_at = datetime.utcnow()
-                    payment.gateway_transaction_id = str(data.get("id"))
-                    payment.gateway_response = data
-                    
-                    # Create transaction record
-                    transaction = models.Transaction(
-                        payment_id=payment.id,
-                        transaction_type="charge",
-                        amount=payment.amount,
-                        status=models.PaymentStatus.COMPLETED,
-                        gateway_transaction_id=str(data.get("id")),
-                        gateway_response=data
-                    )
-                    db.add(transaction)
-                    
-                    # Notify order service
-                    background_tasks.add_task(
-                        notify_order_service,
-                        payment.order_id,
-                        "completed"
-                    )
-                else:
-                    payment.status = models.PaymentStatus.FAILED
-        
-        db.commit()
-        db.refresh(payment)
-        
-        return {
-            "payment_id": payment.payment_id,
-            "status": payment.status,
-            "amount": payment.amount,
-            "paid_at": payment.paid_at,
-            "gateway_response": payment.gateway_response
-        }
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Payment verification failed: {str(e)}"
-        )
+            # Checkout polls for one reference share a recent gateway lookup
+            charge = await charge_lookups.lookup(gateway, payment_id)
+            
+            expected = loaded["response"]["amount"]
+            if charge["succeeded"] and not amount_matches(charge["amount"], expected):
+                # Never complete a payment for less than was charged
+                print(f"Verify skipped {payment_id}: paid {charge['amount']}, expected {expected}")
+            elif charge["succeeded"] is not None:
+                return await run_in_threadpool(_settle_verified, payment_id, charge["succeeded"], charge["data"])
+            
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Payment verification failed: {str(e)}"
+            )
+    
+    return loaded["response"]
 
 @app.post("/payments", response_model=schemas.PaymentResponse, status_code=status.HTTP_201_CREATED)
 def create_payment(
@@ -209,7 +233,7 @@ def create_payment(
         currency=payment.currency,
         payment_method=payment.payment_method,
         description=payment.description,
-        metadata=payment.metadata,
+        meta=payment.metadata,
         expires_at=datetime.utcnow() + timedelta(hours=1)
     )
     db.add(db_payment)
@@ -231,7 +255,7 @@ def list_payments(
             models.Payment.student_id == current_user["user_id"]
         ).offset(skip).limit(limit).all()
     
-    return payments
+    return list_response(schemas.PaymentResponse, payments)
 
 @app.get("/payments/{payment_id}", response_model=schemas.PaymentResponse)
 def get_payment(
@@ -274,16 +298,36 @@ def update_payment(
             detail="Payment not found"
         )
     
+    previous_status = payment.status
+    
     for key, value in payment_update.dict(exclude_unset=True).items():
         setattr(payment, key, value)
     
     if payment_update.status == models.PaymentStatus.COMPLETED and not payment.paid_at:
         payment.paid_at = datetime.utcnow()
     
+    if payment.status != previous_status:
+        add_payment_event(db, payment)
+    
     db.commit()
     db.refresh(payment)
     return payment
 
+# ==================== WEBHOOK ENDPOINTS ====================
+
+@app.post("/webhooks/{provider}", response_model=schemas.WebhookAcknowledgement)
+async def receive_webhook(provider: str, request: Request):
+    """Provider payment notifications, authenticated by signature rather than a token.
+
+    The event is stored and acknowledged; WebhookWorkerPool applies it.
+    """
+    body = await request.body()
+    try:
+        result = await run_in_threadpool(webhooks.ingest_webhook, SessionLocal, provider, body, request.headers)
+    except webhooks.WebhookRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return {"status": result}
+
 # ==================== REFUND ENDPOINTS ====================
 
 @app.post("/refunds", response_model=schemas.RefundResponse, status_code=status.HTTP_201_CREATED)
@@ -349,22 +393,51 @@ def process_refund(
             detail="Refund not found"
         )
     
-    for key, value in refund_update.dict(exclude_unset=True).items():
+    updates = refund_update.dict(exclude_unset=True)
+    if refund_update.status == models.RefundStatus.APPROVED:
+        # Queued; the refund executor submits it to the gateway
+        _, rejected = refund_execution.approve_refunds(db, [refund_id], current_user["user_id"])
+        if rejected:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=rejected[refund_id]
+            )
+        updates.pop("status")
+    
+    for key, value in updates.items():
         setattr(refund, key, value)
     
     refund.processed_by = current_user["user_id"]
     refund.processed_at = datetime.utcnow()
     
     if refund_update.status == models.RefundStatus.COMPLETED:
-        payment = db.query(models.Payment).filter(
-            models.Payment.id == refund.payment_id
-        ).first()
-        payment.status = models.PaymentStatus.REFUNDED
+        # Settled outside the executor (offline methods, provider-pending refunds)
+        refund_execution.refund_covered_payments(db, [refund.payment_id])
     
     db.commit()
     db.refresh(refund)
     return refund
 
+@app.post("/refunds/approve", response_model=schemas.RefundApprovalResponse)
+def approve_refunds(
+    approval: schemas.RefundApproval,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_admin)
+):
+    """Approve many refunds in one call; the refund executor submits them to the gateways.
+
+    Refunds that cannot be approved are returned with the reason and left unchanged.
+    """
+    approved, rejected = refund_execution.approve_refunds(db, approval.refund_ids, current_user["user_id"])
+    
+    # Serialize before commit so expired attributes aren't reloaded
+    response = schemas.RefundApprovalResponse(
+        approved=[schemas.RefundResponse.model_validate(refund) for refund in approved],
+        rejected=[schemas.RefundApprovalError(refund_id=refund_id, detail=detail) for refund_id, detail in rejected.items()]
+    )
+    db.commit()
+    return response
+
 # ==================== INVOICE ENDPOINTS ====================
 
 @app.post("/invoices", response_model=schemas.InvoiceResponse, status_code=status.HTTP_201_CREATED)
@@ -373,7 +446,7 @@ def create_invoice(
     db: Session = Depends(get_db),
     current_user: dict = Depends(verify_token)
 ):
-    invoice_number = f"INV-{uuid.uuid4().hex[:10].upper()}"
+    invoice_number = new_invoice_number()
     
     total = invoice.subtotal + invoice.tax - invoice.discount
     
@@ -439,6 +512,83 @@ def get_invoice(
     
     return invoice
 
+@app.get("/invoices/{invoice_number}/pdf")
+def download_invoice_pdf(
+    invoice_number: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    """Stream the rendered invoice PDF; honours Range and If-None-Match"""
+    invoice = db.query(models.Invoice).filter(
+        models.Invoice.invoice_number == invoice_number
+    ).first()
+    
+    if not invoice:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Invoice not found"
+        )
+    
+    if current_user["role"] != "admin" and invoice.student_id != current_user["user_id"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    if invoice.pdf_status != models.InvoicePdfStatus.READY:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Invoice PDF is {invoice.pdf_status.value}"
+        )
+    
+    store = get_blob_store()
+    key = invoice.pdf_sha256
+    size = store.size(key)
+    if size is None:
+        # Blob lost (e.g. a wiped local volume); queue a re-render
+        invoice.pdf_status = models.InvoicePdfStatus.PENDING
+        db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Invoice PDF is pending"
+        )
+    
+    # The blob key is the content hash, so it is a strong validator
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f'inline; filename="{invoice_number}.pdf"'
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    byte_range = None
+    if request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_byte_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={"Content-Range": f"bytes */{size}", **headers}
+            )
+    
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, status.HTTP_200_OK
+    else:
+        (start, end), status_code = byte_range, status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    
+    return StreamingResponse(
+        store.iter_range(key, start, end),
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=headers
+    )
+
 # ==================== WALLET ENDPOINTS ====================
 
 @app.get("/wallet", response_model=schemas.WalletResponse)
@@ -479,6 +629,39 @@ def get_wallet_transactions(
     
     return transactions
 
+@app.post("/wallet/postings", response_model=List[schemas.WalletTransactionResponse], status_code=status.HTTP_201_CREATED)
+def create_wallet_postings(
+    batch: schemas.WalletPostingBatch,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_admin)
+):
+    """Post credits and debits (payouts, refunds) to student wallets as one batch.
+
+    All or nothing; postings whose reference a wallet already has are skipped.
+    """
+    try:
+        entries = ledger.post_batch(db, [
+            {
+                "student_id": posting.student_id,
+                "transaction_type": posting.transaction_type,
+                "amount_minor": ledger.to_minor(posting.amount),
+                "description": posting.description,
+                "reference": posting.reference
+            }
+            for posting in batch.postings
+        ])
+    except ledger.LedgerError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    # Serialize before commit so expired attributes aren't reloaded
+    response = [schemas.WalletTransactionResponse.model_validate(entry) for entry in entries]
+    db.commit()
+    return response
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8004)
@@ -1,9 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum, Text, JSON
+from sqlalchemy import BigInteger, Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum, Text, JSON, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
 import enum
 
+# Wallet amounts are stored in minor units (kobo, cents); every supported
+# currency has two decimal places
+MINOR_UNITS = 100
+
 class PaymentStatus(str, enum.Enum):
     PENDING = "pending"
     PROCESSING = "processing"
@@ -22,12 +26,26 @@ class PaymentMethod(str, enum.Enum):
 
 class RefundStatus(str, enum.Enum):
     PENDING = "pending"
-    APPROVED = "approved"
+    APPROVED = "approved"  # Queued for refunds.RefundExecutor
+    PROCESSING = "processing"  # Accepted by the gateway, not yet settled
     REJECTED = "rejected"
     COMPLETED = "completed"
+    FAILED = "failed"
+
+class WebhookEventStatus(str, enum.Enum):
+    RECEIVED = "received"
+    PROCESSED = "processed"
+    IGNORED = "ignored"
+    FAILED = "failed"
+
+class InvoicePdfStatus(str, enum.Enum):
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (Index("ix_payments_status_id", "status", "id"),)  # Reconciler keyset scan
 
     id = Column(Integer, primary_key=True, index=True)
     payment_id = Column(String, unique=True, nullable=False, index=True)
@@ -45,11 +63,12 @@ class Payment(Base):
     
     # Metadata
     description = Column(Text)
-    metadata = Column(JSON)
+    meta = Column("metadata", JSON)  # "metadata" is reserved on declarative models
     
     # Timestamps
     paid_at = Column(DateTime(timezone=True))
     expires_at = Column(DateTime(timezone=True))
+    invoiced_at = Column(DateTime(timezone=True))  # Set once the invoice generator has handled it
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -58,6 +77,11 @@ class Payment(Base):
     refunds = relationship("Refund", back_populates="payment", cascade="all, delete-orphan")
     invoice = relationship("Invoice", back_populates="payment", uselist=False)
 
+# Invoice generator queue: completed payments not yet invoiced, kept small
+# by the partial index however many payments have been invoiced
+_uninvoiced = (Payment.status == PaymentStatus.COMPLETED) & Payment.invoiced_at.is_(None)
+Index("ix_payments_uninvoiced", Payment.id, postgresql_where=_uninvoiced, sqlite_where=_uninvoiced)
+
 class Transaction(Base):
     __tablename__ = "transactions"
 
@@ -76,6 +100,7 @@ class Transaction(Base):
 
 class Refund(Base):
     __tablename__ = "refunds"
+    __table_args__ = (Index("ix_refunds_status_id", "status", "id"),)  # Refund executor queue scan
 
     id = Column(Integer, primary_key=True, index=True)
     refund_id = Column(String, unique=True, nullable=False, index=True)
@@ -89,12 +114,17 @@ class Refund(Base):
     processed_by = Column(Integer)  # Admin who processed
     requested_at = Column(DateTime(timezone=True), server_default=func.now())
     processed_at = Column(DateTime(timezone=True))
+    attempts = Column(Integer, default=0, nullable=False)  # Gateway submissions that errored
+    outcome_unknown = Column(Boolean, default=False, nullable=False)  # An errored submission may have reached the gateway
+    last_error = Column(Text)
+    next_attempt_at = Column(DateTime(timezone=True))  # NULL means ready now
     
     # Relationships
     payment = relationship("Payment", back_populates="refunds")
 
 class Invoice(Base):
     __tablename__ = "invoices"
+    __table_args__ = (Index("ix_invoices_pdf_status_id", "pdf_status", "id"),)  # Renderer queue scan
 
     id = Column(Integer, primary_key=True, index=True)
     invoice_number = Column(String, unique=True, nullable=False, index=True)
@@ -122,6 +152,15 @@ class Invoice(Base):
     
     # URLs
     pdf_url = Column(String)
+
+    # PDF rendering; pending invoices are the renderer's queue
+    pdf_status = Column(Enum(InvoicePdfStatus), default=InvoicePdfStatus.PENDING, nullable=False)
+    pdf_sha256 = Column(String(64))  # Blob store key
+    pdf_size = Column(Integer)
+    pdf_source_hash = Column(String(64))  # Inputs the stored PDF was rendered from
+    pdf_attempts = Column(Integer, default=0, nullable=False)
+    pdf_error = Column(Text)
+    pdf_rendered_at = Column(DateTime(timezone=True))
     
     # Status
     is_paid = Column(Boolean, default=False)
@@ -151,7 +190,7 @@ class Wallet(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     student_id = Column(Integer, unique=True, nullable=False, index=True)
-    balance = Column(Float, default=0.0)
+    balance_minor = Column(BigInteger, default=0, nullable=False)  # Materialised from the ledger by ledger.post_batch
     currency = Column(String, default="NGN")
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -160,19 +199,74 @@ class Wallet(Base):
     # Relationships
     transactions = relationship("WalletTransaction", back_populates="wallet")
 
+    @property
+    def balance(self) -> float:
+        return (self.balance_minor or 0) / MINOR_UNITS
+
 class WalletTransaction(Base):
+    """A ledger posting; never updated once written"""
     __tablename__ = "wallet_transactions"
+    __table_args__ = (
+        # A reference is posted to a wallet at most once
+        UniqueConstraint("wallet_id", "reference", name="uq_wallet_transactions_wallet_reference"),
+        Index("ix_wallet_transactions_wallet_id_id", "wallet_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False)
     transaction_type = Column(String, nullable=False)  # credit, debit
-    amount = Column(Float, nullable=False)
-    balance_before = Column(Float, nullable=False)
-    balance_after = Column(Float, nullable=False)
+    amount_minor = Column(BigInteger, nullable=False)  # Positive; transaction_type gives the direction
+    balance_before_minor = Column(BigInteger, nullable=False)
+    balance_after_minor = Column(BigInteger, nullable=False)
     description = Column(Text)
     reference = Column(String, index=True)
-    metadata = Column(JSON)
+    meta = Column("metadata", JSON)  # "metadata" is reserved on declarative models
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     wallet = relationship("Wallet", back_populates="transactions")
+
+    @property
+    def amount(self) -> float:
+        return self.amount_minor / MINOR_UNITS
+
+    @property
+    def balance_before(self) -> float:
+        return self.balance_before_minor / MINOR_UNITS
+
+    @property
+    def balance_after(self) -> float:
+        return self.balance_after_minor / MINOR_UNITS
+
+class WebhookEvent(Base):
+    """Provider webhook inbox; rows are applied by webhooks.WebhookWorkerPool"""
+    __tablename__ = "webhook_events"
+    __table_args__ = (
+        UniqueConstraint("provider", "event_key", name="uq_webhook_events_provider_key"),
+        Index("ix_webhook_events_status_id", "status", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String, nullable=False)
+    event_key = Column(String, nullable=False)  # Provider event identity, used for deduplication
+    event_type = Column(String, nullable=False)
+    reference = Column(String, index=True)  # Our payment_id
+    payload = Column(JSON, nullable=False)
+    status = Column(Enum(WebhookEventStatus), default=WebhookEventStatus.RECEIVED, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text)
+    next_attempt_at = Column(DateTime(timezone=True))  # NULL means ready now
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True))
+
+class ReconcilerCheckpoint(Base):
+    """Resume point and lease for reconciler.PaymentReconciler passes"""
+    __tablename__ = "reconciler_checkpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    cursor = Column(Integer, default=0, nullable=False)  # Last payments.id handled in the current pass
+    lease_owner = Column(String)  # Replica running the pass; NULL when idle
+    lease_expires_at = Column(DateTime(timezone=True))
+    last_pass_completed_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
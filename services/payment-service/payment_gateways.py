@@ -1,37 +1,323 @@
+"""Payment provider adapters.
+
+Every provider implements the async PaymentGateway interface: start a
+checkout, look up a charge by our reference, refund a charge, and check
+and normalise webhooks. Adapters register themselves with
+register_gateway, and get_payment_gateway returns the shared instance for
+a payment method. PAYMENT_GATEWAY_ROUTES can point a method at another
+adapter, e.g. paystack=simulator to run checkout benchmarks against the
+in-process simulator (payment_simulator.py) instead of a real provider.
+
+HTTP providers (BaseGateway) are long-lived singletons holding one
+httpx.AsyncClient, so calls reuse keep-alive connections instead of
+paying a TCP and TLS handshake every time. The client speaks HTTP/2 when
+the provider supports it and h2 is installed. Pool size and connect/read
+timeouts are bounded, so a slow provider fails fast rather than holding
+requests open indefinitely.
+
+Every call is recorded in gateway_metrics by provider and operation and
+served on /metrics. RateLimiter paces bulk calls so background jobs stay
+under provider rate limits, and ChargeLookupCache collapses repeated
+checkout polls for one reference into one provider call. The *_BASE_URL
+settings exist so a local stub provider can stand in for benchmarks
+(scripts/stub-payment-provider.py).
+"""
+import asyncio
+import hashlib
+import hmac
 import httpx
 import os
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, List, Optional, Tuple, Type
 from dotenv import load_dotenv
 
+from service_toolkit.metrics import RequestMetrics
+
 load_dotenv()
 
-class PaystackGateway:
+PAYSTACK_BASE_URL = os.getenv("PAYSTACK_BASE_URL", "https://api.paystack.co")
+FLUTTERWAVE_BASE_URL = os.getenv("FLUTTERWAVE_BASE_URL", "https://api.flutterwave.com/v3")
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = float(os.getenv("PAYMENT_GATEWAY_CONNECT_TIMEOUT", "5"))
+PAYMENT_GATEWAY_READ_TIMEOUT = float(os.getenv("PAYMENT_GATEWAY_READ_TIMEOUT", "20"))
+PAYMENT_GATEWAY_POOL_TIMEOUT = float(os.getenv("PAYMENT_GATEWAY_POOL_TIMEOUT", "5"))
+PAYMENT_GATEWAY_MAX_CONNECTIONS = int(os.getenv("PAYMENT_GATEWAY_MAX_CONNECTIONS", "50"))
+# Idle connections kept open; below the expected concurrency, the pool churns
+PAYMENT_GATEWAY_MAX_KEEPALIVE = int(os.getenv("PAYMENT_GATEWAY_MAX_KEEPALIVE", str(PAYMENT_GATEWAY_MAX_CONNECTIONS)))
+PAYMENT_GATEWAY_HTTP2 = os.getenv("PAYMENT_GATEWAY_HTTP2", "true").lower() == "true"
+# Payment methods served by another adapter, e.g. "paystack=simulator,flutterwave=simulator"
+PAYMENT_GATEWAY_ROUTES = dict(
+    (method.strip().lower(), adapter.strip().lower())
+    for method, _, adapter in (
+        route.partition("=") for route in os.getenv("PAYMENT_GATEWAY_ROUTES", "").split(",") if "=" in route
+    )
+)
+PAYMENT_VERIFY_CACHE_TTL = float(os.getenv("PAYMENT_VERIFY_CACHE_TTL", "5"))
+PAYMENT_VERIFY_CACHE_SIZE = int(os.getenv("PAYMENT_VERIFY_CACHE_SIZE", "10000"))
+
+try:
+    import h2  # noqa: F401 - httpx needs it for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+gateway_metrics = RequestMetrics(prefix="payment_gateway", labels=("provider", "operation"), result_label="outcome")
+
+
+class GatewayError(Exception):
+    """The provider answered, but not with a usable result"""
+
+
+class GatewayUnavailable(GatewayError):
+    """The provider answered 429 or 5xx: throttled, or failed part way"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RateLimiter:
+    """Token bucket shared by concurrent callers on one event loop"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ChargeLookupCache:
+    """Recent lookup_charge results, for clients polling an open payment.
+
+    Concurrent lookups of one reference share a single provider call, and
+    its result answers repeat polls for ttl seconds. Only open payments
+    reach the cache; settled ones are answered from the database.
+    """
+
+    def __init__(self, ttl: float = PAYMENT_VERIFY_CACHE_TTL, max_cached: int = PAYMENT_VERIFY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self._results: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.counts: Dict[str, int] = {"hit": 0, "shared": 0, "miss": 0}
+
+    async def lookup(self, gateway: "PaymentGateway", reference: str) -> Dict[str, Any]:
+        key = (gateway.name, reference)
+        cached = self._results.get(key)
+        if cached and cached[0] > time.monotonic():
+            self.counts["hit"] += 1
+            return cached[1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.counts["miss"] += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._lookup(gateway, reference, key))
+        else:
+            self.counts["shared"] += 1
+        # Shielded so one poller disconnecting does not cancel the others' lookup
+        return await asyncio.shield(task)
+
+    async def _lookup(self, gateway: "PaymentGateway", reference: str, key: Tuple[str, str]) -> Dict[str, Any]:
+        try:
+            result = await gateway.lookup_charge(reference)
+        finally:
+            self._inflight.pop(key, None)
+        if len(self._results) >= self.max_cached:
+            self._results.clear()
+        self._results[key] = (time.monotonic() + self.ttl, result)
+        return result
+
+    def render_metrics(self) -> str:
+        name = "payment_verify_lookups_total"
+        lines = [f"# HELP {name} Checkout verify lookups by cache result", f"# TYPE {name} counter"]
+        for result, count in sorted(self.counts.items()):
+            lines.append(f'{name}{{result="{result}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+class PaymentGateway:
+    """Adapter interface for a payment provider.
+
+    Amounts are in major units. Methods raise GatewayError when the
+    provider's answer is unusable; transport errors propagate as raised.
+    """
+
+    name = ""
+    # Whether list_refunds is implemented; checked before relying on it
+    supports_refund_listing = False
+
+    async def initialize_payment(
+        self,
+        reference: str,
+        amount: float,
+        currency: str,
+        email: str,
+        callback_url: str,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Start a checkout for one of our references.
+
+        Returns authorization_url (where the customer pays), access_code
+        (None if the provider has none) and reference.
+        """
+        raise NotImplementedError
+
+    async def lookup_charge(self, reference: str) -> Dict[str, Any]:
+        """Current state of the charge for one of our references.
+
+        Returns succeeded (True, False, or None while unpaid or unknown to
+        the provider), amount in major units and the provider's data.
+        Raises GatewayError when the provider's answer is inconclusive.
+        """
+        raise NotImplementedError
+
+    async def refund_charge(self, reference: str, transaction_id: str, amount: Optional[float] = None) -> Dict[str, Any]:
+        """Refund a charge, in full unless amount is given.
+
+        Returns refund_id, status (processed, pending or failed) and the
+        provider's data; a refund the provider declines is returned as
+        failed, with its message in data. Raises only when the provider
+        could not answer (transport errors, GatewayUnavailable).
+        """
+        raise NotImplementedError
+
+    async def list_refunds(self, reference: str, transaction_id: str) -> List[Dict[str, Any]]:
+        """Refunds the provider holds for a charge.
+
+        Each has refund_id, status, amount in major units and the
+        provider's data. Used to settle a refund submission whose outcome
+        is unknown before submitting it again. Only called on adapters
+        with supports_refund_listing; refunds on other adapters are left
+        for review.
+        """
+        raise NotImplementedError
+
+    # ---- Webhooks ----
+
+    signature_header = ""
+
+    def default_webhook_secret(self) -> str:
+        """Secret used when PaymentGatewayConfig has no webhook_secret"""
+        return ""
+
+    def webhook_signature_valid(self, body: bytes, signature: str, secret: str) -> bool:
+        raise NotImplementedError
+
+    def parse_webhook(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Normalise a webhook body to a charge outcome, or None for events we do not act on.
+
+        The outcome has event_key (unique per provider event), event_type,
+        reference (our payment_id), succeeded, amount (major units) and the
+        provider's transaction data.
+        """
+        raise NotImplementedError
+
+    async def aclose(self):
+        """Release connections; called on shutdown"""
+
+class BaseGateway(PaymentGateway):
+    """Shared connection pool and metrics for HTTP payment providers"""
+
+    def __init__(self, base_url: str, secret_key: str):
+        self.base_url = base_url
+        self.secret_key = secret_key
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.secret_key}"},
+                timeout=httpx.Timeout(
+                    PAYMENT_GATEWAY_READ_TIMEOUT,
+                    connect=PAYMENT_GATEWAY_CONNECT_TIMEOUT,
+                    pool=PAYMENT_GATEWAY_POOL_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=PAYMENT_GATEWAY_MAX_CONNECTIONS,
+                    max_keepalive_connections=PAYMENT_GATEWAY_MAX_KEEPALIVE
+                ),
+                http2=PAYMENT_GATEWAY_HTTP2 and HTTP2_AVAILABLE
+            )
+        return self._client
+
+    async def _request(self, operation: str, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        """Call the provider and return its JSON body (4xx error bodies included)"""
+        labels = (self.name, operation)
+        outcome = "error"
+        started = time.perf_counter()
+        gateway_metrics.in_flight += 1
+        try:
+            response = await self.client.request(method, path, **kwargs)
+            outcome = str(response.status_code)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise GatewayUnavailable(f"{self.name} {operation} returned {response.status_code}", response.status_code)
+            return response.json()
+        except httpx.TimeoutException:
+            outcome = "timeout"
+            raise
+        finally:
+            gateway_metrics.in_flight -= 1
+            gateway_metrics.observe(labels, outcome, time.perf_counter() - started)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# Provider refund states to processed, pending or failed
+REFUND_STATUSES = {
+    "processed": "processed",
+    "completed": "processed",
+    "successful": "processed",
+    "pending": "pending",
+    "processing": "pending",
+    "queued": "pending",
+    "failed": "failed"
+}
+
+GATEWAY_ADAPTERS: Dict[str, Type[PaymentGateway]] = {}
+
+def register_gateway(adapter_class: Type[PaymentGateway]) -> Type[PaymentGateway]:
+    """Class decorator making an adapter available under its name"""
+    GATEWAY_ADAPTERS[adapter_class.name] = adapter_class
+    return adapter_class
+
+@register_gateway
+class PaystackGateway(BaseGateway):
     """Paystack payment gateway integration (Popular in Nigeria)"""
-    
+
+    name = "paystack"
+    supports_refund_listing = True
+
     def __init__(self):
-        self.secret_key = os.getenv("PAYSTACK_SECRET_KEY", "")
+        super().__init__(PAYSTACK_BASE_URL, os.getenv("PAYSTACK_SECRET_KEY", ""))
         self.public_key = os.getenv("PAYSTACK_PUBLIC_KEY", "")
-        self.base_url = "https://api.paystack.co"
-    
+
     async def initialize_transaction(
-        self, 
-        email: str, 
-        amount: float, 
+        self,
+        email: str,
+        amount: float,
         reference: str,
         callback_url: str,
         metadata: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """Initialize a Paystack transaction"""
-        url = f"{self.base_url}/transaction/initialize"
-        
         # Paystack amount is in kobo (smallest currency unit)
         amount_in_kobo = int(amount * 100)
-        
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}",
-            "Content-Type": "application/json"
-        }
-        
+
         data = {
             "email": email,
             "amount": amount_in_kobo,
@@ -39,66 +325,120 @@ class PaystackGateway:
             "callback_url": callback_url,
             "metadata": metadata or {}
         }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=headers)
-            return response.json()
-    
+
+        return await self._request("initialize", "POST", "/transaction/initialize", json=data)
+
     async def verify_transaction(self, reference: str) -> Dict[str, Any]:
         """Verify a Paystack transaction"""
-        url = f"{self.base_url}/transaction/verify/{reference}"
-        
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            return response.json()
-    
+        return await self._request("verify", "GET", f"/transaction/verify/{reference}")
+
     async def create_refund(self, transaction_id: str, amount: Optional[float] = None) -> Dict[str, Any]:
         """Create a refund for a transaction"""
-        url = f"{self.base_url}/refund"
-        
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}",
-            "Content-Type": "application/json"
-        }
-        
         data = {"transaction": transaction_id}
         if amount:
             data["amount"] = int(amount * 100)  # Convert to kobo
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=headers)
-            return response.json()
 
-class FlutterwaveGateway:
+        return await self._request("refund", "POST", "/refund", json=data)
+
+    async def initialize_payment(
+        self,
+        reference: str,
+        amount: float,
+        currency: str,
+        email: str,
+        callback_url: str,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        result = await self.initialize_transaction(email, amount, reference, callback_url, metadata)
+        data = result.get("data") or {}
+        if not result.get("status") or not data.get("authorization_url"):
+            raise GatewayError(result.get("message") or "Paystack initialize failed")
+        return {"authorization_url": data["authorization_url"], "access_code": data.get("access_code"), "reference": reference}
+
+    async def refund_charge(self, reference: str, transaction_id: str, amount: Optional[float] = None) -> Dict[str, Any]:
+        result = await self.create_refund(transaction_id, amount)
+        data = result.get("data") or {}
+        if not result.get("status"):
+            # Declined (already reversed, not refundable, ...); retrying will not help
+            return {"refund_id": "", "status": "failed", "data": {**data, "message": result.get("message") or "Paystack refund declined"}}
+        return {"refund_id": str(data.get("id") or ""), "status": REFUND_STATUSES.get(data.get("status"), "pending"), "data": data}
+
+    async def list_refunds(self, reference: str, transaction_id: str) -> List[Dict[str, Any]]:
+        result = await self._request("refund_lookup", "GET", "/refund", params={"transaction": transaction_id})
+        if not result.get("status"):
+            raise GatewayError(result.get("message") or "Paystack refund lookup failed")
+        return [
+            {
+                "refund_id": str(refund.get("id") or ""),
+                "status": REFUND_STATUSES.get(refund.get("status"), "pending"),
+                "amount": (refund.get("amount") or 0) / 100,  # kobo
+                "data": refund
+            }
+            for refund in result.get("data") or []
+        ]
+
+    async def lookup_charge(self, reference: str) -> Dict[str, Any]:
+        result = await self.verify_transaction(reference)
+        data = result.get("data") or {}
+        if not result.get("status"):
+            if "not found" in str(result.get("message", "")).lower():
+                return {"succeeded": None, "amount": 0, "data": {}}
+            raise GatewayError(result.get("message") or "Paystack verify failed")
+
+        charge_status = data.get("status")
+        if charge_status == "success":
+            succeeded = True
+        elif charge_status in ("failed", "reversed"):
+            succeeded = False
+        else:
+            succeeded = None  # abandoned, ongoing, pending: the customer can still pay
+        return {"succeeded": succeeded, "amount": (data.get("amount") or 0) / 100, "data": data}
+
+    signature_header = "x-paystack-signature"
+
+    def default_webhook_secret(self) -> str:
+        # Paystack signs webhooks with the account secret key
+        return self.secret_key
+
+    def webhook_signature_valid(self, body: bytes, signature: str, secret: str) -> bool:
+        expected = hmac.new(secret.encode(), body, hashlib.sha512).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    def parse_webhook(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        event_type = payload.get("event")
+        data = payload.get("data") or {}
+        if event_type != "charge.success" or not data.get("reference"):
+            return None
+        return {
+            "event_key": f"{event_type}:{data.get('id')}",
+            "event_type": event_type,
+            "reference": data["reference"],
+            "succeeded": data.get("status") == "success",
+            "amount": (data.get("amount") or 0) / 100,  # kobo
+            "data": data
+        }
+
+@register_gateway
+class FlutterwaveGateway(BaseGateway):
     """Flutterwave payment gateway integration (Popular in Africa)"""
-    
+
+    name = "flutterwave"
+
     def __init__(self):
-        self.secret_key = os.getenv("FLUTTERWAVE_SECRET_KEY", "")
+        super().__init__(FLUTTERWAVE_BASE_URL, os.getenv("FLUTTERWAVE_SECRET_KEY", ""))
         self.public_key = os.getenv("FLUTTERWAVE_PUBLIC_KEY", "")
-        self.base_url = "https://api.flutterwave.com/v3"
-    
-    async def initialize_payment(
+
+    async def initialize_transaction(
         self,
         amount: float,
         currency: str,
         email: str,
         tx_ref: str,
         redirect_url: str,
-        customer_name: str,
+        customer_name: Optional[str] = None,
         metadata: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """Initialize a Flutterwave payment"""
-        url = f"{self.base_url}/payments"
-        
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
             "tx_ref": tx_ref,
             "amount": amount,
@@ -106,7 +446,7 @@ class FlutterwaveGateway:
             "redirect_url": redirect_url,
             "customer": {
                 "email": email,
-                "name": customer_name
+                "name": customer_name or email
             },
             "customizations": {
                 "title": "Execute Tech Academy",
@@ -115,43 +455,97 @@ class FlutterwaveGateway:
             },
             "meta": metadata or {}
         }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=headers)
-            return response.json()
-    
+
+        return await self._request("initialize", "POST", "/payments", json=data)
+
+    async def initialize_payment(
+        self,
+        reference: str,
+        amount: float,
+        currency: str,
+        email: str,
+        callback_url: str,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        result = await self.initialize_transaction(amount, currency, email, reference, callback_url, metadata=metadata)
+        data = result.get("data") or {}
+        if result.get("status") != "success" or not data.get("link"):
+            raise GatewayError(result.get("message") or "Flutterwave initialize failed")
+        return {"authorization_url": data["link"], "access_code": None, "reference": reference}
+
     async def verify_transaction(self, transaction_id: str) -> Dict[str, Any]:
         """Verify a Flutterwave transaction"""
-        url = f"{self.base_url}/transactions/{transaction_id}/verify"
-        
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}"
+        return await self._request("verify", "GET", f"/transactions/{transaction_id}/verify")
+
+    async def create_refund(self, transaction_id: str, amount: Optional[float] = None) -> Dict[str, Any]:
+        """Refund a transaction, in full unless amount is given"""
+        return await self._request(
+            "refund", "POST", f"/transactions/{transaction_id}/refund", json={"amount": amount} if amount else {}
+        )
+
+    async def refund_charge(self, reference: str, transaction_id: str, amount: Optional[float] = None) -> Dict[str, Any]:
+        result = await self.create_refund(transaction_id, amount)
+        data = result.get("data") or {}
+        if result.get("status") != "success":
+            return {"refund_id": "", "status": "failed", "data": {**data, "message": result.get("message") or "Flutterwave refund declined"}}
+        return {"refund_id": str(data.get("id") or ""), "status": REFUND_STATUSES.get(data.get("status"), "pending"), "data": data}
+
+    async def lookup_charge(self, reference: str) -> Dict[str, Any]:
+        result = await self._request(
+            "verify", "GET", "/transactions/verify_by_reference", params={"tx_ref": reference}
+        )
+        data = result.get("data") or {}
+        if result.get("status") != "success":
+            if "no transaction" in str(result.get("message", "")).lower():
+                return {"succeeded": None, "amount": 0, "data": {}}
+            raise GatewayError(result.get("message") or "Flutterwave verify failed")
+
+        charge_status = data.get("status")
+        succeeded = True if charge_status == "successful" else False if charge_status == "failed" else None
+        return {"succeeded": succeeded, "amount": data.get("amount") or 0, "data": data}
+
+    signature_header = "verif-hash"
+
+    def default_webhook_secret(self) -> str:
+        return os.getenv("FLUTTERWAVE_WEBHOOK_HASH", "")
+
+    def webhook_signature_valid(self, body: bytes, signature: str, secret: str) -> bool:
+        # Flutterwave sends the configured secret hash back verbatim
+        return hmac.compare_digest(secret, signature)
+
+    def parse_webhook(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        event_type = payload.get("event")
+        data = payload.get("data") or {}
+        if event_type != "charge.completed" or not data.get("tx_ref"):
+            return None
+        return {
+            "event_key": f"{event_type}:{data.get('id')}",
+            "event_type": event_type,
+            "reference": data["tx_ref"],
+            "succeeded": data.get("status") == "successful",
+            "amount": data.get("amount") or 0,
+            "data": data
         }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            return response.json()
 
-class StripeGateway:
-    """Stripe payment gateway integration (International)"""
-    
-    def __init__(self):
-        self.secret_key = os.getenv("STRIPE_SECRET_KEY", "")
-        self.publishable_key = os.getenv("STRIPE_PUBLISHABLE_KEY", "")
-    
-    # Stripe integration would use their official SDK
-    # This is a placeholder for the structure
-
-def get_payment_gateway(gateway_name: str):
-    """Factory function to get payment gateway"""
-    gateways = {
-        "paystack": PaystackGateway,
-        "flutterwave": FlutterwaveGateway,
-        "stripe": StripeGateway
-    }
-    
-    gateway_class = gateways.get(gateway_name.lower())
-    if not gateway_class:
-        raise ValueError(f"Unsupported payment gateway: {gateway_name}")
-    
-    return gateway_class()
+_gateways: Dict[str, PaymentGateway] = {}
+
+def get_payment_gateway(gateway_name: str) -> PaymentGateway:
+    """Shared adapter instance for a payment method, created on first use"""
+    name = gateway_name.lower()
+    adapter_name = PAYMENT_GATEWAY_ROUTES.get(name, name)
+    gateway = _gateways.get(adapter_name)
+    if gateway is None:
+        adapter_class = GATEWAY_ADAPTERS.get(adapter_name)
+        if not adapter_class:
+            raise ValueError(f"Unsupported payment gateway: {gateway_name}")
+        gateway = _gateways[adapter_name] = adapter_class()
+    return gateway
+
+async def close_payment_gateways():
+    """Close every gateway's connection pool; called on shutdown"""
+    while _gateways:
+        _, gateway = _gateways.popitem()
+        await gateway.aclose()
+
+# Registers the simulator adapter; imported last, as it builds on this module
+import payment_simulator  # noqa: E402,F401
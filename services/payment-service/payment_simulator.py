@@ -0,0 +1,216 @@
+"""In-process payment provider for offline load tests.
+
+SimulatorGateway implements the PaymentGateway interface without any
+network calls to a provider: each call sleeps for a configurable latency
+(with jitter), and a configurable share of calls fail as a provider
+outage would. A checkout settles PAYMENT_SIMULATOR_PAY_DELAY_MS after it
+starts, as paid or (at PAYMENT_SIMULATOR_FAILURE_RATE) as failed. When
+PAYMENT_SIMULATOR_WEBHOOK_URL is set, the outcome is also posted there
+as a signed webhook, so a benchmark drives the same webhook, verify and
+reconciler paths as production.
+
+Route payment methods to it with PAYMENT_GATEWAY_ROUTES, e.g.
+
+    PAYMENT_GATEWAY_ROUTES=paystack=simulator
+    PAYMENT_SIMULATOR_WEBHOOK_URL=http://localhost:8004/webhooks/paystack
+    PAYMENT_SIMULATOR_WEBHOOK_SECRET=local-simulator-secret
+
+Charges live in process memory, so run one payment-service replica (a
+lookup on another replica sees an unknown, unpaid charge until the
+webhook lands). Webhooks are rejected while the secret is unset.
+"""
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+from dotenv import load_dotenv
+
+from payment_gateways import GatewayUnavailable, PaymentGateway, gateway_metrics, register_gateway
+
+load_dotenv()
+
+PAYMENT_SIMULATOR_LATENCY_MS = float(os.getenv("PAYMENT_SIMULATOR_LATENCY_MS", "50"))
+PAYMENT_SIMULATOR_JITTER_MS = float(os.getenv("PAYMENT_SIMULATOR_JITTER_MS", "10"))
+PAYMENT_SIMULATOR_FAILURE_RATE = float(os.getenv("PAYMENT_SIMULATOR_FAILURE_RATE", "0.05"))  # charges declined
+PAYMENT_SIMULATOR_ERROR_RATE = float(os.getenv("PAYMENT_SIMULATOR_ERROR_RATE", "0"))  # calls that error
+PAYMENT_SIMULATOR_PAY_DELAY_MS = float(os.getenv("PAYMENT_SIMULATOR_PAY_DELAY_MS", "1000"))
+PAYMENT_SIMULATOR_WEBHOOK_URL = os.getenv("PAYMENT_SIMULATOR_WEBHOOK_URL", "")
+PAYMENT_SIMULATOR_WEBHOOK_SECRET = os.getenv("PAYMENT_SIMULATOR_WEBHOOK_SECRET", "")
+PAYMENT_SIMULATOR_SEED = os.getenv("PAYMENT_SIMULATOR_SEED")  # fixes outcomes and latencies between runs
+
+WEBHOOK_ATTEMPTS = 3
+
+
+@register_gateway
+class SimulatorGateway(PaymentGateway):
+    """Simulated provider with configurable latency, failures and webhooks"""
+
+    name = "simulator"
+    supports_refund_listing = True
+    signature_header = "x-simulator-signature"
+
+    def __init__(
+        self,
+        latency_ms: float = PAYMENT_SIMULATOR_LATENCY_MS,
+        jitter_ms: float = PAYMENT_SIMULATOR_JITTER_MS,
+        failure_rate: float = PAYMENT_SIMULATOR_FAILURE_RATE,
+        error_rate: float = PAYMENT_SIMULATOR_ERROR_RATE,
+        pay_delay_ms: float = PAYMENT_SIMULATOR_PAY_DELAY_MS,
+        webhook_url: str = PAYMENT_SIMULATOR_WEBHOOK_URL,
+        webhook_secret: str = PAYMENT_SIMULATOR_WEBHOOK_SECRET,
+        seed: Optional[str] = PAYMENT_SIMULATOR_SEED
+    ):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.pay_delay = pay_delay_ms / 1000
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.random = random.Random(seed)
+        self.charges: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._deliveries: Set[asyncio.Task] = set()
+
+    async def _call(self, operation: str):
+        """Provider round trip: latency, then maybe a simulated outage"""
+        started = time.perf_counter()
+        await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+        failed = self.random.random() < self.error_rate
+        gateway_metrics.observe((self.name, operation), "503" if failed else "200", time.perf_counter() - started)
+        if failed:
+            raise GatewayUnavailable(f"Simulated provider error during {operation}", 503)
+
+    def _charge_view(self, charge: Dict[str, Any]) -> Dict[str, Any]:
+        """Provider-side charge data, settled once its pay delay has passed"""
+        settled = time.monotonic() >= charge["settles_at"]
+        return {
+            "id": charge["id"],
+            "reference": charge["reference"],
+            "amount": charge["amount"],
+            "currency": charge["currency"],
+            "status": charge["outcome"] if settled else "ongoing",
+            "customer": {"email": charge["email"]}
+        }
+
+    async def initialize_payment(
+        self,
+        reference: str,
+        amount: float,
+        currency: str,
+        email: str,
+        callback_url: str,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        await self._call("initialize")
+        charge_id = next(self._ids)
+        self.charges[reference] = {
+            "id": charge_id,
+            "reference": reference,
+            "amount": amount,
+            "currency": currency,
+            "email": email,
+            "outcome": "failed" if self.random.random() < self.failure_rate else "success",
+            "settles_at": time.monotonic() + self.pay_delay,
+            "refunds": []
+        }
+        if self.webhook_url:
+            delivery = asyncio.ensure_future(self._deliver_webhook(reference))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+        return {
+            "authorization_url": f"https://simulator.invalid/checkout/{reference}",
+            "access_code": f"SIM-{charge_id}",
+            "reference": reference
+        }
+
+    async def lookup_charge(self, reference: str) -> Dict[str, Any]:
+        await self._call("verify")
+        charge = self.charges.get(reference)
+        if charge is None:
+            return {"succeeded": None, "amount": 0, "data": {}}
+        data = self._charge_view(charge)
+        succeeded = True if data["status"] == "success" else False if data["status"] == "failed" else None
+        return {"succeeded": succeeded, "amount": data["amount"], "data": data}
+
+    async def refund_charge(self, reference: str, transaction_id: str, amount: Optional[float] = None) -> Dict[str, Any]:
+        await self._call("refund")
+        charge = self.charges.get(reference)
+        if charge is not None and self._charge_view(charge)["status"] != "success":
+            return {"refund_id": "", "status": "failed", "data": {"message": "Charge was not paid"}}
+        data = {
+            "id": f"SIMR-{next(self._ids)}",
+            "transaction": transaction_id,
+            "amount": amount if amount else (charge or {}).get("amount"),
+            "status": "processed"
+        }
+        if charge is not None:
+            charge["refunds"].append(data)
+        return {"refund_id": data["id"], "status": "processed", "data": data}
+
+    async def list_refunds(self, reference: str, transaction_id: str) -> List[Dict[str, Any]]:
+        await self._call("refund_lookup")
+        charge = self.charges.get(reference) or {}
+        return [
+            {"refund_id": refund["id"], "status": refund["status"], "amount": refund["amount"], "data": refund}
+            for refund in charge.get("refunds", [])
+        ]
+
+    # ---- Webhooks ----
+
+    def _sign(self, body: bytes, secret: str) -> str:
+        return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+    async def _deliver_webhook(self, reference: str):
+        await asyncio.sleep(self.pay_delay)
+        charge = self.charges.get(reference)
+        if charge is None:
+            return
+        body = json.dumps({"event": "charge.completed", "data": self._charge_view(charge)}).encode()
+        headers = {"content-type": "application/json", self.signature_header: self._sign(body, self.webhook_secret)}
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10.0)
+        for attempt in range(WEBHOOK_ATTEMPTS):
+            try:
+                response = await self._client.post(self.webhook_url, content=body, headers=headers)
+                if response.status_code < 500:
+                    return
+            except httpx.HTTPError as e:
+                print(f"Simulator webhook for {reference} failed: {e}")
+            await asyncio.sleep(2 ** attempt)
+
+    def default_webhook_secret(self) -> str:
+        return self.webhook_secret
+
+    def webhook_signature_valid(self, body: bytes, signature: str, secret: str) -> bool:
+        # With no secret anyone could sign; never accept that
+        return bool(secret) and hmac.compare_digest(self._sign(body, secret), signature)
+
+    def parse_webhook(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        event_type = payload.get("event")
+        data = payload.get("data") or {}
+        if event_type != "charge.completed" or not data.get("reference"):
+            return None
+        return {
+            "event_key": f"{event_type}:{data.get('id')}",
+            "event_type": event_type,
+            "reference": data["reference"],
+            "succeeded": data.get("status") == "success",
+            "amount": data.get("amount") or 0,
+            "data": data
+        }
+
+    async def aclose(self):
+        for delivery in list(self._deliveries):
+            delivery.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
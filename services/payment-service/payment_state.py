@@ -0,0 +1,90 @@
+"""Payment status transitions shared by the API and background workers.
+
+A payment leaves PENDING/PROCESSING exactly once. Every path that learns a
+charge outcome (client verify, provider webhook) goes through
+apply_charge_outcome with the payment row locked, so a repeated or late
+notification is a no-op rather than a second charge transaction and a
+second outbox event. cancel_payment does the same for expired payments,
+and mark_refunded for completed payments whose refunds cover the charge.
+"""
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+import models
+from service_toolkit import events
+
+OPEN_STATUSES = (models.PaymentStatus.PENDING, models.PaymentStatus.PROCESSING)
+
+# Amounts are compared in major units; anything under a kobo/cent is rounding
+AMOUNT_TOLERANCE = 0.005
+
+
+def amount_matches(paid: float, expected: float) -> bool:
+    """Whether two amounts in major units are equal up to rounding"""
+    return abs(paid - expected) <= AMOUNT_TOLERANCE
+
+
+def add_payment_event(db: Session, payment: models.Payment):
+    """Stage a payment status event in the outbox, committed with the payment"""
+    events.add_event(
+        db,
+        f"payment.{payment.status.value}",
+        aggregate_type="payment",
+        aggregate_id=payment.payment_id,
+        payload={
+            "payment_id": payment.payment_id,
+            "order_id": payment.order_id,
+            "student_id": payment.student_id,
+            "amount": payment.amount,
+            "status": payment.status.value
+        }
+    )
+
+
+def apply_charge_outcome(db: Session, payment: models.Payment, succeeded: bool, data: dict) -> bool:
+    """Complete or fail an open payment; returns False if it was already settled"""
+    if payment.status not in OPEN_STATUSES:
+        return False
+
+    if succeeded:
+        payment.status = models.PaymentStatus.COMPLETED
+        payment.paid_at = datetime.utcnow()
+        payment.gateway_transaction_id = str(data.get("id"))
+        payment.gateway_response = data
+
+        db.add(models.Transaction(
+            payment_id=payment.id,
+            transaction_type="charge",
+            amount=payment.amount,
+            status=models.PaymentStatus.COMPLETED,
+            gateway_transaction_id=str(data.get("id")),
+            gateway_response=data
+        ))
+    else:
+        payment.status = models.PaymentStatus.FAILED
+        payment.gateway_response = data
+
+    # Order service is notified through the outbox relay
+    add_payment_event(db, payment)
+    return True
+
+
+def cancel_payment(db: Session, payment: models.Payment) -> bool:
+    """Cancel an open payment that was never paid; returns False if it was already settled"""
+    if payment.status not in OPEN_STATUSES:
+        return False
+
+    payment.status = models.PaymentStatus.CANCELLED
+    add_payment_event(db, payment)
+    return True
+
+
+def mark_refunded(db: Session, payment: models.Payment) -> bool:
+    """Move a completed payment to REFUNDED; returns False unless it was completed"""
+    if payment.status != models.PaymentStatus.COMPLETED:
+        return False
+
+    payment.status = models.PaymentStatus.REFUNDED
+    add_payment_event(db, payment)
+    return True
@@ -0,0 +1,291 @@
+"""Background reconciliation of open payments.
+
+PaymentReconciler settles PENDING/PROCESSING payments whose verify call
+or webhook never arrived, and cancels the ones that expired unpaid. Each
+pass walks open payments in payments.id order (keyset batches, no OFFSET),
+looks every payment in the batch up with its gateway concurrently, paced
+by a RateLimiter, and writes the batch's transitions in one transaction
+together with the pass checkpoint. A restarted replica resumes from the
+checkpoint instead of rescanning, and a lease on the checkpoint row keeps
+replicas from running the same pass twice.
+
+An expired payment is only cancelled once its gateway says it was not
+paid (or the method has no gateway lookup); a failed lookup leaves the
+payment for the next pass. Transitions go through payment_state, so
+they emit outbox events for order-service and never fight a webhook.
+
+Gateway clients are bound to the app's event loop, so the reconciler
+runs as an asyncio task there and does its database work in the
+threadpool.
+"""
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Payment, ReconcilerCheckpoint
+from payment_gateways import RateLimiter, get_payment_gateway
+from payment_state import OPEN_STATUSES, amount_matches, apply_charge_outcome, cancel_payment
+
+load_dotenv()
+
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "300"))  # seconds between passes
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "200"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "10"))
+RECONCILE_RATE_LIMIT = float(os.getenv("RECONCILE_RATE_LIMIT", "20"))  # gateway lookups per second
+RECONCILE_MIN_AGE = float(os.getenv("RECONCILE_MIN_AGE", "600"))  # leave fresh checkouts alone
+RECONCILE_LEASE_SECONDS = float(os.getenv("RECONCILE_LEASE_SECONDS", "120"))
+
+LOOKUP_FAILED = object()
+
+Candidate = Tuple[int, str, str, float, Optional[datetime]]  # id, payment_id, method, amount, expires_at
+Decision = Tuple[int, str, dict]  # id, action, gateway data
+
+
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class PaymentReconciler:
+    """Periodic, resumable reconciliation pass over open payments"""
+
+    def __init__(
+        self,
+        session_factory,
+        name: str = "payments",
+        batch_size: int = RECONCILE_BATCH_SIZE,
+        concurrency: int = RECONCILE_CONCURRENCY,
+        rate_limit: float = RECONCILE_RATE_LIMIT,
+        interval: float = RECONCILE_INTERVAL
+    ):
+        self.session_factory = session_factory
+        self.name = name
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.interval = interval
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+        self.counts: Dict[str, int] = {"completed": 0, "failed": 0, "cancelled": 0, "lookup_failed": 0}
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task and not self._task.done():
+            return
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self, timeout: float = 5.0):
+        if not self._task:
+            return
+        self._stop.set()
+        try:
+            # Lets the current batch commit; cancelled if it overruns
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._task = None
+        await run_in_threadpool(self._release)
+
+    async def _loop(self):
+        while not self._stop.is_set():
+            try:
+                await self.run_pass()
+            except Exception as e:
+                print(f"Payment reconciliation failed: {e}")
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_pass(self) -> int:
+        """Reconcile open payments from the checkpoint onwards; returns payments changed"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = RateLimiter(self.rate_limit)
+        changed = 0
+
+        while not self._stop.is_set():
+            candidates = await run_in_threadpool(self._claim_batch)
+            if candidates is None:
+                break  # Another replica holds the lease
+            if not candidates:
+                await run_in_threadpool(self._finish_pass)
+                break
+
+            lookups = await asyncio.gather(*(self._lookup(c, semaphore, limiter) for c in candidates))
+            decisions = self._decide(candidates, lookups)
+            changed += await run_in_threadpool(self._apply, candidates[-1][0], decisions)
+
+        return changed
+
+    # ---- Gateway lookups ----
+
+    async def _lookup(self, candidate: Candidate, semaphore: asyncio.Semaphore, limiter: RateLimiter):
+        _, payment_id, method, _, _ = candidate
+        try:
+            gateway = get_payment_gateway(method)
+        except ValueError:
+            return None  # No gateway behind this method; only expiry applies
+
+        async with semaphore:
+            await limiter.acquire()
+            try:
+                return await gateway.lookup_charge(payment_id)
+            except Exception as e:
+                print(f"Reconciler lookup for {payment_id} failed: {e}")
+                return LOOKUP_FAILED
+
+    def _decide(self, candidates: List[Candidate], lookups: list) -> List[Decision]:
+        now = datetime.utcnow()
+        decisions = []
+        for (pk, payment_id, _, amount, expires_at), lookup in zip(candidates, lookups):
+            if lookup is LOOKUP_FAILED:
+                self.counts["lookup_failed"] += 1
+                continue
+
+            succeeded = lookup["succeeded"] if lookup else None
+            if succeeded:
+                if not amount_matches(lookup["amount"], amount):
+                    print(f"Reconciler skipped {payment_id}: paid {lookup['amount']}, expected {amount}")
+                    continue
+                decisions.append((pk, "complete", lookup["data"]))
+            elif succeeded is False:
+                decisions.append((pk, "fail", lookup["data"]))
+            elif expires_at is not None and _utc_naive(expires_at) <= now:
+                decisions.append((pk, "cancel", {}))
+        return decisions
+
+    # ---- Database ----
+
+    def _checkpoint(self, db: Session) -> ReconcilerCheckpoint:
+        checkpoint = db.query(ReconcilerCheckpoint).filter(ReconcilerCheckpoint.name == self.name).first()
+        if checkpoint is None:
+            db.add(ReconcilerCheckpoint(name=self.name, cursor=0))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # Created concurrently by another replica
+            checkpoint = db.query(ReconcilerCheckpoint).filter(ReconcilerCheckpoint.name == self.name).one()
+        return checkpoint
+
+    def _claim_batch(self) -> Optional[List[Candidate]]:
+        """Take or renew the lease and load the next batch after the cursor"""
+        db = self.session_factory()
+        try:
+            checkpoint = self._checkpoint(db)
+            now = datetime.utcnow()
+            # Conditional update, so two replicas cannot both take a free lease
+            claimed = db.query(ReconcilerCheckpoint).filter(
+                ReconcilerCheckpoint.id == checkpoint.id,
+                or_(
+                    ReconcilerCheckpoint.lease_owner.is_(None),
+                    ReconcilerCheckpoint.lease_owner == self.owner,
+                    ReconcilerCheckpoint.lease_expires_at < now
+                )
+            ).update({
+                ReconcilerCheckpoint.lease_owner: self.owner,
+                ReconcilerCheckpoint.lease_expires_at: now + timedelta(seconds=RECONCILE_LEASE_SECONDS)
+            }, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                return None
+
+            db.refresh(checkpoint)
+            rows = db.query(
+                Payment.id, Payment.payment_id, Payment.payment_method, Payment.amount, Payment.expires_at
+            ).filter(
+                Payment.status.in_(OPEN_STATUSES),
+                Payment.id > checkpoint.cursor,
+                Payment.created_at <= now - timedelta(seconds=RECONCILE_MIN_AGE)
+            ).order_by(Payment.id).limit(self.batch_size).all()
+            return [(pk, payment_id, method.value, amount, expires_at) for pk, payment_id, method, amount, expires_at in rows]
+        finally:
+            db.close()
+
+    def _apply(self, cursor: int, decisions: List[Decision]) -> int:
+        """Write a batch's transitions and advance the cursor in one transaction"""
+        db = self.session_factory()
+        try:
+            changed = 0
+            if decisions:
+                # One locking SELECT for the batch; webhooks that won the
+                # race have already moved their payments out of OPEN_STATUSES
+                payments = {
+                    payment.id: payment
+                    for payment in db.query(Payment).filter(
+                        Payment.id.in_([pk for pk, _, _ in decisions])
+                    ).with_for_update().all()
+                }
+                for pk, action, data in decisions:
+                    payment = payments.get(pk)
+                    if payment is None:
+                        continue
+                    if action == "cancel":
+                        applied = cancel_payment(db, payment)
+                    else:
+                        applied = apply_charge_outcome(db, payment, action == "complete", data)
+                    if applied:
+                        changed += 1
+                        self.counts[payment.status.value] += 1
+
+            db.query(ReconcilerCheckpoint).filter(
+                ReconcilerCheckpoint.name == self.name,
+                ReconcilerCheckpoint.lease_owner == self.owner
+            ).update({
+                ReconcilerCheckpoint.cursor: cursor,
+                ReconcilerCheckpoint.lease_expires_at: datetime.utcnow() + timedelta(seconds=RECONCILE_LEASE_SECONDS)
+            }, synchronize_session=False)
+            db.commit()
+            return changed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _finish_pass(self):
+        db = self.session_factory()
+        try:
+            db.query(ReconcilerCheckpoint).filter(
+                ReconcilerCheckpoint.name == self.name,
+                ReconcilerCheckpoint.lease_owner == self.owner
+            ).update({
+                ReconcilerCheckpoint.cursor: 0,
+                ReconcilerCheckpoint.lease_owner: None,
+                ReconcilerCheckpoint.lease_expires_at: None,
+                ReconcilerCheckpoint.last_pass_completed_at: datetime.utcnow()
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _release(self):
+        """Give up the lease on shutdown, keeping the cursor for the next run"""
+        db = self.session_factory()
+        try:
+            db.query(ReconcilerCheckpoint).filter(
+                ReconcilerCheckpoint.name == self.name,
+                ReconcilerCheckpoint.lease_owner == self.owner
+            ).update({
+                ReconcilerCheckpoint.lease_owner: None,
+                ReconcilerCheckpoint.lease_expires_at: None
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def render_metrics(self) -> str:
+        name = "payment_reconciler_transitions_total"
+        lines = [f"# HELP {name} Payments settled or cancelled by the reconciler", f"# TYPE {name} counter"]
+        for outcome, count in sorted(self.counts.items()):
+            lines.append(f'{name}{{outcome="{outcome}"}} {count}')
+        return "\n".join(lines) + "\n"
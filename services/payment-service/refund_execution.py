@@ -0,0 +1,388 @@
+"""Gateway refund execution.
+
+Approving a refund (one at a time with PUT /refunds/{refund_id}, or many
+with POST /refunds/approve) checks it against its payment and queues it;
+the refunds table is the queue. RefundExecutor claims APPROVED refunds in
+batches with SKIP LOCKED and keeps the row locks while it submits the
+batch, so replicas never submit the same refund at the same time. Calls
+run concurrently, paced by one RateLimiter per provider: a slow or
+strictly limited provider holds back only its own refunds. A batch's
+outcomes, its refund Transaction rows (one multi-row INSERT) and the
+payments its refunds now fully cover are committed together.
+
+A refund the gateway declines fails at once, and one it accepts but has
+not settled yet is left PROCESSING. A submission that raises is retried
+with exponential backoff up to REFUND_MAX_ATTEMPTS. Refund calls carry
+no idempotency key, so an error after the request may have reached the
+provider (timeout, 5xx) marks the outcome unknown. The next attempt
+first lists the charge's refunds at the provider and adopts a matching
+one instead of refunding twice. A refund whose outcome stays unknown is
+never marked FAILED: it is left PROCESSING for review when its attempts
+run out or its gateway cannot list refunds. Failed refunds can be
+approved again.
+
+Gateway clients are bound to the app's event loop, so the executor runs
+as an asyncio task there and does its database work in the threadpool.
+"""
+import asyncio
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, insert, or_
+from sqlalchemy.orm import Session
+
+from models import Payment, PaymentStatus, Refund, RefundStatus, Transaction
+from payment_gateways import GatewayUnavailable, PaymentGateway, RateLimiter, get_payment_gateway
+from payment_state import AMOUNT_TOLERANCE, amount_matches, mark_refunded
+
+load_dotenv()
+
+REFUND_BATCH_SIZE = int(os.getenv("REFUND_BATCH_SIZE", "50"))
+REFUND_CONCURRENCY = int(os.getenv("REFUND_CONCURRENCY", "10"))
+REFUND_RATE_LIMIT = float(os.getenv("REFUND_RATE_LIMIT", "5"))  # refund calls per second, per provider
+# Per-provider overrides of REFUND_RATE_LIMIT, e.g. "paystack=10,flutterwave=2"
+REFUND_RATE_LIMITS = dict(
+    (provider.strip().lower(), float(rate))
+    for provider, _, rate in (
+        limit.partition("=") for limit in os.getenv("REFUND_RATE_LIMITS", "").split(",") if "=" in limit
+    )
+)
+REFUND_POLL_INTERVAL = float(os.getenv("REFUND_POLL_INTERVAL", "2"))
+REFUND_MAX_ATTEMPTS = int(os.getenv("REFUND_MAX_ATTEMPTS", "6"))
+REFUND_RETRY_BACKOFF = float(os.getenv("REFUND_RETRY_BACKOFF", "10"))  # seconds, doubled per attempt
+
+APPROVABLE_STATUSES = (RefundStatus.PENDING, RefundStatus.FAILED)
+# Refunds that claim part of their payment's amount
+COMMITTED_STATUSES = (RefundStatus.APPROVED, RefundStatus.PROCESSING, RefundStatus.COMPLETED)
+
+# The gateway cannot tell whether an earlier submission went through
+OUTCOME_UNRESOLVED = object()
+
+
+class Submission(NamedTuple):
+    id: int
+    refund_id: str
+    method: str
+    reference: str  # Our payment_id
+    transaction_id: str  # The charge at the gateway
+    amount: float
+    full: bool  # Sent without an amount, so the provider refunds exactly what it charged
+    outcome_unknown: bool
+    known_refund_ids: Set[str]  # Gateway refunds already recorded against the payment
+
+
+def _not_sent(error: Exception) -> bool:
+    """Whether the provider certainly did not act on a failed request"""
+    if isinstance(error, GatewayUnavailable):
+        return error.status_code == 429
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+# ==================== APPROVAL ====================
+
+def _approval_error(refund: Optional[Refund], payment: Optional[Payment], committed: Dict[int, float]) -> Optional[str]:
+    if refund is None:
+        return "Refund not found"
+    if refund.status not in APPROVABLE_STATUSES:
+        return f"Refund is {refund.status.value}"
+    if payment.status != PaymentStatus.COMPLETED:
+        return f"Payment is {payment.status.value}"
+    if not payment.gateway_transaction_id:
+        return "Payment has no gateway transaction"
+    try:
+        get_payment_gateway(payment.payment_method.value)
+    except ValueError:
+        return f"No gateway refunds for {payment.payment_method.value} payments"
+    if refund.amount <= 0:
+        return "Refund amount must be positive"
+    if committed[payment.id] + refund.amount > payment.amount + AMOUNT_TOLERANCE:
+        return f"Refunds would exceed the payment amount of {payment.amount}"
+    return None
+
+
+def approve_refunds(db: Session, refund_ids: List[str], admin_id: int) -> Tuple[List[Refund], Dict[str, str]]:
+    """Queue refunds for the executor; returns (approved, refund_id -> reason not approved).
+
+    The caller commits. Refunds and their payments are locked, so
+    concurrent approvals cannot refund more than a payment's amount.
+    """
+    refunds = {
+        refund.refund_id: refund
+        for refund in db.query(Refund).filter(
+            Refund.refund_id.in_(refund_ids)
+        ).order_by(Refund.id).with_for_update().all()
+    }
+    payment_ids = {refund.payment_id for refund in refunds.values()}
+    payments = {
+        payment.id: payment
+        for payment in db.query(Payment).filter(Payment.id.in_(payment_ids)).order_by(Payment.id).with_for_update().all()
+    }
+    committed = defaultdict(float, db.query(Refund.payment_id, func.sum(Refund.amount)).filter(
+        Refund.payment_id.in_(payment_ids),
+        Refund.status.in_(COMMITTED_STATUSES)
+    ).group_by(Refund.payment_id).all())
+
+    approved: List[Refund] = []
+    rejected: Dict[str, str] = {}
+    now = datetime.utcnow()
+    for refund_id in dict.fromkeys(refund_ids):
+        refund = refunds.get(refund_id)
+        error = _approval_error(refund, payments.get(refund.payment_id) if refund else None, committed)
+        if error:
+            rejected[refund_id] = error
+            continue
+
+        refund.status = RefundStatus.APPROVED
+        refund.processed_by = admin_id
+        refund.processed_at = now
+        refund.attempts = 0
+        refund.last_error = None
+        refund.next_attempt_at = None
+        committed[refund.payment_id] += refund.amount
+        approved.append(refund)
+    return approved, rejected
+
+
+def refund_covered_payments(db: Session, payment_ids: Iterable[int]) -> int:
+    """Mark payments REFUNDED once completed refunds cover them; returns payments changed"""
+    payment_ids = set(payment_ids)
+    db.flush()
+    refunded = dict(db.query(Refund.payment_id, func.sum(Refund.amount)).filter(
+        Refund.payment_id.in_(payment_ids),
+        Refund.status == RefundStatus.COMPLETED
+    ).group_by(Refund.payment_id).all())
+
+    changed = 0
+    for payment in db.query(Payment).filter(Payment.id.in_(payment_ids)).order_by(Payment.id).with_for_update().all():
+        if refunded.get(payment.id, 0) >= payment.amount - AMOUNT_TOLERANCE and mark_refunded(db, payment):
+            changed += 1
+    return changed
+
+
+# ==================== EXECUTION ====================
+
+class RefundExecutor:
+    """Submits approved refunds to their gateways in rate-limited batches"""
+
+    def __init__(
+        self,
+        session_factory,
+        batch_size: int = REFUND_BATCH_SIZE,
+        concurrency: int = REFUND_CONCURRENCY,
+        rate_limit: float = REFUND_RATE_LIMIT,
+        interval: float = REFUND_POLL_INTERVAL
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.interval = interval
+        self.limiters: Dict[str, RateLimiter] = {}
+        self.counts: Dict[str, int] = {"completed": 0, "processing": 0, "failed": 0, "retried": 0, "adopted": 0}
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task and not self._task.done():
+            return
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self, timeout: float = 5.0):
+        if not self._task:
+            return
+        self._stop.set()
+        try:
+            # Lets the current batch commit; cancelled if it overruns
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._task = None
+
+    async def _loop(self):
+        backoff = self.interval
+        while not self._stop.is_set():
+            try:
+                handled = await self.run_once()
+                backoff = self.interval
+            except Exception as e:
+                print(f"Refund execution failed: {e}")
+                handled = 0
+                backoff = min(backoff * 2, 30.0)
+            if not handled:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), backoff)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self) -> int:
+        """Submit one batch; returns the number of refunds handled"""
+        # One session for the batch: its row locks are held until the outcomes commit
+        db = self.session_factory()
+        try:
+            submissions = await run_in_threadpool(self._claim, db)
+            if not submissions:
+                return 0
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+            results = await asyncio.gather(*(self._submit(submission, semaphore) for submission in submissions))
+            await run_in_threadpool(self._record, db, submissions, results)
+            return len(submissions)
+        finally:
+            # Rolls back anything uncommitted, releasing the batch
+            await run_in_threadpool(db.close)
+
+    # ---- Gateway calls ----
+
+    def _limiter(self, provider: str) -> RateLimiter:
+        if provider not in self.limiters:
+            self.limiters[provider] = RateLimiter(REFUND_RATE_LIMITS.get(provider, self.rate_limit))
+        return self.limiters[provider]
+
+    async def _submit(self, submission: Submission, semaphore: asyncio.Semaphore):
+        """Refund one charge; returns the gateway's result, the exception it raised or OUTCOME_UNRESOLVED"""
+        try:
+            gateway = get_payment_gateway(submission.method)
+        except ValueError as e:
+            return {"refund_id": "", "status": "failed", "data": {"message": str(e)}}
+
+        # Paced before taking a slot, so a throttled provider never holds slots others could use
+        limiter = self._limiter(gateway.name)
+        await limiter.acquire()
+        async with semaphore:
+            try:
+                if submission.outcome_unknown:
+                    if not gateway.supports_refund_listing:
+                        return OUTCOME_UNRESOLVED
+                    existing = await self._find_existing(gateway, submission)
+                    if existing is not None:
+                        return existing
+                    await limiter.acquire()
+                return await gateway.refund_charge(
+                    submission.reference, submission.transaction_id, None if submission.full else submission.amount
+                )
+            except Exception as e:
+                print(f"Refund {submission.refund_id} submission failed: {e}")
+                return e
+
+    async def _find_existing(self, gateway: PaymentGateway, submission: Submission) -> Optional[dict]:
+        """The provider's refund from an earlier submission of this refund, if it went through"""
+        for refund in await gateway.list_refunds(submission.reference, submission.transaction_id):
+            if (
+                refund["status"] != "failed"
+                and refund["refund_id"] not in submission.known_refund_ids
+                and amount_matches(refund["amount"], submission.amount)
+            ):
+                # Shared by the payment's submissions, so no other one adopts it too
+                submission.known_refund_ids.add(refund["refund_id"])
+                self.counts["adopted"] += 1
+                return refund
+        return None
+
+    # ---- Database ----
+
+    def _claim(self, db: Session) -> List[Submission]:
+        now = datetime.utcnow()
+        rows = db.query(Refund, Payment).join(Payment, Refund.payment_id == Payment.id).filter(
+            Refund.status == RefundStatus.APPROVED,
+            or_(Refund.next_attempt_at.is_(None), Refund.next_attempt_at <= now)
+        ).order_by(Refund.id).limit(self.batch_size).with_for_update(skip_locked=True, of=Refund).all()
+
+        payment_ids = {payment.id for _, payment in rows}
+        known: Dict[int, Set[str]] = defaultdict(set)
+        for payment_id, gateway_refund_id in db.query(Refund.payment_id, Refund.gateway_refund_id).filter(
+            Refund.payment_id.in_(payment_ids),
+            Refund.gateway_refund_id.isnot(None)
+        ):
+            known[payment_id].add(gateway_refund_id)
+
+        return [
+            Submission(
+                id=refund.id,
+                refund_id=refund.refund_id,
+                method=payment.payment_method.value,
+                reference=payment.payment_id,
+                transaction_id=payment.gateway_transaction_id,
+                amount=refund.amount,
+                full=refund.amount >= payment.amount - AMOUNT_TOLERANCE,
+                outcome_unknown=refund.outcome_unknown,
+                known_refund_ids=known[payment.id]
+            )
+            for refund, payment in rows
+        ]
+
+    def _record(self, db: Session, submissions: List[Submission], results: list):
+        """Write the batch's outcomes and refund transactions in one transaction"""
+        now = datetime.utcnow()
+        transactions = []
+        completed = set()
+        for submission, result in zip(submissions, results):
+            refund = db.get(Refund, submission.id)  # Claimed by this session, so no query
+            if result is OUTCOME_UNRESOLVED:
+                refund.status = RefundStatus.PROCESSING
+                refund.last_error = (
+                    f"Outcome unknown ({refund.last_error}) and {submission.method} "
+                    "refunds cannot be listed; check with the provider"
+                )
+                print(f"Refund {refund.refund_id} left for review: {refund.last_error}")
+            elif isinstance(result, Exception):
+                refund.attempts += 1
+                refund.last_error = str(result) or type(result).__name__
+                refund.outcome_unknown = refund.outcome_unknown or not _not_sent(result)
+                if refund.attempts < REFUND_MAX_ATTEMPTS:
+                    refund.next_attempt_at = now + timedelta(seconds=REFUND_RETRY_BACKOFF * 2 ** (refund.attempts - 1))
+                    self.counts["retried"] += 1
+                    continue
+                if refund.outcome_unknown:
+                    # The money may have gone out; never record that as failed
+                    refund.status = RefundStatus.PROCESSING
+                    refund.last_error = f"Outcome unknown after {refund.attempts} attempts: {refund.last_error}"
+                    print(f"Refund {refund.refund_id} left for review: {refund.last_error}")
+                else:
+                    refund.status = RefundStatus.FAILED
+                    print(f"Refund {refund.refund_id} failed after {refund.attempts} attempts: {refund.last_error}")
+            else:
+                refund.outcome_unknown = False
+                refund.last_error = None
+                refund.gateway_refund_id = result["refund_id"] or None
+                refund.gateway_response = result["data"]
+                if result["status"] == "processed":
+                    refund.status = RefundStatus.COMPLETED
+                    completed.add(refund.payment_id)
+                elif result["status"] == "pending":
+                    refund.status = RefundStatus.PROCESSING
+                else:
+                    refund.status = RefundStatus.FAILED
+                    refund.last_error = result["data"].get("message") or "Refund declined by the gateway"
+
+            self.counts[refund.status.value] += 1
+            transactions.append({
+                "payment_id": refund.payment_id,
+                "transaction_type": "refund",
+                "amount": refund.amount,
+                "status": {
+                    RefundStatus.COMPLETED: PaymentStatus.REFUNDED,
+                    RefundStatus.PROCESSING: PaymentStatus.PROCESSING
+                }.get(refund.status, PaymentStatus.FAILED),
+                "gateway_transaction_id": refund.gateway_refund_id,
+                "gateway_response": refund.gateway_response,
+                "error_message": refund.last_error
+            })
+
+        if transactions:
+            db.execute(insert(Transaction), transactions)
+        if completed:
+            refund_covered_payments(db, completed)
+        db.commit()
+
+    def render_metrics(self) -> str:
+        name = "payment_refunds_total"
+        lines = [f"# HELP {name} Refund submissions by outcome", f"# TYPE {name} counter"]
+        for outcome, count in sorted(self.counts.items()):
+            lines.append(f'{name}{{outcome="{outcome}"}} {count}')
+        return "\n".join(lines) + "\n"
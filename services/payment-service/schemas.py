@@ -1,7 +1,7 @@
 from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
-from models import PaymentStatus, PaymentMethod, RefundStatus
+from models import InvoicePdfStatus, PaymentStatus, PaymentMethod, RefundStatus
 
 # Payment Schemas
 class PaymentCreate(BaseModel):
@@ -68,6 +68,8 @@ class RefundResponse(BaseModel):
     amount: float
     reason: Optional[str]
     status: RefundStatus
+    gateway_refund_id: Optional[str] = None
+    last_error: Optional[str] = None
     requested_by: int
     processed_by: Optional[int]
     requested_at: datetime
@@ -76,6 +78,17 @@ class RefundResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class RefundApproval(BaseModel):
+    refund_ids: List[str] = Field(..., min_length=1, max_length=1000)
+
+class RefundApprovalError(BaseModel):
+    refund_id: str
+    detail: str
+
+class RefundApprovalResponse(BaseModel):
+    approved: List[RefundResponse]
+    rejected: List[RefundApprovalError]
+
 # Invoice Schemas
 class InvoiceCreate(BaseModel):
     payment_id: int
@@ -106,6 +119,8 @@ class InvoiceResponse(BaseModel):
     billing_email: str
     is_paid: bool
     paid_at: Optional[datetime]
+    pdf_url: Optional[str] = None
+    pdf_status: InvoicePdfStatus
     created_at: datetime
     
     class Config:
@@ -116,6 +131,7 @@ class WalletResponse(BaseModel):
     id: int
     student_id: int
     balance: float
+    balance_minor: int
     currency: str
     is_active: bool
     created_at: datetime
@@ -129,6 +145,12 @@ class WalletTransactionCreate(BaseModel):
     description: Optional[str] = None
     reference: Optional[str] = None
 
+class WalletPostingCreate(WalletTransactionCreate):
+    student_id: int
+
+class WalletPostingBatch(BaseModel):
+    postings: List[WalletPostingCreate] = Field(..., min_length=1, max_length=1000)
+
 class WalletTransactionResponse(BaseModel):
     id: int
     wallet_id: int
@@ -136,6 +158,8 @@ class WalletTransactionResponse(BaseModel):
     amount: float
     balance_before: float
     balance_after: float
+    amount_minor: int
+    balance_after_minor: int
     description: Optional[str]
     reference: Optional[str]
     created_at: datetime
@@ -163,3 +187,6 @@ class PaymentVerifyResponse(BaseModel):
     amount: float
     paid_at: Optional[datetime]
     gateway_response: Optional[Dict[str, Any]]
+
+class WebhookAcknowledgement(BaseModel):
+    status: str  # accepted, duplicate or ignored
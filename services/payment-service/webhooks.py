@@ -0,0 +1,203 @@
+"""Provider webhook ingestion and the workers that apply it.
+
+POST /webhooks/{provider} only checks the signature and inserts a
+WebhookEvent row, so the provider gets its 200 without waiting on payment
+processing and no request worker blocks on a provider round trip.
+WebhookWorkerPool threads claim received rows with SKIP LOCKED and apply
+them through payment_state.apply_charge_outcome; the inbox's unique
+(provider, event_key) constraint drops redeliveries, and settled payments
+ignore late or repeated outcomes. A failing event is retried with
+exponential backoff up to WEBHOOK_MAX_ATTEMPTS and then left FAILED.
+"""
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from service_toolkit.events import BackgroundWorker
+from models import Payment, PaymentGatewayConfig, WebhookEvent, WebhookEventStatus
+from payment_gateways import PaymentGateway, get_payment_gateway
+from payment_state import amount_matches, apply_charge_outcome
+
+load_dotenv()
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "0.5"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BACKOFF = float(os.getenv("WEBHOOK_RETRY_BACKOFF", "5"))  # seconds, doubled per attempt
+WEBHOOK_SECRET_CACHE_TTL = float(os.getenv("WEBHOOK_SECRET_CACHE_TTL", "60"))
+
+
+class WebhookRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+# ==================== INGESTION ====================
+
+_secrets: Dict[str, Tuple[float, str]] = {}
+
+
+def get_webhook_secret(db: Session, gateway: PaymentGateway) -> str:
+    """Webhook secret from PaymentGatewayConfig, falling back to the gateway default"""
+    now = time.monotonic()
+    cached = _secrets.get(gateway.name)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    config = db.query(PaymentGatewayConfig).filter(
+        PaymentGatewayConfig.gateway_name == gateway.name,
+        PaymentGatewayConfig.is_active.is_(True)
+    ).first()
+    secret = (config.webhook_secret if config else None) or gateway.default_webhook_secret()
+    _secrets[gateway.name] = (now + WEBHOOK_SECRET_CACHE_TTL, secret)
+    return secret
+
+
+def ingest_webhook(session_factory, provider: str, body: bytes, headers: Mapping[str, str]) -> str:
+    """Verify and store one delivery; returns accepted, duplicate or ignored"""
+    try:
+        gateway = get_payment_gateway(provider)
+    except ValueError:
+        raise WebhookRejected(404, "Unknown payment provider")
+
+    db = session_factory()
+    try:
+        secret = get_webhook_secret(db, gateway)
+        signature = headers.get(gateway.signature_header, "")
+        if not secret or not signature or not gateway.webhook_signature_valid(body, signature, secret):
+            raise WebhookRejected(401, "Invalid webhook signature")
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise WebhookRejected(400, "Webhook body is not valid JSON")
+        if not isinstance(payload, dict):
+            raise WebhookRejected(400, "Webhook body must be a JSON object")
+
+        event = gateway.parse_webhook(payload)
+        if event is None:
+            return "ignored"
+
+        db.add(WebhookEvent(
+            provider=gateway.name,
+            event_key=event["event_key"],
+            event_type=event["event_type"],
+            reference=event["reference"],
+            payload=payload
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return "duplicate"
+        return "accepted"
+    finally:
+        db.close()
+
+
+# ==================== WORKERS ====================
+
+class WebhookProcessor(BackgroundWorker):
+    """Claims received webhook events in batches and applies them"""
+
+    idle_interval = WEBHOOK_POLL_INTERVAL
+
+    def __init__(self, session_factory, name: str = "webhook-processor", batch_size: int = WEBHOOK_BATCH_SIZE):
+        super().__init__(name)
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+
+    def run_once(self) -> int:
+        """Apply one batch; returns the number of events handled"""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            # SKIP LOCKED spreads events across the pool and across replicas
+            rows = db.query(WebhookEvent).filter(
+                WebhookEvent.status == WebhookEventStatus.RECEIVED,
+                or_(WebhookEvent.next_attempt_at.is_(None), WebhookEvent.next_attempt_at <= now)
+            ).order_by(WebhookEvent.id).limit(self.batch_size).with_for_update(skip_locked=True).all()
+
+            if not rows:
+                db.rollback()
+                return 0
+
+            for row in rows:
+                try:
+                    # A savepoint per event keeps one bad event from undoing the batch
+                    with db.begin_nested():
+                        status, note = self.apply(db, row)
+                    row.status = status
+                    row.last_error = note
+                    row.processed_at = now
+                except Exception as e:
+                    row.attempts += 1
+                    row.last_error = str(e)
+                    if row.attempts >= WEBHOOK_MAX_ATTEMPTS:
+                        row.status = WebhookEventStatus.FAILED
+                    else:
+                        row.next_attempt_at = now + timedelta(seconds=WEBHOOK_RETRY_BACKOFF * 2 ** (row.attempts - 1))
+                    print(f"Webhook event {row.provider}:{row.event_key} failed (attempt {row.attempts}): {e}")
+
+            db.commit()
+            return len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def apply(self, db: Session, row: WebhookEvent) -> Tuple[WebhookEventStatus, Optional[str]]:
+        """Apply one event to its payment; returns the event status and an optional note"""
+        gateway = get_payment_gateway(row.provider)
+        event = gateway.parse_webhook(row.payload)
+
+        payment = db.query(Payment).filter(
+            Payment.payment_id == event["reference"]
+        ).with_for_update().first()
+        if payment is None:
+            return WebhookEventStatus.IGNORED, "Unknown payment reference"
+
+        try:
+            payment_gateway = get_payment_gateway(payment.payment_method.value)
+        except ValueError:
+            payment_gateway = None
+        if payment_gateway is not gateway:
+            # Only the adapter that took the payment may settle it
+            return WebhookEventStatus.IGNORED, f"Payment was made with {payment.payment_method.value}"
+
+        if event["succeeded"] and not amount_matches(event["amount"], payment.amount):
+            # Never complete a payment for less than was charged; left for review
+            return WebhookEventStatus.FAILED, f"Paid amount {event['amount']} does not match {payment.amount}"
+
+        if not apply_charge_outcome(db, payment, event["succeeded"], event["data"]):
+            return WebhookEventStatus.IGNORED, f"Payment already {payment.status.value}"
+        return WebhookEventStatus.PROCESSED, None
+
+
+class WebhookWorkerPool:
+    """A fixed set of WebhookProcessor threads"""
+
+    def __init__(self, session_factory, workers: int = WEBHOOK_WORKERS, batch_size: int = WEBHOOK_BATCH_SIZE):
+        self.workers: List[WebhookProcessor] = [
+            WebhookProcessor(session_factory, f"webhook-processor-{i}", batch_size)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self, timeout: float = 5.0):
+        for worker in self.workers:
+            worker.stop(timeout)
@@ -1,42 +1,24 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Query
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
 import models
 import schemas
 from database import engine, get_db
-from auth_middleware import verify_token, verify_admin, verify_instructor
+from service_toolkit.app import add_lifecycle_hooks, create_app
+from service_toolkit.auth import token_verifier, verify_token, verify_admin, verify_instructor
+from service_toolkit.serialization import list_response
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(
+app = create_app(
     title="Execute Tech Academy - Product Service",
     description="Course and Instructor Management Service",
-    version="1.0.0"
+    service_name="Product Service"
 )
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.get("/")
-def read_root():
-    return {
-        "service": "Product Service",
-        "status": "running",
-        "version": "1.0.0"
-    }
-
-@app.get("/health")
-def health_check():
-    return {"status": "healthy"}
+add_lifecycle_hooks(app, stop=token_verifier.stop)
 
 # ==================== INSTRUCTOR ENDPOINTS ====================
 
@@ -72,7 +54,7 @@ def list_instructors(
     instructors = db.query(models.Instructor).filter(
         models.Instructor.is_active == True
     ).offset(skip).limit(limit).all()
-    return instructors
+    return list_response(schemas.InstructorResponse, instructors)
 
 @app.get("/instructors/{instructor_id}", response_model=schemas.InstructorResponse)
 def get_instructor(instructor_id: int, db: Session = Depends(get_db)):
@@ -165,7 +147,7 @@ def list_courses(
         query = query.filter(models.Course.is_featured == is_featured)
     
     courses = query.offset(skip).limit(limit).all()
-    return courses
+    return list_response(schemas.CourseListResponse, courses)
 
 @app.get("/courses/{course_id}", response_model=schemas.CourseResponse)
 def get_course(course_id: int, db: Session = Depends(get_db)):
@@ -1,7 +1,3 @@
-
-
-# Create models.py
-cat > models.py << 'EOF'
 from sqlalchemy import Column, Integer, String, Text, Float, Boolean, DateTime, ForeignKey, Enum, Table
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -0,0 +1,6 @@
+"""Code shared by the Python services.
+
+Each service image copies this package next to its own modules (see the
+service Dockerfiles), so it is imported as ``service_toolkit``. For local
+runs outside Docker, put ``services/shared`` on PYTHONPATH.
+"""
@@ -0,0 +1,139 @@
+"""FastAPI application factory.
+
+create_app sets up what every service used to repeat in main.py: CORS,
+the ``/`` and ``/health`` routes, request metrics on ``/metrics``, orjson
+rendering, and a lifespan that runs the service's background workers.
+Services can add their own series to ``/metrics`` with
+add_metrics_collector.
+
+Workers are registered with add_lifecycle_hooks. They start in
+registration order; if one fails to start, the ones already running are
+stopped before the error propagates. On shutdown they stop in reverse
+order, each bounded by SHUTDOWN_HOOK_TIMEOUT, and a failing stop hook is
+logged without skipping the rest. Blocking stop hooks (thread joins,
+process pool shutdown) run in the threadpool so they do not stall the
+event loop.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+from service_toolkit.metrics import MetricsMiddleware, RequestMetrics
+from service_toolkit.responses import DefaultJSONResponse
+
+load_dotenv()
+
+SHUTDOWN_HOOK_TIMEOUT = float(os.getenv("SHUTDOWN_HOOK_TIMEOUT", "10"))
+
+Hook = Callable[[], object]
+
+
+async def _run_hook(hook: Hook, timeout: Optional[float] = None):
+    if asyncio.iscoroutinefunction(hook):
+        call = hook()
+    else:
+        call = run_in_threadpool(hook)
+    return await asyncio.wait_for(call, timeout)
+
+
+class ServiceLifecycle:
+    def __init__(self, stop_timeout: float = SHUTDOWN_HOOK_TIMEOUT):
+        self.stop_timeout = stop_timeout
+        self._hooks: List[Tuple[Optional[Hook], Optional[Hook]]] = []
+        self._running: List[Hook] = []
+
+    def add(self, start: Optional[Hook] = None, stop: Optional[Hook] = None):
+        self._hooks.append((start, stop))
+
+    async def startup(self):
+        for start, stop in self._hooks:
+            if start:
+                try:
+                    await _run_hook(start)
+                except Exception:
+                    await self.shutdown()
+                    raise
+            if stop:
+                self._running.append(stop)
+
+    async def shutdown(self):
+        while self._running:
+            stop = self._running.pop()
+            try:
+                await _run_hook(stop, self.stop_timeout)
+            except asyncio.TimeoutError:
+                print(f"Shutdown hook {getattr(stop, '__qualname__', stop)} timed out after {self.stop_timeout}s")
+            except Exception as e:
+                print(f"Shutdown hook {getattr(stop, '__qualname__', stop)} failed: {e}")
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    lifecycle: ServiceLifecycle = app.state.lifecycle
+    await lifecycle.startup()
+    try:
+        yield
+    finally:
+        await lifecycle.shutdown()
+
+
+def create_app(title: str, description: str, service_name: str, version: str = "1.0.0") -> FastAPI:
+    app = FastAPI(
+        title=title,
+        description=description,
+        version=version,
+        default_response_class=DefaultJSONResponse,
+        lifespan=_lifespan
+    )
+    app.state.lifecycle = ServiceLifecycle()
+    app.state.metrics = RequestMetrics()
+    app.state.metrics_collectors = []
+
+    # CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Configure properly in production
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(MetricsMiddleware, metrics=app.state.metrics)
+
+    @app.get("/")
+    def read_root():
+        return {
+            "service": service_name,
+            "status": "running",
+            "version": version
+        }
+
+    @app.get("/health")
+    def health_check():
+        return {"status": "healthy"}
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    def metrics():
+        return "".join([app.state.metrics.render()] + [collect() for collect in app.state.metrics_collectors])
+
+    return app
+
+
+def add_lifecycle_hooks(app: FastAPI, start: Optional[Hook] = None, stop: Optional[Hook] = None):
+    """Run start when the app starts and stop when it shuts down.
+
+    Use this instead of @app.on_event: FastAPI ignores on_event handlers
+    once an app has a lifespan.
+    """
+    app.state.lifecycle.add(start, stop)
+
+
+def add_metrics_collector(app: FastAPI, collect: Callable[[], str]):
+    """Append collect()'s Prometheus text to the /metrics output"""
+    app.state.metrics_collectors.append(collect)
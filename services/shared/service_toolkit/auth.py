@@ -0,0 +1,324 @@
+"""Access token verification for services that trust auth-service tokens.
+
+Tokens are RS256-signed by auth-service and checked locally against its
+published JWKS. Revocation is checked against a bloom filter of revoked
+token ids pulled from auth-service, with an exact check only on a filter
+hit. Both caches refresh in the background over one keep-alive HTTP
+client each.
+
+The RSA signature check is the most expensive step of an authenticated
+request, and clients send the same token for up to its whole lifetime, so
+TokenVerifier remembers tokens it has already verified. Revocation is
+still checked on every request.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Depends, Header, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwk, jwt
+from jose.exceptions import JWKError
+import httpx
+
+load_dotenv()
+
+AUTH_JWKS_URL = os.getenv("AUTH_JWKS_URL", "http://auth-service:8001/.well-known/jwks.json")
+JWKS_REFRESH_INTERVAL = int(os.getenv("JWKS_REFRESH_INTERVAL", "300"))
+AUTH_REVOCATIONS_URL = os.getenv("AUTH_REVOCATIONS_URL", "http://auth-service:8001/revocations")
+REVOCATION_REFRESH_INTERVAL = float(os.getenv("REVOCATION_REFRESH_INTERVAL", "5"))
+VERIFIED_TOKEN_TTL = float(os.getenv("VERIFIED_TOKEN_TTL", "60"))
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "10000"))
+ALGORITHM = "RS256"
+# Shared by the services for service-to-service calls; unset disables them
+SERVICE_API_TOKEN = os.getenv("SERVICE_API_TOKEN", "")
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+def _http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(timeout=5.0, limits=httpx.Limits(max_connections=10, max_keepalive_connections=2))
+
+
+class JWKSKeyCache:
+    """Auth-service public keys, held in memory and refreshed in the background.
+
+    Tokens are verified locally; an unknown kid (a freshly rotated key)
+    triggers at most one extra fetch per min_refresh_interval.
+    """
+
+    def __init__(self, jwks_url: str = AUTH_JWKS_URL, refresh_interval: int = JWKS_REFRESH_INTERVAL, algorithm: str = ALGORITHM, min_refresh_interval: int = 10):
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh_interval
+        self.algorithm = algorithm
+        self.min_refresh_interval = min_refresh_interval
+        self._keys: Dict[str, jwk.Key] = {}
+        self._last_fetch = 0.0
+        self._lock = asyncio.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._refresher: Optional[asyncio.Task] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = _http_client()
+        return self._client
+
+    async def refresh(self):
+        self._last_fetch = time.monotonic()
+        response = await self._get_client().get(self.jwks_url)
+        response.raise_for_status()
+
+        keys = {}
+        for key_data in response.json().get("keys", []):
+            try:
+                keys[key_data["kid"]] = jwk.construct(key_data, key_data.get("alg", self.algorithm))
+            except (KeyError, JWKError):
+                continue
+        self._keys = keys
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except (httpx.HTTPError, ValueError) as e:
+                print(f"JWKS refresh failed: {e}")
+
+    async def get_key(self, kid: Optional[str]) -> Optional[jwk.Key]:
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._last_fetch >= self.min_refresh_interval:
+            async with self._lock:
+                if kid not in self._keys and time.monotonic() - self._last_fetch >= self.min_refresh_interval:
+                    try:
+                        await self.refresh()
+                    except (httpx.HTTPError, ValueError) as e:
+                        print(f"JWKS fetch failed: {e}")
+            key = self._keys.get(kid)
+        return key
+
+    async def stop(self):
+        if self._refresher:
+            self._refresher.cancel()
+            self._refresher = None
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+
+class RevocationFilter:
+    """Read-only copy of auth-service's bloom filter of revoked token ids"""
+
+    def __init__(self, snapshot: dict):
+        self.version = snapshot["version"]
+        self.size_bits = snapshot["size_bits"]
+        self.hash_count = snapshot["hash_count"]
+        self.bits = base64.b64decode(snapshot["filter"])
+
+    def __contains__(self, jti: str) -> bool:
+        digest = hashlib.sha256(jti.encode()).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        for i in range(self.hash_count):
+            position = (h1 + i * h2) % self.size_bits
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RevocationCache:
+    """Revoked token filter pulled from auth-service and swapped in the background.
+
+    A jti that misses the filter is accepted without a network call; a hit
+    is confirmed with auth-service and the answer cached for result_ttl.
+    """
+
+    def __init__(self, revocations_url: str = AUTH_REVOCATIONS_URL, refresh_interval: float = REVOCATION_REFRESH_INTERVAL, result_ttl: float = 30.0, max_results: int = 10000):
+        self.revocations_url = revocations_url
+        self.refresh_interval = refresh_interval
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self._filter: Optional[RevocationFilter] = None
+        self._results: Dict[str, tuple] = {}
+        self._last_attempt = 0.0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._refresher: Optional[asyncio.Task] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = _http_client()
+        return self._client
+
+    async def refresh(self):
+        self._last_attempt = time.monotonic()
+        headers = {}
+        if self._filter is not None:
+            headers["If-None-Match"] = f'"{self._filter.version}"'
+        response = await self._get_client().get(f"{self.revocations_url}/bloom", headers=headers)
+        if response.status_code == 304:
+            return
+        response.raise_for_status()
+        self._filter = RevocationFilter(response.json())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                print(f"Revocation filter refresh failed: {e}")
+
+    async def is_revoked(self, jti: Optional[str]) -> bool:
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+        if self._filter is None and time.monotonic() - self._last_attempt >= self.refresh_interval:
+            try:
+                await self.refresh()
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                print(f"Revocation filter fetch failed: {e}")
+
+        # Without a filter yet revocation cannot be checked; tokens still expire
+        if not jti or self._filter is None or jti not in self._filter:
+            return False
+
+        cached = self._results.get(jti)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        try:
+            response = await self._get_client().get(f"{self.revocations_url}/{jti}")
+            response.raise_for_status()
+            revoked = bool(response.json()["revoked"])
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            # Fail closed: a filter hit is almost always a real revocation
+            print(f"Revocation check failed: {e}")
+            return True
+
+        if len(self._results) >= self.max_results:
+            self._results.clear()
+        self._results[jti] = (time.monotonic() + self.result_ttl, revoked)
+        return revoked
+
+    async def stop(self):
+        if self._refresher:
+            self._refresher.cancel()
+            self._refresher = None
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+
+class TokenVerifier:
+    """Verifies access tokens and remembers the ones that passed.
+
+    A verified token is trusted for at most claims_ttl seconds (and never
+    past its own exp) before its signature is checked again, which bounds
+    how long a token signed by a key that was withdrawn from the JWKS keeps
+    working.
+    """
+
+    def __init__(
+        self,
+        key_cache: Optional[JWKSKeyCache] = None,
+        revocation_cache: Optional[RevocationCache] = None,
+        algorithm: str = ALGORITHM,
+        claims_ttl: float = VERIFIED_TOKEN_TTL,
+        max_cached: int = VERIFIED_TOKEN_CACHE_SIZE
+    ):
+        self.key_cache = key_cache or JWKSKeyCache(algorithm=algorithm)
+        self.revocation_cache = revocation_cache or RevocationCache()
+        self.algorithm = algorithm
+        self.claims_ttl = claims_ttl
+        self.max_cached = max_cached
+        self._verified: Dict[str, Tuple[float, dict, Optional[str]]] = {}
+
+    @staticmethod
+    def credentials_exception() -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    async def _decode(self, token: str) -> Tuple[dict, Optional[str], float]:
+        """Check the signature; returns (principal, jti, seconds until exp)"""
+        try:
+            key = await self.key_cache.get_key(jwt.get_unverified_header(token).get("kid"))
+            if key is None:
+                raise self.credentials_exception()
+            payload = jwt.decode(token, key, algorithms=[self.algorithm])
+        except JWTError:
+            raise self.credentials_exception()
+
+        user_id = payload.get("sub")
+        if user_id is None:
+            raise self.credentials_exception()
+        try:
+            principal = {"user_id": int(user_id), "role": payload.get("role")}
+        except (TypeError, ValueError):
+            raise self.credentials_exception()
+        expires_in = float(payload["exp"]) - time.time() if "exp" in payload else self.claims_ttl
+        return principal, payload.get("jti"), expires_in
+
+    async def verify(self, token: str) -> dict:
+        """Principal ({"user_id", "role"}) of a valid, unrevoked token, else 401"""
+        now = time.monotonic()
+        cached = self._verified.get(token)
+        if cached and cached[0] > now:
+            _, principal, jti = cached
+        else:
+            principal, jti, expires_in = await self._decode(token)
+            if len(self._verified) >= self.max_cached:
+                self._verified.clear()
+            self._verified[token] = (now + min(self.claims_ttl, expires_in), principal, jti)
+
+        if await self.revocation_cache.is_revoked(jti):
+            self._verified.pop(token, None)
+            raise self.credentials_exception()
+        return dict(principal)
+
+    async def stop(self):
+        await self.key_cache.stop()
+        await self.revocation_cache.stop()
+
+
+token_verifier = TokenVerifier()
+
+
+async def verify_token(token: str = Depends(oauth2_scheme)):
+    return await token_verifier.verify(token)
+
+
+async def verify_admin(current_user: dict = Depends(verify_token)):
+    if current_user["role"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    return current_user
+
+
+async def verify_instructor(current_user: dict = Depends(verify_token)):
+    if current_user["role"] not in ["admin", "instructor"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    return current_user
+
+
+async def verify_service(x_service_token: Optional[str] = Header(None)):
+    """Service-to-service calls authenticate with the shared SERVICE_API_TOKEN"""
+    if not SERVICE_API_TOKEN or not x_service_token or not hmac.compare_digest(
+        x_service_token.encode(), SERVICE_API_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid service credentials"
+        )
@@ -0,0 +1,55 @@
+"""SQLAlchemy engine and session setup.
+
+Every service gets the same bounded connection pool. pool_pre_ping swaps
+out connections that Postgres or a proxy closed while they sat idle, so
+the first request after a database restart does not fail, and
+pool_recycle retires connections before server-side idle limits hit them.
+"""
+import os
+from typing import Callable, Iterator
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+load_dotenv()
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+def create_pooled_engine(database_url: str, **overrides) -> Engine:
+    """Engine with the shared pool settings; keyword arguments override them"""
+    if database_url.startswith("sqlite"):
+        # Local runs and tests: SQLite ignores pool sizing
+        return create_engine(database_url, connect_args={"check_same_thread": False}, **overrides)
+
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True
+    }
+    options.update(overrides)
+    return create_engine(database_url, **options)
+
+
+def create_session_factory(engine: Engine) -> sessionmaker:
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def session_dependency(session_factory: sessionmaker) -> Callable[[], Iterator[Session]]:
+    """FastAPI dependency yielding a session that is closed after the request"""
+
+    def get_db() -> Iterator[Session]:
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    return get_db
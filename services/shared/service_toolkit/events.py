@@ -0,0 +1,452 @@
+"""Transactional outbox, outbox relay and stream consumers.
+
+Domain changes write an ``OutboxEvent`` row in the same session (and
+therefore the same commit) as the change itself. ``OutboxRelay`` drains
+unpublished rows in batches to a stream bus, and ``EventConsumer`` reads
+them back through a consumer group. Delivery is at-least-once: handlers
+are recorded in ``ProcessedEvent`` in the same transaction as their side
+effects, so a redelivered event is acknowledged without running twice.
+An entry that still fails after EVENT_MAX_DELIVERIES deliveries is moved
+to ``<stream>.dead`` with its error and acknowledged, so one poison
+message is not reclaimed forever.
+
+The two tables are defined here rather than in each service's models, on
+their own metadata; create_event_tables creates them in a service's
+database next to its own tables.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import Column, DateTime, Integer, JSON, String, UniqueConstraint
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.sql import func
+
+load_dotenv()
+
+EVENT_BUS_BACKEND = os.getenv("EVENT_BUS_BACKEND", "redis")
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+EVENT_STREAM_MAXLEN = int(os.getenv("EVENT_STREAM_MAXLEN", "100000"))
+EVENT_MAX_DELIVERIES = int(os.getenv("EVENT_MAX_DELIVERIES", "5"))
+DEAD_LETTER_SUFFIX = ".dead"
+
+StreamEntry = Tuple[str, Dict[str, str]]
+DeadLetter = Tuple[str, Dict[str, str], str]  # message id, fields, error
+EventHandler = Callable[[Session, dict], None]
+
+Base = declarative_base()
+
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(String, unique=True, nullable=False, index=True)
+    aggregate_type = Column(String, nullable=False)
+    aggregate_id = Column(String, nullable=False, index=True)
+    event_type = Column(String, nullable=False)
+    payload = Column(JSON)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    published_at = Column(DateTime(timezone=True), index=True)  # NULL until relayed
+
+
+class ProcessedEvent(Base):
+    __tablename__ = "processed_events"
+    __table_args__ = (UniqueConstraint("event_id", "consumer_group", name="uq_processed_events_event_group"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(String, nullable=False)
+    consumer_group = Column(String, nullable=False)
+    processed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+def create_event_tables(engine: Engine):
+    Base.metadata.create_all(bind=engine)
+
+
+def add_event(
+    db: Session,
+    event_type: str,
+    aggregate_type: str,
+    aggregate_id,
+    payload: dict
+) -> OutboxEvent:
+    """Stage an event in the outbox; it is published once the caller commits"""
+    event = OutboxEvent(
+        event_id=uuid.uuid4().hex,
+        aggregate_type=aggregate_type,
+        aggregate_id=str(aggregate_id),
+        event_type=event_type,
+        payload=payload
+    )
+    db.add(event)
+    return event
+
+
+def decode_event(fields: Dict[str, str]) -> dict:
+    """Turn flat stream fields back into an event dict"""
+    return {
+        "event_id": fields["event_id"],
+        "event_type": fields["event_type"],
+        "aggregate_type": fields.get("aggregate_type"),
+        "aggregate_id": fields.get("aggregate_id"),
+        "occurred_at": fields.get("occurred_at"),
+        "payload": json.loads(fields.get("payload") or "{}")
+    }
+
+
+def encode_event(event: OutboxEvent) -> Dict[str, str]:
+    """Flatten an outbox row into stream fields"""
+    occurred_at = event.created_at or datetime.utcnow()
+    return {
+        "event_id": event.event_id,
+        "event_type": event.event_type,
+        "aggregate_type": event.aggregate_type,
+        "aggregate_id": event.aggregate_id,
+        "occurred_at": occurred_at.isoformat(),
+        "payload": json.dumps(event.payload or {}, default=str)
+    }
+
+
+# ==================== STREAM BUSES ====================
+
+class RedisStreamBus:
+    """Redis Streams backed event bus"""
+
+    def __init__(self, host: str = REDIS_HOST, port: int = REDIS_PORT, maxlen: int = EVENT_STREAM_MAXLEN):
+        import redis
+
+        self.redis_client = redis.Redis(host=host, port=port, decode_responses=True)
+        self.maxlen = maxlen
+
+    def publish_batch(self, stream: str, messages: List[Dict[str, str]]) -> List[str]:
+        pipe = self.redis_client.pipeline(transaction=False)
+        for fields in messages:
+            pipe.xadd(stream, fields, maxlen=self.maxlen, approximate=True)
+        return pipe.execute()
+
+    def ensure_group(self, stream: str, group: str):
+        import redis
+
+        try:
+            self.redis_client.xgroup_create(stream, group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def read_group(self, stream: str, group: str, consumer: str, count: int, block_ms: int) -> List[StreamEntry]:
+        response = self.redis_client.xreadgroup(group, consumer, {stream: ">"}, count=count, block=block_ms)
+        if not response:
+            return []
+        return [(msg_id, fields) for msg_id, fields in response[0][1]]
+
+    def claim_stale(self, stream: str, group: str, consumer: str, min_idle_ms: int, count: int) -> List[StreamEntry]:
+        response = self.redis_client.xautoclaim(stream, group, consumer, min_idle_ms, start_id="0-0", count=count)
+        return [(msg_id, fields) for msg_id, fields in response[1] if fields]
+
+    def ack(self, stream: str, group: str, message_ids: List[str]):
+        if message_ids:
+            self.redis_client.xack(stream, group, *message_ids)
+
+    def delivery_counts(self, stream: str, group: str, message_ids: List[str]) -> Dict[str, int]:
+        """times_delivered from XPENDING for each still-pending entry"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for msg_id in message_ids:
+            pipe.xpending_range(stream, group, min=msg_id, max=msg_id, count=1)
+        return {
+            pending[0]["message_id"]: pending[0]["times_delivered"]
+            for pending in pipe.execute() if pending
+        }
+
+    def dead_letter(self, stream: str, group: str, entries: List[DeadLetter]):
+        """Copy entries to <stream>.dead and ack them in one transaction"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        for msg_id, fields, error in entries:
+            pipe.xadd(stream + DEAD_LETTER_SUFFIX, {**fields, "dead_letter_id": msg_id, "error": error}, maxlen=self.maxlen, approximate=True)
+        pipe.xack(stream, group, *[msg_id for msg_id, _, _ in entries])
+        pipe.execute()
+
+
+class InMemoryStreamBus:
+    """In-process stand-in for Redis Streams with the same consumer group semantics.
+
+    Used by tests and single-process local runs; nothing survives a restart.
+    """
+
+    def __init__(self):
+        self._streams: Dict[str, List[StreamEntry]] = {}
+        self._groups: Dict[Tuple[str, str], dict] = {}
+        self._sequence = 0
+        self._condition = threading.Condition()
+
+    def publish_batch(self, stream: str, messages: List[Dict[str, str]]) -> List[str]:
+        with self._condition:
+            entries = self._streams.setdefault(stream, [])
+            ids = []
+            for fields in messages:
+                self._sequence += 1
+                msg_id = f"{int(time.time() * 1000)}-{self._sequence}"
+                entries.append((msg_id, dict(fields)))
+                ids.append(msg_id)
+            self._condition.notify_all()
+            return ids
+
+    def ensure_group(self, stream: str, group: str):
+        with self._condition:
+            self._streams.setdefault(stream, [])
+            self._groups.setdefault((stream, group), {"next_index": 0, "pending": {}})
+
+    def read_group(self, stream: str, group: str, consumer: str, count: int, block_ms: int) -> List[StreamEntry]:
+        deadline = time.monotonic() + block_ms / 1000.0
+        with self._condition:
+            state = self._groups[(stream, group)]
+            entries = self._streams[stream]
+            while state["next_index"] >= len(entries):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+            batch = entries[state["next_index"]:state["next_index"] + count]
+            state["next_index"] += len(batch)
+            now = time.monotonic()
+            for msg_id, _ in batch:
+                state["pending"][msg_id] = (consumer, now, 1)
+            return [(msg_id, dict(fields)) for msg_id, fields in batch]
+
+    def claim_stale(self, stream: str, group: str, consumer: str, min_idle_ms: int, count: int) -> List[StreamEntry]:
+        with self._condition:
+            state = self._groups[(stream, group)]
+            by_id = dict(self._streams[stream])
+            now = time.monotonic()
+            claimed = []
+            for msg_id, (_, delivered_at, deliveries) in list(state["pending"].items()):
+                if len(claimed) >= count:
+                    break
+                if (now - delivered_at) * 1000 >= min_idle_ms:
+                    state["pending"][msg_id] = (consumer, now, deliveries + 1)
+                    claimed.append((msg_id, dict(by_id[msg_id])))
+            return claimed
+
+    def ack(self, stream: str, group: str, message_ids: List[str]):
+        with self._condition:
+            pending = self._groups[(stream, group)]["pending"]
+            for msg_id in message_ids:
+                pending.pop(msg_id, None)
+
+    def delivery_counts(self, stream: str, group: str, message_ids: List[str]) -> Dict[str, int]:
+        with self._condition:
+            pending = self._groups[(stream, group)]["pending"]
+            return {msg_id: pending[msg_id][2] for msg_id in message_ids if msg_id in pending}
+
+    def dead_letter(self, stream: str, group: str, entries: List[DeadLetter]):
+        self.publish_batch(
+            stream + DEAD_LETTER_SUFFIX,
+            [{**fields, "dead_letter_id": msg_id, "error": error} for msg_id, fields, error in entries]
+        )
+        self.ack(stream, group, [msg_id for msg_id, _, _ in entries])
+
+    def pending_count(self, stream: str, group: str) -> int:
+        with self._condition:
+            return len(self._groups[(stream, group)]["pending"])
+
+
+_event_bus = None
+
+
+def get_event_bus():
+    """Process-wide event bus selected by EVENT_BUS_BACKEND"""
+    global _event_bus
+    if _event_bus is None:
+        if EVENT_BUS_BACKEND == "memory":
+            _event_bus = InMemoryStreamBus()
+        else:
+            _event_bus = RedisStreamBus()
+    return _event_bus
+
+
+# ==================== WORKERS ====================
+
+class BackgroundWorker:
+    """Daemon thread that calls run_once until stopped"""
+
+    idle_interval = 0.5
+
+    def __init__(self, name: str):
+        self.name = name
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> int:
+        raise NotImplementedError
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        backoff = self.idle_interval
+        while not self._stop.is_set():
+            try:
+                handled = self.run_once()
+                backoff = self.idle_interval
+            except Exception as e:
+                print(f"{self.name} failed: {e}")
+                handled = 0
+                backoff = min(backoff * 2, 30.0)
+            if not handled:
+                self._stop.wait(backoff)
+
+
+class OutboxRelay(BackgroundWorker):
+    """Publishes committed outbox rows to a stream in batches"""
+
+    def __init__(self, session_factory, bus, stream: str, batch_size: int = 100):
+        super().__init__(f"outbox-relay:{stream}")
+        self.session_factory = session_factory
+        self.bus = bus
+        self.stream = stream
+        self.batch_size = batch_size
+
+    def run_once(self) -> int:
+        """Publish one batch; returns the number of events relayed"""
+        db = self.session_factory()
+        try:
+            # SKIP LOCKED lets several replicas relay concurrently without
+            # publishing the same rows twice in the common case.
+            events = db.query(OutboxEvent).filter(
+                OutboxEvent.published_at.is_(None)
+            ).order_by(OutboxEvent.id).limit(self.batch_size).with_for_update(skip_locked=True).all()
+
+            if not events:
+                db.rollback()
+                return 0
+
+            # Publish before marking: a crash in between republishes the
+            # batch, which consumers absorb through ProcessedEvent.
+            self.bus.publish_batch(self.stream, [encode_event(event) for event in events])
+
+            db.query(OutboxEvent).filter(
+                OutboxEvent.id.in_([event.id for event in events])
+            ).update({OutboxEvent.published_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            return len(events)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+class EventConsumer(BackgroundWorker):
+    """Consumer group reader dispatching events to idempotent handlers"""
+
+    def __init__(
+        self,
+        session_factory,
+        bus,
+        stream: str,
+        group: str,
+        handlers: Dict[str, EventHandler],
+        consumer_name: Optional[str] = None,
+        batch_size: int = 50,
+        block_ms: int = 1000,
+        claim_idle_ms: int = 30000,
+        max_deliveries: int = EVENT_MAX_DELIVERIES
+    ):
+        super().__init__(f"event-consumer:{stream}:{group}")
+        self.session_factory = session_factory
+        self.bus = bus
+        self.stream = stream
+        self.group = group
+        self.handlers = handlers
+        self.consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self._group_ready = False
+
+    def run_once(self) -> int:
+        """Handle redelivered and new entries; returns the number acknowledged"""
+        if not self._group_ready:
+            self.bus.ensure_group(self.stream, self.group)
+            self._group_ready = True
+
+        # Entries delivered to a consumer that died before acking are
+        # reclaimed once idle, giving at-least-once delivery.
+        entries = self.bus.claim_stale(
+            self.stream, self.group, self.consumer_name, self.claim_idle_ms, self.batch_size
+        )
+        if not entries:
+            entries = self.bus.read_group(
+                self.stream, self.group, self.consumer_name, self.batch_size, self.block_ms
+            )
+
+        acked = []
+        failed = []
+        for msg_id, fields in entries:
+            try:
+                self.handle(decode_event(fields))
+            except Exception as e:
+                failed.append((msg_id, fields, e))
+                continue
+            acked.append(msg_id)
+
+        self.bus.ack(self.stream, self.group, acked)
+        return len(acked) + (self._dead_letter_exhausted(failed) if failed else 0)
+
+    def _dead_letter_exhausted(self, failed: List[Tuple[str, Dict[str, str], Exception]]) -> int:
+        """Dead-letter entries out of deliveries; returns how many were moved"""
+        deliveries = self.bus.delivery_counts(self.stream, self.group, [msg_id for msg_id, _, _ in failed])
+        dead = []
+        for msg_id, fields, error in failed:
+            attempts = deliveries.get(msg_id, 0)
+            if attempts >= self.max_deliveries:
+                print(f"Dead-lettering event {msg_id} from {self.stream} after {attempts} deliveries: {error}")
+                dead.append((msg_id, fields, str(error)))
+            else:
+                # Left pending; claimed again after claim_idle_ms
+                print(f"Failed to handle event {msg_id} from {self.stream} (delivery {attempts}): {error}")
+        if dead:
+            self.bus.dead_letter(self.stream, self.group, dead)
+        return len(dead)
+
+    def handle(self, event: dict) -> bool:
+        """Apply one event exactly once; returns False for duplicates"""
+        db = self.session_factory()
+        try:
+            db.add(ProcessedEvent(event_id=event["event_id"], consumer_group=self.group))
+            try:
+                db.flush()
+            except IntegrityError:
+                db.rollback()
+                return False
+
+            handler = self.handlers.get(event["event_type"])
+            if handler:
+                handler(db, event)
+
+            db.commit()
+            return True
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
@@ -0,0 +1,437 @@
+"""Idempotency-Key support for create endpoints.
+
+IdempotencyMiddleware covers the (method, path) pairs it is given. A
+request carrying an Idempotency-Key header is keyed by the caller (user id
+from the bearer token), the route and the key:
+
+- the first request runs and its response is stored for IDEMPOTENCY_TTL;
+- a retry with the same key and body gets the stored response back, marked
+  Idempotent-Replayed: true, without running the endpoint (or calling a
+  payment gateway) again;
+- a duplicate that arrives while the first is still running waits for it
+  (single-flight) rather than running alongside it, and gets 409 if that
+  takes longer than IDEMPOTENCY_WAIT_TIMEOUT;
+- reusing a key with a different body is a 422.
+
+5xx responses and exceptions are not stored, so the client can retry
+with the same key. An in-progress claim lapses after IDEMPOTENCY_LOCK_TTL
+in case the replica running it dies. Requests without the header, or
+whose token does not verify, pass straight through.
+
+IDEMPOTENCY_BACKEND picks the store: redis (shared by replicas, the
+default), database (an idempotency_keys table in the service database)
+or memory (single-process local runs). If the store is unreachable,
+requests run without idempotency rather than failing.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Column, DateTime, Integer, JSON, LargeBinary, MetaData, String, Table, delete, insert, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from starlette.datastructures import Headers
+from starlette.middleware import Middleware
+from starlette.routing import Match
+
+from service_toolkit.app import add_lifecycle_hooks
+from service_toolkit.auth import TokenVerifier, token_verifier
+
+load_dotenv()
+
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "redis")
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))  # how long responses are replayed
+IDEMPOTENCY_LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_TTL", "60"))  # longest a request may run
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+# A stored record: {"state", "fingerprint"} plus "status", "headers" and
+# "body" once completed
+Record = dict
+
+
+# ==================== STORES ====================
+
+class RedisIdempotencyStore:
+    """Records shared by all replicas; a claim is SET NX with the lock TTL"""
+
+    def __init__(self, host: str = REDIS_HOST, port: int = REDIS_PORT, prefix: str = "idempotency:"):
+        import redis.asyncio as aioredis
+
+        self.redis_client = aioredis.Redis(host=host, port=port)
+        self.prefix = prefix
+
+    async def claim(self, key: str, fingerprint: str) -> Optional[Record]:
+        """None if the caller now owns key, else the existing record"""
+        name = self.prefix + key
+        pending = json.dumps({"state": IN_PROGRESS, "fingerprint": fingerprint})
+        if await self.redis_client.set(name, pending, nx=True, ex=IDEMPOTENCY_LOCK_TTL):
+            return None
+        value = await self.redis_client.get(name)
+        if value is None:
+            # Lapsed between the two calls; report in progress so the caller claims again
+            return {"state": IN_PROGRESS, "fingerprint": fingerprint}
+        record = json.loads(value)
+        if "body" in record:
+            record["body"] = base64.b64decode(record["body"])
+        return record
+
+    async def complete(self, key: str, record: Record):
+        stored = dict(record, body=base64.b64encode(record["body"]).decode())
+        await self.redis_client.set(self.prefix + key, json.dumps(stored), ex=IDEMPOTENCY_TTL)
+
+    async def release(self, key: str):
+        await self.redis_client.delete(self.prefix + key)
+
+    async def close(self):
+        await self.redis_client.close()
+
+
+metadata = MetaData()
+
+idempotency_keys = Table(
+    "idempotency_keys",
+    metadata,
+    Column("key", String, primary_key=True),
+    Column("fingerprint", String, nullable=False),
+    Column("state", String, nullable=False),
+    Column("response_status", Integer),
+    Column("response_headers", JSON),
+    Column("response_body", LargeBinary),
+    Column("locked_until", DateTime, nullable=False),
+    Column("expires_at", DateTime, nullable=False, index=True)
+)
+
+
+class DatabaseIdempotencyStore:
+    """Records in the service's own database, for deployments without Redis"""
+
+    purge_interval = 300.0
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        metadata.create_all(bind=engine)
+        self._last_purge = 0.0
+
+    def _claim(self, key: str, fingerprint: str) -> Optional[Record]:
+        now = datetime.utcnow()
+        claim = {
+            "fingerprint": fingerprint,
+            "state": IN_PROGRESS,
+            "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_TTL),
+            "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL)
+        }
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(idempotency_keys).values(key=key, **claim))
+            return None
+        except IntegrityError:
+            pass
+
+        with self.engine.begin() as conn:
+            # Take over a claim whose owner died, or a record past its TTL
+            taken = conn.execute(
+                update(idempotency_keys).where(
+                    idempotency_keys.c.key == key,
+                    or_(
+                        (idempotency_keys.c.state == IN_PROGRESS) & (idempotency_keys.c.locked_until < now),
+                        idempotency_keys.c.expires_at < now
+                    )
+                ).values(response_status=None, response_headers=None, response_body=None, **claim)
+            ).rowcount
+            if taken:
+                return None
+            row = conn.execute(select(idempotency_keys).where(idempotency_keys.c.key == key)).first()
+
+        if row is None:
+            return {"state": IN_PROGRESS, "fingerprint": fingerprint}
+        return {
+            "state": row.state,
+            "fingerprint": row.fingerprint,
+            "status": row.response_status,
+            "headers": row.response_headers,
+            "body": row.response_body
+        }
+
+    def _complete(self, key: str, record: Record):
+        with self.engine.begin() as conn:
+            conn.execute(update(idempotency_keys).where(idempotency_keys.c.key == key).values(
+                state=COMPLETED,
+                response_status=record["status"],
+                response_headers=record["headers"],
+                response_body=record["body"]
+            ))
+            if time.monotonic() - self._last_purge > self.purge_interval:
+                self._last_purge = time.monotonic()
+                conn.execute(delete(idempotency_keys).where(idempotency_keys.c.expires_at < datetime.utcnow()))
+
+    def _release(self, key: str):
+        with self.engine.begin() as conn:
+            conn.execute(delete(idempotency_keys).where(
+                idempotency_keys.c.key == key,
+                idempotency_keys.c.state == IN_PROGRESS
+            ))
+
+    async def claim(self, key: str, fingerprint: str) -> Optional[Record]:
+        return await run_in_threadpool(self._claim, key, fingerprint)
+
+    async def complete(self, key: str, record: Record):
+        await run_in_threadpool(self._complete, key, record)
+
+    async def release(self, key: str):
+        await run_in_threadpool(self._release, key)
+
+    async def close(self):
+        pass
+
+
+class InMemoryIdempotencyStore:
+    """Per-process records for local runs; nothing survives a restart"""
+
+    def __init__(self):
+        self._records: Dict[str, Tuple[float, Record]] = {}
+        self._lock = threading.Lock()
+
+    async def claim(self, key: str, fingerprint: str) -> Optional[Record]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._records.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+            self._records[key] = (now + IDEMPOTENCY_LOCK_TTL, {"state": IN_PROGRESS, "fingerprint": fingerprint})
+            return None
+
+    async def complete(self, key: str, record: Record):
+        with self._lock:
+            self._records[key] = (time.monotonic() + IDEMPOTENCY_TTL, record)
+
+    async def release(self, key: str):
+        with self._lock:
+            self._records.pop(key, None)
+
+    async def close(self):
+        pass
+
+
+def create_idempotency_store(engine: Optional[Engine] = None):
+    """Store selected by IDEMPOTENCY_BACKEND; database needs the service engine"""
+    if IDEMPOTENCY_BACKEND == "memory":
+        return InMemoryIdempotencyStore()
+    if IDEMPOTENCY_BACKEND == "database":
+        return DatabaseIdempotencyStore(engine)
+    return RedisIdempotencyStore()
+
+
+# ==================== MIDDLEWARE ====================
+
+def _fingerprint(scope, body: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in (scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _send_json(send, status_code: int, content: dict, extra_headers: List[Tuple[bytes, bytes]] = ()):
+    body = json.dumps(content).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": status_code, "headers": headers + list(extra_headers)})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    poll_interval = 0.05
+    max_poll_interval = 0.5
+
+    def __init__(
+        self,
+        app,
+        store,
+        routes: Iterable[Tuple[str, str]],
+        namespace: str,
+        router=None,
+        verifier: TokenVerifier = token_verifier
+    ):
+        self.app = app
+        self.store = store
+        self.routes = set(routes)
+        self.namespace = namespace
+        self.router = router
+        self.verifier = verifier
+        # Requests this process is running, so local duplicates wait on a
+        # future instead of polling the store
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in self.routes:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, {"detail": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"})
+            return
+
+        user_id = await self._user_id(headers)
+        if user_id is None:
+            await self.app(scope, receive, send)  # The endpoint answers 401
+            return
+
+        body = await _read_body(receive)
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        fingerprint = _fingerprint(scope, body)
+        key = f"{self.namespace}:{user_id}:{scope['method']}:{scope['path']}:{idempotency_key}"
+
+        try:
+            record = await self._claim(key, fingerprint)
+        except Exception as e:
+            print(f"Idempotency store unavailable, running request without it: {e}")
+            await self.app(scope, replay_receive, send)
+            return
+
+        if record is not None:
+            if record["fingerprint"] != fingerprint:
+                await _send_json(send, 422, {"detail": "Idempotency-Key was already used with a different request"})
+            elif record["state"] != COMPLETED:
+                await _send_json(send, 409, {"detail": "A request with this Idempotency-Key is still in progress"})
+            else:
+                await self._replay(scope, send, record)
+            return
+
+        await self._run(scope, replay_receive, send, key, fingerprint)
+
+    async def _user_id(self, headers: Headers) -> Optional[int]:
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        try:
+            return (await self.verifier.verify(token))["user_id"]
+        except HTTPException:
+            return None
+
+    async def _claim(self, key: str, fingerprint: str) -> Optional[Record]:
+        """Claim key, waiting out a duplicate in progress; returns the record when not claimed"""
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+        interval = self.poll_interval
+        while True:
+            record = await self.store.claim(key, fingerprint)
+            if record is None or record["state"] == COMPLETED or record["fingerprint"] != fingerprint:
+                return record
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return record
+
+            running = self._inflight.get(key)
+            if running is not None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(running), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # Running on another replica
+                await asyncio.sleep(min(interval, remaining))
+                interval = min(interval * 2, self.max_poll_interval)
+
+    async def _run(self, scope, receive, send, key: str, fingerprint: str):
+        status_code = 500
+        response_headers: List[Tuple[bytes, bytes]] = []
+        response_body = bytearray()
+
+        async def send_and_capture(message):
+            nonlocal status_code, response_headers
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response_body.extend(message.get("body", b""))
+            await send(message)
+
+        running = asyncio.get_running_loop().create_future()
+        self._inflight[key] = running
+        finished = False
+        try:
+            await self.app(scope, receive, send_and_capture)
+            finished = True
+        finally:
+            try:
+                if finished and status_code < 500:
+                    await self.store.complete(key, {
+                        "state": COMPLETED,
+                        "fingerprint": fingerprint,
+                        "status": status_code,
+                        "headers": [[name.decode("latin-1"), value.decode("latin-1")] for name, value in response_headers],
+                        "body": bytes(response_body)
+                    })
+                else:
+                    await self.store.release(key)
+            except Exception as e:
+                # The response has gone out; a store failure only costs the replay
+                print(f"Failed to record idempotent response for {key}: {e}")
+            del self._inflight[key]
+            running.set_result(None)
+
+    async def _replay(self, scope, send, record: Record):
+        if self.router is not None:
+            # Label the replay with its route in request metrics
+            for route in self.router.routes:
+                match, child_scope = route.matches(scope)
+                if match == Match.FULL:
+                    scope.update(child_scope)
+                    break
+
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record["headers"]]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": record["body"]})
+
+
+def add_idempotency(app: FastAPI, routes: Iterable[Tuple[str, str]], namespace: str, engine: Optional[Engine] = None):
+    """Honour Idempotency-Key on the given (method, path) routes.
+
+    The middleware goes innermost, so CORS and request metrics still see
+    replayed responses.
+    """
+    store = create_idempotency_store(engine)
+    app.user_middleware.append(Middleware(
+        IdempotencyMiddleware, store=store, routes=routes, namespace=namespace, router=app.router
+    ))
+    add_lifecycle_hooks(app, stop=store.close)
+    return store
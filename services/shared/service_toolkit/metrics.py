@@ -0,0 +1,108 @@
+"""Request count and latency metrics in the Prometheus text format.
+
+MetricsMiddleware is plain ASGI rather than BaseHTTPMiddleware, so it adds
+no extra task or response buffering per request. Requests are labelled
+by route template (``/courses/{course_id}``), not raw path, which keeps
+the number of series bounded.
+
+RequestMetrics is not tied to HTTP serving: services use it for their
+own outbound calls too (e.g. payment gateway requests).
+"""
+import time
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics:
+    """In-process request counter, latency histogram and in-flight gauge.
+
+    Each replica is scraped separately. The counter carries an extra
+    result label (status code, outcome) on top of the shared labels.
+    """
+
+    def __init__(
+        self,
+        prefix: str = "http",
+        labels: Sequence[str] = ("method", "route"),
+        result_label: str = "status",
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.prefix = prefix
+        self.labels = tuple(labels)
+        self.result_label = result_label
+        self.buckets = tuple(buckets)
+        self.in_flight = 0
+        self._requests: Dict[Tuple, int] = {}
+        # labels -> per-bucket counts followed by sum and count
+        self._durations: Dict[Tuple, List[float]] = {}
+
+    def observe(self, labels: Tuple, result, seconds: float):
+        key = labels + (result,)
+        self._requests[key] = self._requests.get(key, 0) + 1
+
+        series = self._durations.get(labels)
+        if series is None:
+            series = self._durations[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                series[i] += 1
+        series[-2] += seconds
+        series[-1] += 1
+
+    def _label_text(self, values: Tuple) -> str:
+        return ",".join(f'{name}="{value}"' for name, value in zip(self.labels + (self.result_label,), values))
+
+    def render(self) -> str:
+        requests = f"{self.prefix}_requests_total"
+        duration = f"{self.prefix}_request_duration_seconds"
+        in_flight = f"{self.prefix}_requests_in_flight"
+
+        lines = [f"# HELP {requests} Requests handled", f"# TYPE {requests} counter"]
+        for key, count in sorted(self._requests.items()):
+            lines.append(f"{requests}{{{self._label_text(key)}}} {count}")
+
+        lines += [f"# HELP {duration} Time to handle a request", f"# TYPE {duration} histogram"]
+        for key, series in sorted(self._durations.items()):
+            labels = self._label_text(key)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{duration}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{duration}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+            lines.append(f"{duration}_sum{{{labels}}} {series[-2]:.6f}")
+            lines.append(f"{duration}_count{{{labels}}} {series[-1]}")
+
+        lines += [
+            f"# HELP {in_flight} Requests currently in progress",
+            f"# TYPE {in_flight} gauge",
+            f"{in_flight} {self.in_flight}"
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        self.metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.in_flight -= 1
+            # The router records the matched route in the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.metrics.observe((scope["method"], route), status_code, time.perf_counter() - started)
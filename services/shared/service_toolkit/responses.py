@@ -0,0 +1,29 @@
+"""JSON response classes backed by orjson.
+
+FastAPI has already run response_model validation and jsonable_encoder
+by the time the default response class renders, so orjson only replaces
+the final json.dumps there. FastJSONResponse is for content that has not
+been through jsonable_encoder (see serialization.list_response): it
+renders datetimes the way Pydantic does, with UTC as "Z".
+
+Without orjson installed the standard JSONResponse is the default and
+FastJSONResponse is None.
+"""
+from typing import Any
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in shared/requirements.txt
+    orjson = None
+
+if orjson is not None:
+    class FastJSONResponse(ORJSONResponse):
+        def render(self, content: Any) -> bytes:
+            return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+    DefaultJSONResponse = ORJSONResponse
+else:  # pragma: no cover
+    FastJSONResponse = None
+    DefaultJSONResponse = JSONResponse
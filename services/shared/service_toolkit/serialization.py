@@ -0,0 +1,78 @@
+"""Fast path for list endpoints that return ORM rows.
+
+With a response_model, FastAPI validates every row into a Pydantic model,
+dumps it back to a dict with jsonable_encoder and only then renders JSON.
+For a page of 100 rows that is most of the request's CPU time.
+
+list_response skips that: the response schema is compiled once into a
+function that reads the schema's fields straight off each row, and
+orjson renders the dicts (datetimes and enums natively). Keep the
+response_model on the route so the OpenAPI schema is unchanged.
+
+Rows are not validated on this path, so only use it where the ORM
+columns already match the schema; scripts/benchmark-serialization.py
+checks that the output is identical to the Pydantic path.
+"""
+import datetime
+import enum
+from functools import lru_cache
+from types import NoneType
+from typing import Callable, Iterable, List, Optional, Type, Union, get_args, get_origin
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+from service_toolkit.responses import FastJSONResponse
+
+Converter = Callable[[object], object]
+
+# Rendered as-is by orjson, with the same output as Pydantic
+_NATIVE_TYPES = (str, int, bool, datetime.datetime, datetime.date)
+
+
+def _converter(annotation) -> Optional[Converter]:
+    """Conversion for one field value, or None if the value passes through"""
+    origin = get_origin(annotation)
+    if origin is Union:
+        args = [arg for arg in get_args(annotation) if arg is not NoneType]
+        if len(args) != 1:
+            raise TypeError(f"Unsupported union for fast serialization: {annotation}")
+        return _converter(args[0])
+    if origin in (list, List):
+        convert = _converter(get_args(annotation)[0])
+        if convert is None:
+            return list
+        return lambda values: [convert(value) for value in values]
+    if isinstance(annotation, type):
+        if issubclass(annotation, BaseModel):
+            return compile_serializer(annotation)
+        if annotation is float:
+            # Pydantic coerces ints and Decimals in float fields
+            return float
+        if issubclass(annotation, (enum.Enum,) + _NATIVE_TYPES):
+            return None
+    raise TypeError(f"Unsupported type for fast serialization: {annotation}")
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(schema: Type[BaseModel]) -> Callable[[object], dict]:
+    """Function turning an ORM object into the dict `schema` would dump"""
+    fields = [(name, _converter(field.annotation)) for name, field in schema.model_fields.items()]
+
+    def serialize(obj) -> dict:
+        data = {}
+        for name, convert in fields:
+            value = getattr(obj, name)
+            data[name] = value if convert is None or value is None else convert(value)
+        return data
+
+    return serialize
+
+
+def list_response(schema: Type[BaseModel], rows: Iterable) -> Response:
+    serialize = compile_serializer(schema)
+    content = [serialize(row) for row in rows]
+    if FastJSONResponse is None:
+        return JSONResponse(content=jsonable_encoder(content))
+    return FastJSONResponse(content=content)